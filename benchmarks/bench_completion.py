@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+prompt_toolkit = pytest.importorskip("prompt_toolkit")
+
+from prompt_toolkit.completion import CompleteEvent  # noqa: E402
+from prompt_toolkit.document import Document  # noqa: E402
+
+from developergpt.interactive import PathCompleter  # noqa: E402
+
+N_ENTRIES = 100_000
+
+
+@pytest.fixture(scope="session")
+def large_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp("large_dir")
+    for i in range(N_ENTRIES):
+        open(os.path.join(path, f"file_{i:06d}.txt"), "w").close()
+    return path
+
+
+@pytest.mark.parametrize(
+    "text", ["ls ", "ls file_09999", "ls no_match"], ids=["all", "prefix", "none"]
+)
+def test_path_completions(benchmark, large_dir, monkeypatch, text):
+    monkeypatch.chdir(large_dir)
+    completer = PathCompleter()
+    document = Document(text, cursor_position=len(text))
+    event = CompleteEvent(completion_requested=True)
+
+    completions = benchmark(lambda: list(completer.get_completions(document, event)))
+    expected = {"ls ": N_ENTRIES, "ls file_09999": 10, "ls no_match": 0}[text]
+    assert len(completions) == expected
@@ -0,0 +1,99 @@
+"""
+Per-turn latency of Hugging Face chats against a local stub of the Inference API,
+with a new client and HTTP session per turn (as before the pooled backend) and with
+the pooled backend. The stub serves plain HTTP, so the measured difference leaves out
+the TLS handshake a new session costs against the real API.
+"""
+
+import io
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from rich.console import Console
+
+huggingface_hub = pytest.importorskip("huggingface_hub")
+
+from developergpt import config, huggingface_adapter  # noqa: E402
+
+MODEL = config.ZEPHYR
+
+
+class StubInferenceAPI(BaseHTTPRequestHandler):
+    """Streams a recorded chat response as text generation server-sent events."""
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+    chunks: list = []
+    connections: set = set()
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        self.connections.add(self.client_address)
+        self.rfile.read(int(self.headers["Content-Length"]))
+        events = b"".join(
+            b"data: "
+            + json.dumps(
+                {
+                    "index": i,
+                    "token": {"id": i, "text": text, "logprob": 0.0, "special": False},
+                    "generated_text": None,
+                    "details": None,
+                }
+            ).encode()
+            + b"\n\n"
+            for i, text in enumerate(self.chunks)
+        )
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(events)))
+        self.end_headers()
+        self.wfile.write(events)
+
+
+@pytest.fixture(scope="module")
+def stub_url(chat_trace):
+    StubInferenceAPI.chunks = chat_trace
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubInferenceAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.fixture
+def stub_model(stub_url, monkeypatch):
+    monkeypatch.setitem(config.HF_MODEL_MAP, MODEL, stub_url)
+    StubInferenceAPI.connections.clear()
+    huggingface_hub.utils.reset_sessions()
+    huggingface_adapter.get_backend.cache_clear()
+
+
+def _chat_turn(backend) -> list:
+    return huggingface_adapter.get_model_chat_response(
+        user_input="How do I undo my last git commit?",
+        console=Console(file=io.StringIO(), width=100, force_terminal=True),
+        input_messages=[],
+        client=backend,
+        temperature=0.7,
+        model=MODEL,
+    )
+
+
+def test_chat_turn_new_client(benchmark, stub_model, chat_trace):
+    def turn():
+        huggingface_hub.utils.reset_sessions()
+        return _chat_turn(huggingface_adapter.HuggingFaceBackend(MODEL, None))
+
+    messages = benchmark(turn)
+    assert messages[-1].startswith("Assistant:")
+
+
+def test_chat_turn_pooled_backend(benchmark, stub_model, chat_trace):
+    messages = benchmark(
+        lambda: _chat_turn(huggingface_adapter.get_backend(MODEL, None))
+    )
+    assert messages[-1].startswith("Assistant:")
+    # every turn reuses the kept-alive connection
+    assert len(StubInferenceAPI.connections) == 1
@@ -0,0 +1,30 @@
+import sqlite3
+
+import pytest
+
+from developergpt.semantic_cache import SemanticCache
+
+RESPONSE = '{"commands": ["find ~/project42 -name \'*.log\' -size +79M"]}'
+
+
+@pytest.fixture(scope="module")
+def large_cache() -> SemanticCache:
+    # tens of thousands of stored requests
+    cache = SemanticCache(sqlite3.connect(":memory:"), threshold=0.8)
+    verbs = ["find", "delete", "list", "count", "compress", "copy", "move", "show"]
+    objects = ["files", "directories", "processes", "logs", "images", "commits"]
+    places = [f"project{i}" for i in range(500)]
+    entries = [
+        (f"{v} all {o} in ~/{p} larger than {i % 97}MB", RESPONSE)
+        for i, (v, o, p) in enumerate(
+            (v, o, p) for p in places for v in verbs for o in objects
+        )
+    ][:20000]
+    cache.add_many(entries, "flash", True)
+    return cache
+
+
+def test_lookup_20k_entries(benchmark, large_cache):
+    query = "find every log in ~/project42 larger than 79MB"
+    similar = benchmark(large_cache.lookup, query, "flash", True)
+    assert similar is not None and similar.response == RESPONSE
@@ -0,0 +1,81 @@
+"""
+Offline generation speed with and without speculative decoding on the few-shot
+command workload. Needs llama.cpp and a downloaded offline model, run it with
+`make bench-offline` (set DEVELOPERGPT_DRAFT_GGUF to also benchmark a draft model).
+"""
+
+import os
+import time
+
+import pytest
+
+if not os.environ.get("DEVELOPERGPT_BENCH_OFFLINE"):
+    pytest.skip("run with make bench-offline", allow_module_level=True)
+
+pytest.importorskip("llama_cpp")
+
+from developergpt import (  # noqa: E402
+    config,
+    few_shot_prompts,
+    grammars,
+    model_manifest,
+    providers,
+    speculative,
+)
+
+MODEL = config.MISTRAL_Q4
+MAX_TOKENS = 512
+
+# command requests whose answers copy paths, flags and JSON keys from the prompt
+REQUESTS = [
+    few_shot_prompts.CONDA_REQUEST,
+    few_shot_prompts.SEARCH_REQUEST,
+    few_shot_prompts.PROCESS_REQUEST,
+    "find all files in ~/Documents larger than 50kB",
+    "rename all .jpeg files in ~/Pictures to .jpg",
+]
+
+DRAFTS = [None, speculative.PROMPT_LOOKUP]
+if os.environ.get("DEVELOPERGPT_DRAFT_GGUF"):
+    DRAFTS.append(os.environ["DEVELOPERGPT_DRAFT_GGUF"])
+
+if model_manifest.resolve(MODEL) is None:
+    pytest.skip(f"{MODEL} is not downloaded", allow_module_level=True)
+
+
+@pytest.fixture(
+    scope="module", params=DRAFTS, ids=lambda d: os.path.basename(d or "none")
+)
+def llm(request):
+    return providers.load_llama(MODEL, draft=request.param)
+
+
+@pytest.mark.parametrize("fast_mode", [False, True], ids=["full", "fast"])
+def test_command_generation(benchmark, llm, fast_mode):
+    base_msgs = (
+        few_shot_prompts.BASE_INPUT_CMD_MSGS_FAST
+        if fast_mode
+        else few_shot_prompts.BASE_INPUT_CMD_MSGS
+    )
+    grammar = grammars.command_grammar(fast_mode)
+    generation = {"tokens": 0, "seconds": 0.0}
+
+    def run_workload():
+        for user_request in REQUESTS:
+            messages = base_msgs + [few_shot_prompts.format_user_request(user_request)]
+            # evaluate the prompt first, only generation is sped up by drafting
+            llm.create_chat_completion(messages=messages, max_tokens=1)
+            start = time.perf_counter()
+            response = llm.create_chat_completion(
+                messages=messages,
+                max_tokens=MAX_TOKENS,
+                temperature=config.CMD_TEMP,
+                grammar=grammar,
+            )
+            generation["seconds"] += time.perf_counter() - start
+            generation["tokens"] += response["usage"]["completion_tokens"]
+
+    benchmark.pedantic(run_workload, rounds=1, iterations=1)
+    tokens_per_second = generation["tokens"] / generation["seconds"]
+    benchmark.extra_info["tokens_per_second"] = round(tokens_per_second, 2)
+    print(f"\n{tokens_per_second:.1f} tokens/s")
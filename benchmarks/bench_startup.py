@@ -0,0 +1,43 @@
+"""
+Import time of `developergpt.cli` in a fresh interpreter, i.e. the startup cost paid by
+every one-shot `cmd` call before the model is even selected.
+"""
+
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# time budget (seconds) for `import developergpt.cli`, exceeded when an eager import of a
+# provider SDK or the interactive UI sneaks back in
+IMPORT_TIME_BUDGET = 0.5
+
+IMPORT_PROBE = """
+import time
+start = time.perf_counter()
+import developergpt.cli
+print(time.perf_counter() - start)
+"""
+
+
+def _import_cli() -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return float(output)
+
+
+def test_cli_import_time(benchmark):
+    # the benchmark includes the interpreter start-up, the budget only the import itself
+    timings = []
+    benchmark.pedantic(lambda: timings.append(_import_cli()), rounds=5, iterations=1)
+    # best run, to reduce noise from a cold filesystem cache
+    elapsed = min(timings)
+    assert (
+        elapsed < IMPORT_TIME_BUDGET
+    ), f"importing developergpt.cli took {elapsed:.3f}s (budget {IMPORT_TIME_BUDGET}s)"
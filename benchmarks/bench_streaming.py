@@ -0,0 +1,83 @@
+import io
+
+from rich.console import Console
+
+from developergpt.streaming import (
+    StopSequenceScanner,
+    StreamingCommands,
+    StreamingMarkdown,
+    stream_chat_response,
+    stream_command_response,
+)
+
+
+def _console() -> Console:
+    return Console(file=io.StringIO(), width=100, force_terminal=True)
+
+
+def test_stream_chat_response(benchmark, chat_trace):
+    text = benchmark(lambda: stream_chat_response(chat_trace, _console()))
+    assert text == "".join(chat_trace)
+
+
+def test_streaming_markdown_refresh_per_chunk(benchmark, chat_trace):
+    # worst case: the live display is refreshed after every chunk
+    console = _console()
+
+    def render_each_chunk():
+        markdown = StreamingMarkdown()
+        for chunk in chat_trace:
+            markdown.append(chunk)
+            console.print(markdown)
+        return markdown.text
+
+    assert benchmark(render_each_chunk) == "".join(chat_trace)
+
+
+def test_streaming_markdown_20k_tokens(benchmark, long_chat_trace):
+    # rich.live.Live redraws a few times per second, not on every chunk
+    console = _console()
+
+    def render_stream():
+        markdown = StreamingMarkdown()
+        for i, chunk in enumerate(long_chat_trace):
+            markdown.append(chunk)
+            if i % 100 == 0:
+                console.render_lines(markdown, console.options)
+        console.render_lines(markdown, console.options)
+        return markdown.text
+
+    text = benchmark.pedantic(render_stream, rounds=3, iterations=1)
+    assert text == "".join(long_chat_trace)
+
+
+def test_stream_command_response(benchmark, cmd_trace):
+    text = benchmark(
+        lambda: stream_command_response(cmd_trace, _console(), fast_mode=False)
+    )
+    assert text == "".join(cmd_trace)
+
+
+def test_streaming_commands_refresh_per_chunk(benchmark, cmd_trace):
+    console = _console()
+
+    def render_each_chunk():
+        view = StreamingCommands(fast_mode=False, panel_width=100)
+        for chunk in cmd_trace:
+            view.append(chunk)
+            console.print(view)
+        return view.commands()
+
+    assert len(benchmark(render_each_chunk)) == 2
+
+
+def test_stop_sequence_scanning(benchmark, chat_trace):
+    # a long answer streamed token by token, without a stop sequence
+    chunks = chat_trace * 20
+
+    def scan():
+        scanner = StopSequenceScanner(["\nUser:", "User:"])
+        shown = "".join(scanner.feed(chunk) for chunk in chunks)
+        return shown + scanner.flush()
+
+    assert benchmark(scan) == "".join(chunks)
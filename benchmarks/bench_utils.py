@@ -0,0 +1,99 @@
+import io
+import json
+
+import pytest
+from rich.console import Console
+
+from developergpt import utils
+
+
+def _chat_history(n_messages: int) -> list:
+    return [
+        {
+            "role": "user" if i % 2 else "assistant",
+            "content": f"message {i}: find all files larger than {i}MB in ~/Documents "
+            * 4,
+        }
+        for i in range(n_messages)
+    ]
+
+
+def _command_response(n_commands: int) -> str:
+    return json.dumps(
+        {
+            "commands": [
+                {
+                    "cmd_to_execute": f"find ~/Documents -size +{i}k -name '*.log' | xargs rm",
+                    "cmd_explanations": [
+                        "`find` searches for files.",
+                        f"`-size +{i}k` matches files larger than {i}kB.",
+                        "`xargs rm` removes the matched files.",
+                    ],
+                    "arg_explanations": {
+                        "-size": "the minimum file size",
+                        "-name": "the file name pattern",
+                    },
+                }
+                for i in range(n_commands)
+            ],
+            "error": 0,
+        }
+    )
+
+
+def test_clean_model_output(benchmark):
+    raw_output = "Sure! Here are the commands:\n```json\n" + _command_response(50)
+    raw_output += "\n```\nLet me know if you need anything else."
+    assert benchmark(utils.clean_model_output, raw_output).startswith("{")
+
+
+@pytest.mark.parametrize("n_messages", [10, 100, 1000])
+def test_count_msg_tokens(benchmark, n_messages):
+    messages = _chat_history(n_messages)
+    assert benchmark(utils.count_msg_tokens, messages, "gpt-3.5-turbo") > n_messages
+
+
+# per-turn cost stays flat as the history grows
+@pytest.mark.parametrize("n_messages", [10, 100, 1000, 5000])
+def test_chat_turn_context_check(benchmark, n_messages):
+    # one chat turn: add the user message, check the context size, add the reply
+    messages = utils.ChatHistory(_chat_history(n_messages), "gpt-3.5-turbo")
+    user_message, reply = _chat_history(2)
+
+    def chat_turn():
+        messages.append(user_message)
+        utils.check_reduce_context(messages, 10**9, "gpt-3.5-turbo", 1)
+        messages.append(reply)
+        messages.pop()
+        messages.pop()
+
+    benchmark(chat_turn)
+    assert len(messages) == n_messages
+
+
+@pytest.mark.parametrize("n_messages", [100, 1000])
+def test_reduce_context(benchmark, n_messages):
+    messages = _chat_history(n_messages)
+    token_limit = utils.count_msg_tokens(messages, "gpt-3.5-turbo") // 2
+
+    def reduce_context():
+        return utils.check_reduce_context(
+            list(messages), token_limit, "gpt-3.5-turbo", 1
+        )
+
+    _, n_tokens = benchmark(reduce_context)
+    assert n_tokens <= token_limit
+
+
+@pytest.mark.parametrize("fast_mode", [False, True])
+def test_print_command_response(benchmark, fast_mode):
+    if fast_mode:
+        model_output = json.dumps(
+            {"commands": [f"ls -la ~/dir{i}" for i in range(200)], "error": 0}
+        )
+    else:
+        model_output = _command_response(200)
+    console = Console(file=io.StringIO(), width=100)
+
+    commands = benchmark(utils.print_command_response, model_output, console, fast_mode)
+    assert len(commands) == 200
@@ -0,0 +1,44 @@
+import json
+import os
+
+import pytest
+import tiktoken
+
+from developergpt import utils
+
+TRACES_DIR = os.path.join(os.path.dirname(__file__), "traces")
+
+# byte-level encoding built in-process, the real encodings are downloaded on first use
+BYTE_ENCODING = tiktoken.Encoding(
+    name="bytes",
+    pat_str=r"\S+|\s+",
+    mergeable_ranks={bytes([i]): i for i in range(256)},
+    special_tokens={},
+)
+
+
+@pytest.fixture(autouse=True)
+def offline_encoding(monkeypatch):
+    monkeypatch.setattr(utils, "get_encoding", lambda model: BYTE_ENCODING)
+
+
+def load_trace(name: str) -> list:
+    """Streamed text chunks of a response, in the order the provider sent them."""
+    with open(os.path.join(TRACES_DIR, name)) as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="session")
+def chat_trace() -> list:
+    return load_trace("chat_response.json")
+
+
+@pytest.fixture(scope="session")
+def long_chat_trace() -> list:
+    # a long, code-heavy answer streamed as 20k token-sized chunks
+    return load_trace("long_chat_response.json")
+
+
+@pytest.fixture(scope="session")
+def cmd_trace() -> list:
+    return load_trace("cmd_response.json")
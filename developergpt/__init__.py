@@ -0,0 +1,4 @@
+import time
+
+# start of the developergpt imports, the first phase reported by `--profile`
+IMPORT_START = time.perf_counter()
@@ -0,0 +1,201 @@
+"""
+DeveloperGPT by luo-anthony
+
+Asyncio runtime for provider requests.
+
+One event loop runs in a background thread for the lifetime of the process. Provider
+clients are async and long-lived: each provider gets a single pooled HTTP client, built
+with the SDK's own httpx client class (keep-alive, HTTP/2 when the `h2` package is
+installed), that is reused across chat turns and `cmd` revisions. The synchronous CLI
+calls into the loop with run() and iterate(), and warm_up() opens and TLS-handshakes a
+provider connection in the background while the user is still typing.
+"""
+
+import asyncio
+import atexit
+import importlib.util
+import sys
+import threading
+from concurrent.futures import CancelledError, Future
+from typing import (
+    Any,
+    AsyncIterable,
+    Awaitable,
+    Iterable,
+    Iterator,
+    Optional,
+    TypeVar,
+)
+
+from developergpt import config
+
+T = TypeVar("T")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_lock = threading.Lock()
+_http_clients: dict = {}
+_local = threading.local()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """The background event loop, started on first use."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever, name="developergpt-aio", daemon=True
+            ).start()
+            atexit.register(_shutdown, loop)
+            _loop = loop
+    return _loop
+
+
+class CancelScope:
+    """
+    Cancels the requests a thread runs on the background loop, e.g. a losing `--race` request.
+    Requests that don't run on the loop (offline models) only stop at their next streamed
+    token, see cancellable().
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._futures: set = set()
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "CancelScope":
+        _local.scope = self
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        _local.scope = None
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            futures = list(self._futures)
+        for future in futures:
+            future.cancel()  # cancels the task on the loop
+
+    def _add(self, future: Future) -> None:
+        with self._lock:
+            self._futures.add(future)
+            if self.cancelled:
+                future.cancel()
+
+    def _discard(self, future: Future) -> None:
+        with self._lock:
+            self._futures.discard(future)
+
+
+def run(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """Run a coroutine on the background loop and wait for its result."""
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())  # type: ignore
+    scope: Optional[CancelScope] = getattr(_local, "scope", None)
+    if scope is None:
+        return future.result(timeout)
+    scope._add(future)
+    try:
+        return future.result(timeout)
+    finally:
+        scope._discard(future)
+
+
+def submit(coro: Awaitable[Any]) -> Future:
+    """Schedule a coroutine on the background loop without waiting for it."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())  # type: ignore
+
+
+def iterate(aiterable: AsyncIterable[T]) -> Iterator[T]:
+    """Iterate an async iterable (e.g. a streamed response) from synchronous code."""
+    iterator = aiterable.__aiter__()
+    while True:
+        try:
+            yield run(iterator.__anext__())
+        except StopAsyncIteration:
+            return
+
+
+def cancellable(stream: Iterable[T]) -> Iterator[T]:
+    """
+    Iterate a synchronous stream (e.g. the tokens of an offline model) until the thread's
+    cancel scope is cancelled, then close it and raise CancelledError.
+    """
+    scope: Optional[CancelScope] = getattr(_local, "scope", None)
+    for item in stream:
+        if scope is not None and scope.cancelled:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()  # stops generating
+            raise CancelledError()
+        yield item
+
+
+def http_client(provider: str, client_class: Optional[type]) -> Any:
+    """
+    The pooled HTTP client shared by all requests to a provider.
+
+    Args:
+        provider (str): The provider name (see developergpt.providers).
+        client_class (Optional[type]): The provider SDK's default httpx AsyncClient class
+            (e.g. openai.DefaultAsyncHttpxClient), so the pool is built on the httpx the SDK uses.
+
+    Returns:
+        Any: The provider's long-lived HTTP client, or None if the SDK has no default httpx
+            client class (then the SDK creates its own client).
+    """
+    if client_class is None:
+        return None
+    httpx = _httpx_module(client_class)
+
+    with _lock:
+        if provider not in _http_clients:
+            _http_clients[provider] = client_class(
+                # HTTP/2 needs the optional h2 package (pip install h2)
+                http2=importlib.util.find_spec("h2") is not None,
+                timeout=httpx.Timeout(
+                    config.HTTP_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT
+                ),
+                limits=httpx.Limits(
+                    max_connections=config.HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=config.HTTP_MAX_CONNECTIONS,
+                    keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+                ),
+            )
+        return _http_clients[provider]
+
+
+def _httpx_module(client_class: type) -> Any:
+    # the httpx (or httpx fork) package whose AsyncClient the SDK's client class extends
+    for base in client_class.__mro__:
+        module = sys.modules.get(base.__module__.partition(".")[0])
+        if base.__name__ == "AsyncClient" and hasattr(module, "Limits"):
+            return module
+    raise TypeError(f"{client_class.__name__} is not an httpx AsyncClient")
+
+
+def warm_up(client: Any, url: str) -> Optional[Future]:
+    """Open (or refresh) a pooled connection of an HTTP client in the background."""
+    if client is None:
+        return None
+    return submit(_warm_up(client, url))
+
+
+async def _warm_up(client: Any, url: str) -> None:
+    try:
+        # any response means the TLS connection is established and kept in the pool
+        await client.head(url)
+    except Exception:
+        pass  # only a missed optimization, the actual request reports errors
+
+
+def _shutdown(loop: asyncio.AbstractEventLoop) -> None:
+    async def close_clients():
+        for client in list(_http_clients.values()):
+            await client.aclose()
+
+    try:
+        asyncio.run_coroutine_threadsafe(close_clients(), loop).result(timeout=1)
+    except Exception:
+        pass
+    loop.call_soon_threadsafe(loop.stop)
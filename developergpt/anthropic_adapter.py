@@ -2,27 +2,35 @@
 DeveloperGPT by luo-anthony
 """
 
+import math
 import sys
-from typing import Optional
+import threading
+from collections import Counter
+from typing import Iterable, Iterator, Optional
 
 import anthropic._exceptions as anthropic_exceptions
-from anthropic import Anthropic
+from anthropic import AsyncAnthropic
 from rich.console import Console
-from rich.live import Live
-from rich.markdown import Markdown
-from rich.panel import Panel
 
-from developergpt import config, utils
+from developergpt import (
+    aio,
+    config,
+    json_repair,
+    profiling,
+    streaming,
+    tokenizers,
+    utils,
+)
 from developergpt.few_shot_prompts import (
+    BASE_INPUT_CMD_MSGS,
+    BASE_INPUT_CMD_MSGS_FAST,
     CHAT_SYS_MSG,
     CMD_SYS_MSG,
     INITIAL_USER_CMD_MSG,
     INITIAL_USER_CMD_MSG_FAST,
-)
-from developergpt.openai_adapter import (
-    BASE_INPUT_CMD_MSGS,
-    BASE_INPUT_CMD_MSGS_FAST,
+    SUMMARY_SYS_MSG,
     format_assistant_response,
+    format_summary_request,
     format_user_request,
 )
 
@@ -34,7 +42,7 @@ def get_model_chat_response(
     input_messages: list,
     temperature: float,
     model: str,
-    client: Anthropic,
+    client: AsyncAnthropic,
 ) -> list:
     """
     Get the chat response from the model.
@@ -45,7 +53,7 @@ def get_model_chat_response(
         input_messages (list): The list of input messages exchanged between the user and the model.
         temperature (float): The temperature parameter for controlling the randomness of the model's output.
         model (str): The name of the model to use for generating the response.
-        client (Anthropic): The client object for making API requests to the model.
+        client (AsyncAnthropic): The client object for making API requests to the model.
 
     Returns:
         list: The updated list of input messages, including the generated response.
@@ -53,40 +61,37 @@ def get_model_chat_response(
     MAX_TOKENS = 3800
     RESERVED_OUTPUT_TOKENS = 1024
     MAX_INPUT_TOKENS = MAX_TOKENS - RESERVED_OUTPUT_TOKENS
-    # Note:  use OpenAI gpt-4-turbo token counts as rough estimate
+    # Note: gpt-4-turbo token counts calibrated with the usage reported by Anthropic
+    tokenizer = tokenizers.chat_tokenizer(model, client)
+    n_system_tokens = math.ceil(tokenizer.count(CHAT_SYS_MSG) * tokenizer.scale)
     input_messages.append({"role": "user", "content": user_input})
     input_messages, n_input_tokens = utils.check_reduce_context(
-        input_messages, MAX_INPUT_TOKENS, "gpt-4-turbo", ctx_removal_index=1
+        input_messages,
+        MAX_INPUT_TOKENS - n_system_tokens,
+        tokenizer,
+        ctx_removal_index=1,
     )
+    n_input_tokens += n_system_tokens
     n_output_tokens = max(RESERVED_OUTPUT_TOKENS, MAX_TOKENS - n_input_tokens)
     model_name = config.ANTHROPIC_MODEL_MAP[model]
+    usage: dict = {}
     try:
         """Get the response from the model."""
-        stream = client.messages.create(
-            model=model_name,
-            messages=input_messages,
-            max_tokens=n_output_tokens,
-            temperature=temperature,
-            system=CHAT_SYS_MSG,
-            stream=True,
-        )
-        collected_messages = []
-        panel_width = min(console.width, config.DEFAULT_COLUMN_WIDTH)
-        output_panel = Panel(
-            "",
-            title="[bold blue]DeveloperGPT[/bold blue]",
-            title_align="left",
-            width=panel_width,
+        with profiling.span("anthropic request"):
+            stream = aio.run(
+                client.messages.create(
+                    model=model_name,
+                    messages=input_messages,
+                    max_tokens=n_output_tokens,
+                    temperature=temperature,
+                    system=CHAT_SYS_MSG,
+                    stream=True,
+                )
+            )
+        full_response = streaming.stream_chat_response(
+            _event_texts(aio.iterate(stream), usage), console
         )
-        with Live(output_panel, refresh_per_second=4):
-            for event in stream:
-                if event.type == "content_block_delta":
-                    collected_messages.append(event.delta.text)
-                    output_panel.renderable = Markdown(
-                        "".join(collected_messages), inline_code_theme="monokai"
-                    )
-
-        full_response = "".join(collected_messages)
+        tokenizer.observe(n_input_tokens, usage.get("input_tokens"))
         input_messages.append(format_assistant_response(full_response))
         return input_messages
     except anthropic_exceptions.AnthropicError as e:
@@ -94,6 +99,48 @@ def get_model_chat_response(
         sys.exit(-1)
 
 
+def _event_texts(events: Iterable, usage: dict) -> Iterator[str]:
+    """Text of streamed message events, recording the usage sent with the message start."""
+    for event in events:
+        if event.type == "message_start":
+            usage["input_tokens"] = event.message.usage.input_tokens
+        elif event.type == "content_block_delta":
+            yield event.delta.text
+
+
+def summarize_conversation(
+    *,
+    transcript: str,
+    client: AsyncAnthropic,
+    model: str,
+    cancel: threading.Event,
+) -> Optional[str]:
+    """
+    Summarize old chat turns for context compaction (runs in a background thread).
+
+    Args:
+        transcript (str): The chat turns to summarize.
+        client (AsyncAnthropic): The client object for making API requests to the model.
+        model (str): The chat model, chats are summarized by the cheapest Anthropic model.
+        cancel (threading.Event): Set when the summary is no longer wanted.
+
+    Returns:
+        Optional[str]: The summary, or None if cancelled.
+    """
+    response = aio.run(
+        client.messages.create(
+            model=config.ANTHROPIC_MODEL_MAP[config.HAIKU],
+            messages=[{"role": "user", "content": format_summary_request(transcript)}],
+            max_tokens=config.SUMMARY_MAX_TOKENS,
+            temperature=0.0,
+            system=SUMMARY_SYS_MSG,
+        )
+    )
+    if cancel.is_set():
+        return None
+    return "".join(block.text for block in response.content if block.type == "text")
+
+
 BASE_ANTHROPIC_MSGS = [
     {"role": "user", "content": INITIAL_USER_CMD_MSG},
     {"role": "assistant", "content": "Understood!"},
@@ -111,7 +158,8 @@ def model_command(
     console: Console,
     fast_mode: bool,
     model: str,
-    client: Anthropic,
+    client: AsyncAnthropic,
+    outcomes: Optional[Counter] = None,
 ) -> Optional[str]:
     """
     Get command suggestion from model.
@@ -121,7 +169,8 @@ def model_command(
         console (Console): The console object for displaying status messages.
         fast_mode (bool): Flag indicating whether to use fast mode.
         model (str): The model to use for generating the response.
-        client (Anthropic): The client object for making API requests.
+        client (AsyncAnthropic): The client object for making API requests.
+        outcomes (Optional[Counter]): Counts how the command JSON was resolved (see json_repair).
 
     Returns:
         Optional[str]: The model's response as a string, or None if there is no response.
@@ -143,17 +192,32 @@ def model_command(
 
     model_name = config.ANTHROPIC_MODEL_MAP[model]
     try:
-        with console.status("[bold blue]Decoding request") as _:
-            response = client.messages.create(
-                model=model_name,
-                messages=input_messages,  # type: ignore
-                max_tokens=n_output_tokens,
-                temperature=config.CMD_TEMP,
-                system=CMD_SYS_MSG,
+        with profiling.span("anthropic request"):
+            stream = aio.run(
+                client.messages.create(
+                    model=model_name,
+                    messages=input_messages,  # type: ignore
+                    max_tokens=n_output_tokens,
+                    temperature=config.CMD_TEMP,
+                    system=CMD_SYS_MSG,
+                    stream=True,
+                )
             )
+        raw_output = streaming.stream_command_response(
+            (
+                event.delta.text
+                for event in aio.iterate(stream)
+                if event.type == "content_block_delta"
+            ),
+            console,
+            fast_mode,
+        )
     except anthropic_exceptions.AnthropicError as e:
         console.log(f"[bold red] Anthropic API Error: {e}[/bold red]")
         sys.exit(-1)
 
-    raw_output = response.content[0].text
-    return utils.clean_model_output(raw_output) if raw_output else None
+    return (
+        json_repair.resolve_command_output(raw_output, fast_mode, outcomes=outcomes)
+        if raw_output
+        else None
+    )
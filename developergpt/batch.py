@@ -0,0 +1,109 @@
+"""
+DeveloperGPT by luo-anthony
+
+Batch `cmd` mode (`cmd --batch requests.txt`): many command requests through one
+process, with a bounded number of concurrent requests and a per-provider request
+rate limit. Results are JSON lines with the parsed command JSON and timings.
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from developergpt import utils
+
+
+def read_requests(lines: Iterable[str]) -> List[str]:
+    """One request per line, skipping blank lines and # comments."""
+    requests = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            requests.append(line)
+    return requests
+
+
+class RateLimiter:
+    """Spaces out requests to at most requests_per_minute, shared by all threads."""
+
+    def __init__(self, requests_per_minute: float):
+        self.interval = 60 / requests_per_minute
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Wait for the next free request slot. Returns the seconds waited."""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        wait = slot - now
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+def run_batch(
+    requests: List[str],
+    get_output: Callable[[str], Optional[str]],
+    *,
+    concurrency: int,
+    ordered: bool = True,
+) -> Iterator[dict]:
+    """
+    Get command suggestions for many requests concurrently.
+
+    Args:
+        requests (List[str]): The natural language command requests.
+        get_output (Callable[[str], Optional[str]]): Returns the model output for a request (called from worker threads).
+        concurrency (int): Maximum number of requests in flight.
+        ordered (bool): Yield results in request order instead of as soon as they complete.
+
+    Returns:
+        Iterator[dict]: One result per request with the parsed command JSON (or an error) and timings.
+    """
+    batch_start = time.perf_counter()
+    results: dict = {}
+    done = threading.Condition()
+
+    def process(index: int, request: str) -> None:
+        start = time.perf_counter()
+        error = None
+        try:
+            output = get_output(request)
+        except BaseException as e:
+            # adapters exit on API errors, only this request fails
+            output = None
+            error = str(e) or type(e).__name__
+        end = time.perf_counter()
+
+        result = {"index": index, "request": request, "response": None}
+        if utils.is_valid_command_response(output):
+            result["response"] = json.loads(output)  # type: ignore
+        else:
+            result["error"] = error or "no valid command response"
+        result["timings"] = {
+            "start": round(start - batch_start, 3),
+            "seconds": round(end - start, 3),
+        }
+        with done:
+            results[index] = result
+            done.notify()
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, concurrency), thread_name_prefix="batch"
+    ) as executor:
+        for index, request in enumerate(requests):
+            executor.submit(process, index, request)
+
+        next_index = 0
+        while next_index < len(requests):
+            with done:
+                while not results or (ordered and next_index not in results):
+                    done.wait()
+                key = next_index if ordered else next(iter(results))
+                result = results.pop(key)
+            next_index += 1
+            yield result
@@ -2,34 +2,78 @@
 DeveloperGPT by luo-anthony
 """
 
+import atexit
+import functools
+import json
 import os
 import subprocess
 import sys
-from typing import Optional
+import threading
+import time
+from collections import Counter
+from typing import Any, List, Optional
 
 import click
-import google.generativeai as genai
-import inquirer
-from anthropic import Anthropic
-from google.generativeai import GenerativeModel
-from llama_cpp import Llama
-from openai import OpenAI
-from prompt_toolkit import PromptSession
-from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
-from prompt_toolkit.shortcuts import CompleteStyle
 from rich.console import Console
 
 from developergpt import (
-    anthropic_adapter,
+    batch,
+    compaction,
     config,
-    gemini_adapter,
-    huggingface_adapter,
-    openai_adapter,
+    daemon,
+    json_repair,
+    model_manifest,
+    preflight,
+    profiling,
+    providers,
+    race,
+    sessions,
+    speculative,
+    tuning,
     utils,
 )
+from developergpt.response_cache import ResponseCache
+from developergpt.semantic_cache import SemanticCache
+
+# NOTE: provider SDKs, llama.cpp and the interactive UI (prompt_toolkit, inquirer) are
+# imported lazily via developergpt.providers / developergpt.interactive to keep startup fast
 
 console: Console = Console()
-session: PromptSession = PromptSession()
+
+# commands that only use local state and don't need a model client
+LOCAL_COMMANDS = {"cache", "daemon", "models", "race-stats", "sessions", "tune"}
+
+
+def load_interactive(pending_history: list):
+    """Import the interactive terminal UI and add any command line input to its prompt history."""
+    with profiling.span("import interactive UI"):
+        from developergpt import interactive
+
+    while pending_history:
+        interactive.add_history(pending_history.pop(0))
+    return interactive
+
+
+def report_profile(profile_output: Optional[str]) -> None:
+    """Print the profiled phases (and export them) when the process exits."""
+    # stderr keeps the profile out of piped output (e.g. cmd --batch)
+    profiling.print_summary(Console(stderr=True))
+    if profile_output:
+        profiling.export_chrome_trace(profile_output)
+        Console(stderr=True).print(f"[gray]Wrote the trace to {profile_output}[/gray]")
+
+
+def normalize_model_name(model: str) -> str:
+    return model.lower().strip().replace(".", "")
+
+
+def check_supported_model(model: str) -> None:
+    if model not in config.SUPPORTED_MODELS:
+        console.print(
+            f"""[bold red]LLM {model} is not supported. """
+            f"""Supported LLMs: {", ".join(config.SUPPORTED_MODELS)}[/bold red]"""
+        )
+        sys.exit(-1)
 
 
 @click.group()
@@ -49,164 +93,507 @@ session: PromptSession = PromptSession()
     default=False,
     help=f"Use DeveloperGPT with a quantized LLM running on-device (offline). Options: {', '.join(config.OFFLINE_MODELS)}",
 )
+@click.option(
+    "--draft",
+    default=None,
+    help=f"Speculative decoding for offline models: '{speculative.PROMPT_LOOKUP}' (drafts tokens from the prompt) or the path of a small GGUF model with the same vocabulary",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    default=False,
+    help="Print how long each phase (imports, preflight, requests, generation, rendering) took",
+)
+@click.option(
+    "--profile-output",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="Write the profiled phases to a Chrome trace file (open in ui.perfetto.dev), implies --profile",
+)
 @click.pass_context
-def main(ctx, temperature: float, model: str, offline: bool):
-    model = model.lower().strip().replace(".", "")
+def main(
+    ctx,
+    temperature: float,
+    model: str,
+    offline: bool,
+    draft: Optional[str],
+    profile: bool,
+    profile_output: Optional[str],
+):
+    if profile or profile_output:
+        profiling.enable()
+        atexit.register(report_profile, profile_output)
+    model = normalize_model_name(model)
     if offline and model not in config.OFFLINE_MODELS:
         model = config.MISTRAL_Q6  # default to mistral 6 bit quantization if offline
 
-    if model not in config.SUPPORTED_MODELS:
+    check_supported_model(model)
+    if draft is not None and not speculative.is_valid_draft(draft):
         console.print(
-            f"""[bold red]LLM {model} is not supported. """
-            f"""Supported LLMs: {", ".join(config.SUPPORTED_MODELS)}[/bold red]"""
+            f"[bold red]--draft must be '{speculative.PROMPT_LOOKUP}' or the path of a GGUF model[/bold red]"
         )
         sys.exit(-1)
-    internet_conn = utils.check_connectivity()
-    if model not in config.OFFLINE_MODELS and not internet_conn:
+    ctx.ensure_object(dict)
+    ctx.obj["model"] = model
+    ctx.obj["draft"] = draft
+    if ctx.invoked_subcommand in LOCAL_COMMANDS:
+        return
+
+    # connectivity, API key validation and offline model loading run concurrently
+    with profiling.span("preflight"):
+        client: Any = preflight.run(model, console, draft=draft)
+
+    ctx.obj["temperature"] = temperature
+    ctx.obj["offline"] = offline
+    ctx.obj["client"] = client
+
+
+def open_chat_log(
+    model: str, session_name: Optional[str], resume: Optional[str]
+) -> Optional[sessions.ChatLog]:
+    """The log of the chat session to save to (--session) or to continue (--resume)."""
+    if session_name and resume:
+        console.print("[bold red]Use either --session or --resume[/bold red]")
+        sys.exit(-1)
+    name = session_name or resume
+    if name is None:
+        return None
+    if not sessions.is_valid_name(name):
         console.print(
-            """[bold red]No internet connection. """
-            """Please check your internet connection or use --offline mode.[/bold red]"""
+            "[bold red]Session names may only contain letters, digits, '_', '-' and '.'[/bold red]"
         )
         sys.exit(-1)
 
-    ctx.ensure_object(dict)
-    client: Optional[OpenAI | Llama | Anthropic] = None
-    if offline or model in config.OFFLINE_MODELS:
+    chat_log = sessions.ChatLog(name)
+    if resume and not chat_log.exists():
         console.print(
-            f"""[bold yellow]Using quantized {' '.join(config.LLAMA_CPP_MODEL_MAP[model])} running on-device (offline)."""
-        )
-        repo, llm_file, chat_format = config.LLAMA_CPP_MODEL_MAP[model]
-        common_llama_args = {
-            "n_ctx": config.OFFLINE_MODEL_CTX,
-            "verbose": False,
-            "chat_format": chat_format,
-        }
-        if internet_conn:
-            client = Llama.from_pretrained(
-                repo_id=repo,
-                filename=llm_file,
-                local_dir=config.OFFLINE_MODEL_CACHE_DIR,
-                local_dir_use_symlinks=True,
-                n_threads=8,
-                **common_llama_args,  # type: ignore
-            )
-        else:
-            model_path = os.path.join(config.OFFLINE_MODEL_CACHE_DIR, llm_file)
-            if not os.path.exists(model_path):
-                console.print(
-                    f"""[bold red]No internet connection and model not found locally at {model_path}. """
-                    """Please download the model first when on internet using --offline.[/bold red]"""
-                )
-                sys.exit(-1)
-            client = Llama(
-                model_path=model_path,
-                n_threads=8,
-                **common_llama_args,  # type: ignore
-            )
-    elif model in config.OPENAI_MODEL_MAP:
-        client = OpenAI(api_key=config.get_environ_key(config.OPEN_AI_API_KEY, console))
-        openai_adapter.check_open_ai_key(console, client)
-        console.print(f"[bold yellow]Using OpenAI {config.OPENAI_MODEL_MAP[model]}.")
-    elif model in config.HF_MODEL_MAP:
-        ctx.obj["api_key"] = config.get_environ_key_optional(
-            config.HUGGING_FACE_API_KEY, console
+            f"[bold red]No chat session named {name}, see developergpt sessions[/bold red]"
         )
+        sys.exit(-1)
+    if not chat_log.exists():
+        chat_log.create(model)
+    elif chat_log.header()["model"] != model:
         console.print(
-            f"[bold yellow]Using {config.HF_MODEL_MAP[model]} via Hugging Face Inference API."
+            f"""[bold red]Chat session {name} was created with {chat_log.header()["model"]}, """
+            f"""use --model {chat_log.header()["model"]} to continue it[/bold red]"""
         )
-    elif model in config.GOOGLE_MODEL_MAP:
-        api_key = config.get_environ_key(config.GOOGLE_API_KEY, console)
-        genai.configure(api_key=api_key)
-    elif model in config.ANTHROPIC_MODEL_MAP:
-        api_key = config.get_environ_key(config.ANTHROPIC_API_KEY, console)
-        client = Anthropic(api_key=api_key)
-
-    ctx.obj["temperature"] = temperature
-    ctx.obj["model"] = model
-    ctx.obj["offline"] = offline
-    ctx.obj["client"] = client
+        sys.exit(-1)
+    return chat_log
 
 
 @main.command(help="Chat with DeveloperGPT")
 @click.pass_context
 @click.argument("user_input", nargs=-1)
-def chat(ctx, user_input):
+@click.option(
+    "--session",
+    "session_name",
+    default=None,
+    help="Save the chat as a named session that can be continued with --resume",
+)
+@click.option(
+    "--resume",
+    default=None,
+    help="Continue a saved chat session",
+)
+def chat(ctx, user_input, session_name, resume):
     """
     Chat with LLMs in Terminal
     """
     if user_input:
         user_input = str(" ".join(user_input))
-        session.history.append_string(user_input)
+    interactive = load_interactive([user_input] if user_input else [])
 
     model = ctx.obj["model"]
+    chat_log = open_chat_log(model, session_name, resume)
+    history = (
+        chat_log.recent(config.SESSION_RESUME_MESSAGES) if chat_log is not None else []
+    )
+    adapter = providers.load_adapter(model)
     input_messages = []
 
     if model in config.OPENAI_MODEL_MAP or model in config.LLAMA_CPP_MODEL_MAP:
-        input_messages = [openai_adapter.INITIAL_CHAT_SYSTEM_MSG]
+        from developergpt.few_shot_prompts import INITIAL_CHAT_SYSTEM_MSG
+
+        input_messages = [INITIAL_CHAT_SYSTEM_MSG] + history
     elif model in config.HF_MODEL_MAP:
         instruct_model = model in config.HF_INSTRUCT_MODELS
         if instruct_model:
-            input_messages = []
+            input_messages = history
         else:
-            input_messages = huggingface_adapter.BASE_INPUT_CHAT_MSGS
+            input_messages = adapter.BASE_INPUT_CHAT_MSGS + history
     elif model in config.GOOGLE_MODEL_MAP:
-        gemini_model = GenerativeModel(config.GOOGLE_MODEL_MAP[model])
-        chat_session = gemini_model.start_chat()
+        chat_session = adapter.start_chat_session(model, history)
     elif model in config.ANTHROPIC_MODEL_MAP:
-        input_messages = []
+        input_messages = history
     else:
         return
 
+    # the evaluated history of offline models is restored instead of evaluated again
+    session_state = sessions.session_state(chat_log, ctx.obj["client"], model)
+    if session_state is not None and history:
+        with profiling.span("restore session state"):
+            session_state.restore()
+    if history:
+        console.print(
+            f"[gray]Resumed {chat_log.name} with the last {len(history)} messages[/gray]"
+        )
+    # old turns are summarized in the background instead of dropped
+    compactor = compaction.create_compactor(model, ctx.obj["client"])
+
     console.print("[gray]Type 'quit' to exit the chat[/gray]")
-    while True:
-        if not user_input:
-            user_input = utils.prompt_user_input(
-                "Chat: ", session, console, auto_suggest=AutoSuggestFromHistory()
-            )
+    try:
+        while True:
+            if not user_input:
+                # connect to the provider while the user is typing
+                providers.warm_up(model)
+                user_input = interactive.prompt_chat_input(console)
 
-        if not user_input:
+            if not user_input:
+                continue
+
+            if compactor is not None and compactor.due(input_messages):
+                # offline chats are summarized by the chat model, before its next request
+                with console.status("[bold blue]Summarizing old messages[/bold blue]"):
+                    input_messages = compactor.before_request(input_messages)
+            elif compactor is not None:
+                input_messages = compactor.before_request(input_messages)
+            with profiling.span("chat response"):
+                if (
+                    model in config.OPENAI_MODEL_MAP
+                    or model in config.LLAMA_CPP_MODEL_MAP
+                ):
+                    # llama.cpp models are OpenAI API drop-in compatible
+                    client = ctx.obj["client"]
+                    input_messages = adapter.get_model_chat_response(
+                        user_input=user_input,
+                        console=console,
+                        input_messages=input_messages,
+                        temperature=ctx.obj["temperature"],
+                        model=model,
+                        client=client,
+                    )
+                elif model in config.HF_MODEL_MAP:
+                    input_messages = adapter.get_model_chat_response(
+                        user_input=user_input,
+                        console=console,
+                        input_messages=input_messages,
+                        client=ctx.obj["client"],
+                        temperature=ctx.obj["temperature"],
+                        model=model,
+                    )
+                elif model in config.GOOGLE_MODEL_MAP:
+                    adapter.get_model_chat_response(
+                        user_input=user_input,
+                        console=console,
+                        chat_session=chat_session,
+                        temperature=ctx.obj["temperature"],
+                        model=model,
+                    )
+                elif model in config.ANTHROPIC_MODEL_MAP:
+                    client = ctx.obj["client"]
+                    input_messages = adapter.get_model_chat_response(
+                        user_input=user_input,
+                        console=console,
+                        input_messages=input_messages,
+                        temperature=ctx.obj["temperature"],
+                        model=model,
+                        client=client,
+                    )
+
+            if chat_log is not None:
+                # each turn adds a user and an assistant message
+                chat_log.append(
+                    adapter.history_messages(chat_session)[-2:]
+                    if model in config.GOOGLE_MODEL_MAP
+                    else input_messages[-2:]
+                )
+            if compactor is not None:
+                compactor.after_turn(input_messages)
+            user_input = None
+    finally:
+        if compactor is not None:
+            compactor.close()
+        if session_state is not None:
+            with console.status("[bold blue]Saving the chat session[/bold blue]"):
+                session_state.save()
+
+
+def model_command(
+    ctx,
+    *,
+    user_input: str,
+    console: Console,
+    fast_mode: bool,
+    model: Optional[str] = None,
+    client: Any = None,
+    outcomes: Optional[Counter] = None,
+):
+    """
+    Get a command suggestion from the selected model (or the given model and client).
+
+    `outcomes` counts how the command JSON was resolved (see json_repair).
+    """
+    if model is None:
+        model, client = ctx.obj["model"], ctx.obj["client"]
+    adapter = providers.load_adapter(model)
+    if model in config.OPENAI_MODEL_MAP or model in config.LLAMA_CPP_MODEL_MAP:
+        # llama.cpp models are OpenAI API drop-in compatible
+        return adapter.model_command(
+            user_input=user_input,
+            console=console,
+            fast_mode=fast_mode,
+            model=model,
+            client=client,
+            outcomes=outcomes,
+        )
+    elif model in config.HF_MODEL_MAP:
+        return adapter.model_command(
+            user_input=user_input,
+            console=console,
+            client=client,
+            fast_mode=fast_mode,
+            model=model,
+            outcomes=outcomes,
+        )
+    elif model in config.GOOGLE_MODEL_MAP:
+        return adapter.model_command(
+            user_input=user_input,
+            console=console,
+            fast_mode=fast_mode,
+            model=model,
+            outcomes=outcomes,
+        )
+    elif model in config.ANTHROPIC_MODEL_MAP:
+        return adapter.model_command(
+            user_input=user_input,
+            console=console,
+            fast_mode=fast_mode,
+            model=model,
+            client=client,
+            outcomes=outcomes,
+        )
+    return None
+
+
+def refresh_cached_command(ctx, *, user_input: str, fast_mode: bool) -> None:
+    """Fetch a fresh response for a stale cache entry (runs in a background thread)."""
+    outcomes: Counter = Counter()
+    model_output = model_command(
+        ctx,
+        user_input=user_input,
+        console=Console(quiet=True),
+        fast_mode=fast_mode,
+        outcomes=outcomes,
+    )
+    # sqlite connections can't be shared across threads
+    cache = ResponseCache()
+    if utils.is_valid_command_response(model_output):
+        cache.put(user_input, ctx.obj["model"], fast_mode, model_output)
+        SemanticCache(cache.db).add(
+            user_input, ctx.obj["model"], fast_mode, model_output
+        )
+    record_outcomes(cache, outcomes)
+    cache.close()
+
+
+def record_outcomes(cache: ResponseCache, outcomes: Counter) -> None:
+    """Add the command JSON outcomes (see json_repair) to the response cache stats."""
+    for name, n in outcomes.items():
+        cache.count(name, n)
+
+
+def get_command_response(
+    ctx,
+    *,
+    user_input: str,
+    fast_mode: bool,
+    use_cache: bool,
+    similarity_threshold: float = config.SEMANTIC_CACHE_THRESHOLD,
+):
+    """Get a command suggestion from the response caches, falling back to the model."""
+    if not use_cache:
+        return model_command(
+            ctx, user_input=user_input, console=console, fast_mode=fast_mode
+        )
+
+    model = ctx.obj["model"]
+    with profiling.span("cache lookup"):
+        cache = ResponseCache()
+        semantic_cache = SemanticCache(cache.db, threshold=similarity_threshold)
+        hit = cache.get(user_input, model, fast_mode)
+        message = "[gray]Using cached response[/gray]"
+        if hit is None:
+            hit = semantic_cache.lookup(user_input, model, fast_mode)
+            if hit is not None:
+                message = (
+                    f"""[gray]Using cached response for similar request "{hit.request}" """
+                    f"""(similarity {hit.similarity:.2f})[/gray]"""
+                )
+    if hit is not None:
+        cache.close()
+        console.print(message)
+        # offline models can't answer a second request concurrently (e.g. "Revise Query")
+        if hit.stale and model not in config.OFFLINE_MODELS:
+            # serve the stale response now and refresh it for next time, the refresh is
+            # dropped if the process exits first
+            threading.Thread(
+                target=refresh_cached_command,
+                kwargs={"ctx": ctx, "user_input": user_input, "fast_mode": fast_mode},
+                name="cache-refresh",
+                daemon=True,
+            ).start()
+        return hit.response
+
+    outcomes: Counter = Counter()
+    model_output = model_command(
+        ctx,
+        user_input=user_input,
+        console=console,
+        fast_mode=fast_mode,
+        outcomes=outcomes,
+    )
+    if utils.is_valid_command_response(model_output):
+        cache.put(user_input, model, fast_mode, model_output)
+        semantic_cache.add(user_input, model, fast_mode, model_output)
+    record_outcomes(cache, outcomes)
+    cache.close()
+    return model_output
+
+
+def race_clients(ctx, race_models: str) -> dict:
+    """Parse the comma-separated --race models and get a client for each of them."""
+    clients = {}
+    for model in race_models.split(","):
+        model = normalize_model_name(model)
+        if not model or model in clients:
             continue
+        check_supported_model(model)
+        if model == ctx.obj["model"]:
+            clients[model] = ctx.obj["client"]
+        else:
+            clients[model] = preflight.run(model, console, draft=ctx.obj["draft"])
+    return clients
+
 
-        if model in config.OPENAI_MODEL_MAP or model in config.LLAMA_CPP_MODEL_MAP:
-            # llama.cpp models are OpenAI API drop-in compatible
-            client = ctx.obj["client"]
-            input_messages = openai_adapter.get_model_chat_response(
+def race_command_response(
+    ctx, *, user_input: str, fast_mode: bool, clients: dict, hedge: bool
+) -> Optional[str]:
+    """Ask all raced models for a command suggestion and return the first valid response."""
+    contestants: List[tuple] = [
+        (
+            model,
+            functools.partial(
+                model_command,
+                ctx,
                 user_input=user_input,
-                console=console,
-                input_messages=input_messages,
-                temperature=ctx.obj["temperature"],
+                # contestants run concurrently, only the winner is shown
+                console=Console(quiet=True),
+                fast_mode=fast_mode,
                 model=model,
                 client=client,
-            )
-        elif model in config.HF_MODEL_MAP:
-            api_token = ctx.obj.get("api_key", None)
-            input_messages = huggingface_adapter.get_model_chat_response(
-                user_input=user_input,
-                console=console,
-                input_messages=input_messages,
-                api_token=api_token,
-                temperature=ctx.obj["temperature"],
-                model=model,
-            )
-        elif model in config.GOOGLE_MODEL_MAP:
-            gemini_adapter.get_model_chat_response(
-                user_input=user_input,
-                console=console,
-                chat_session=chat_session,
-                temperature=ctx.obj["temperature"],
-            )
-        elif model in config.ANTHROPIC_MODEL_MAP:
-            client = ctx.obj["client"]
-            input_messages = anthropic_adapter.get_model_chat_response(
+            ),
+        )
+        for model, client in clients.items()
+    ]
+    stats = race.RaceStats()
+    with console.status(f"[bold blue]Racing {', '.join(clients)}[/bold blue]"):
+        winner = race.race_command(contestants, stats, hedge=hedge)
+    stats.close()
+    if winner is None:
+        console.print(
+            "[bold red]Error: None of the raced models returned valid commands[/bold red]"
+        )
+        return None
+    console.print(
+        f"[gray]Fastest valid response from {winner.model} ({winner.latency:.1f}s)[/gray]"
+    )
+    return winner.response
+
+
+def batch_command_response(
+    ctx,
+    *,
+    user_input: str,
+    fast_mode: bool,
+    use_cache: bool,
+    rate_limiter: Optional[batch.RateLimiter],
+) -> Optional[str]:
+    """Get a command suggestion for one batch request (runs in a worker thread)."""
+    model = ctx.obj["model"]
+    if use_cache:
+        # sqlite connections can't be shared across threads
+        cache = ResponseCache()
+        cached = cache.get(user_input, model, fast_mode)
+        cache.close()
+        if cached:
+            return cached.response
+
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    outcomes: Counter = Counter()
+    model_output = model_command(
+        ctx,
+        user_input=user_input,
+        console=Console(quiet=True),
+        fast_mode=fast_mode,
+        outcomes=outcomes,
+    )
+    if use_cache:
+        cache = ResponseCache()
+        if utils.is_valid_command_response(model_output):
+            cache.put(user_input, model, fast_mode, model_output)
+        record_outcomes(cache, outcomes)
+        cache.close()
+    return model_output
+
+
+def run_batch_commands(
+    ctx,
+    *,
+    requests_file,
+    fast_mode: bool,
+    use_cache: bool,
+    concurrency: int,
+    rate_limit: Optional[float],
+    ordered: bool,
+) -> None:
+    """Write the command suggestions for all requests in the file to stdout as JSON lines."""
+    model = ctx.obj["model"]
+    requests = batch.read_requests(requests_file)
+    if model in config.OFFLINE_MODELS:
+        # a single loaded model, requests are queued onto it one at a time
+        concurrency = 1
+    if rate_limit is None:
+        rate_limit = providers.get_provider(model).requests_per_minute
+    rate_limiter = batch.RateLimiter(rate_limit) if rate_limit else None
+
+    # JSON lines go to stdout, progress to stderr
+    status_console = Console(stderr=True)
+    n_failed = 0
+    with status_console.status(
+        f"[bold blue]Processing {len(requests)} requests[/bold blue]"
+    ) as status:
+        results = batch.run_batch(
+            requests,
+            lambda user_input: batch_command_response(
+                ctx,
                 user_input=user_input,
-                console=console,
-                input_messages=input_messages,
-                temperature=ctx.obj["temperature"],
-                model=model,
-                client=client,
+                fast_mode=fast_mode,
+                use_cache=use_cache,
+                rate_limiter=rate_limiter,
+            ),
+            concurrency=concurrency,
+            ordered=ordered,
+        )
+        for n_done, result in enumerate(results, 1):
+            n_failed += result["response"] is None
+            click.echo(json.dumps(result))
+            status.update(
+                f"[bold blue]Processed {n_done}/{len(requests)} requests[/bold blue]"
             )
-
-        user_input = None
+    status_console.print(
+        f"[bold blue]Processed {len(requests)} requests ({n_failed} failed)[/bold blue]"
+    )
 
 
 @main.command(help="Natural language to terminal commands")
@@ -217,8 +604,71 @@ def chat(ctx, user_input):
     default=False,
     help="Get commands without explanations (may be less accurate)",
 )
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    default=False,
+    help="Always ask the model instead of reusing a cached response",
+)
+@click.option(
+    "--similarity-threshold",
+    type=float,
+    default=config.SEMANTIC_CACHE_THRESHOLD,
+    show_default=True,
+    help="Minimum similarity (0-1) for reusing the cached response to a similar request (> 1 disables)",
+)
+@click.option(
+    "--race",
+    "race_models",
+    default=None,
+    help="Comma-separated LLMs to ask concurrently, the first valid response wins (e.g. gpt4,haiku,flash)",
+)
+@click.option(
+    "--hedge",
+    is_flag=True,
+    default=False,
+    help="With --race, only ask the next LLM once the previous one is slower than usual (its p95 latency) or fails",
+)
+@click.option(
+    "--batch",
+    "batch_file",
+    type=click.File("r"),
+    default=None,
+    help="Get commands for each request (one per line) in the file ('-' for stdin) and write them to stdout as JSON lines",
+)
+@click.option(
+    "--concurrency",
+    type=int,
+    default=config.BATCH_CONCURRENCY,
+    show_default=True,
+    help="With --batch, the number of requests sent at once",
+)
+@click.option(
+    "--rate-limit",
+    type=float,
+    default=None,
+    help="With --batch, the maximum requests per minute (defaults to the provider's rate limit, 0 disables)",
+)
+@click.option(
+    "--unordered",
+    is_flag=True,
+    default=False,
+    help="With --batch, write results as they complete instead of in request order",
+)
 @click.pass_context
-def cmd(ctx, user_input, fast):
+def cmd(
+    ctx,
+    user_input,
+    fast,
+    no_cache,
+    similarity_threshold,
+    race_models,
+    hedge,
+    batch_file,
+    concurrency,
+    rate_limit,
+    unordered,
+):
     """
     Natural Language to Terminal Commands
     """
@@ -226,69 +676,69 @@ def cmd(ctx, user_input, fast):
 
     if user_input:
         user_input = str(" ".join(user_input))
-        session.history.append_string(user_input)
+    # the prompt UI is only loaded once the user has to interact with it
+    pending_history = [user_input] if user_input else []
 
-    model = ctx.obj["model"]
+    use_cache = not no_cache
+    if batch_file is not None:
+        if user_input or race_models:
+            console.print(
+                "[bold red]--batch can't be combined with a request or --race[/bold red]"
+            )
+            sys.exit(-1)
+        run_batch_commands(
+            ctx,
+            requests_file=batch_file,
+            fast_mode=fast,
+            use_cache=use_cache,
+            concurrency=concurrency,
+            rate_limit=rate_limit,
+            ordered=not unordered,
+        )
+        return
+
+    clients = race_clients(ctx, race_models) if race_models else None
 
     if not user_input:
         console.print("[gray]Type 'quit' to exit[/gray]")
 
     while True:
         if not user_input:
-            user_input = utils.prompt_user_input(
-                input_request,
-                session,
-                console,
-                completer=utils.PathCompleter(),
-                complete_style=CompleteStyle.MULTI_COLUMN,
-                key_bindings=config.kb,
-            )
+            # connect to the provider while the user is typing
+            providers.warm_up(ctx.obj["model"])
+            interactive = load_interactive(pending_history)
+            user_input = interactive.prompt_cmd_input(input_request, console)
 
         if not user_input:
             continue
 
-        model_output = None
-        if model in config.OPENAI_MODEL_MAP or model in config.LLAMA_CPP_MODEL_MAP:
-            # llama.cpp models are OpenAI API drop-in compatible
-            client = ctx.obj["client"]
-            model_output = openai_adapter.model_command(
-                user_input=user_input,
-                console=console,
-                fast_mode=fast,
-                model=model,
-                client=client,
-            )
-        elif model in config.HF_MODEL_MAP:
-            api_token = ctx.obj.get("api_key", None)
-            model_output = huggingface_adapter.model_command(
-                user_input=user_input,
-                console=console,
-                api_token=api_token,
-                fast_mode=fast,
-                model=model,
-            )
-        elif model in config.GOOGLE_MODEL_MAP:
-            model_output = gemini_adapter.model_command(
-                user_input=user_input,
-                console=console,
-                fast_mode=fast,
-                model=model,
-            )
-        elif model in config.ANTHROPIC_MODEL_MAP:
-            model_output = anthropic_adapter.model_command(
-                user_input=user_input,
-                console=console,
-                fast_mode=fast,
-                model=model,
-                client=ctx.obj["client"],
-            )
+        with profiling.span("command response"):
+            if clients:
+                model_output = race_command_response(
+                    ctx,
+                    user_input=user_input,
+                    fast_mode=fast,
+                    clients=clients,
+                    hedge=hedge,
+                )
+            else:
+                model_output = get_command_response(
+                    ctx,
+                    user_input=user_input,
+                    fast_mode=fast,
+                    use_cache=use_cache,
+                    similarity_threshold=similarity_threshold,
+                )
 
         user_input = None  # clear input for next iteration
 
-        commands = utils.print_command_response(model_output, console, fast)
+        with profiling.span("render"):
+            commands = utils.print_command_response(model_output, console, fast)
         if not commands:
             continue
 
+        interactive = load_interactive(pending_history)
+
         # Give user options to revise query, execute command(s), or quit
         options = [
             "Revise Query",
@@ -296,10 +746,9 @@ def cmd(ctx, user_input, fast):
             "Copy Command(s) to Clipboard",
             "Quit",
         ]
-        questions = [
-            inquirer.List("Next", message="What would you like to do?", choices=options)
-        ]
-        selected_option = inquirer.prompt(questions)["Next"]  # type: ignore
+        selected_option = interactive.select_option(
+            "What would you like to do?", options
+        )
 
         if selected_option == "Revise Query":
             input_request = "Revised Command Request: "
@@ -323,15 +772,291 @@ def cmd(ctx, user_input, fast):
         sys.exit(0)
 
 
+@main.command(help="Show or clear the command response cache")
+@click.option(
+    "--clear",
+    is_flag=True,
+    default=False,
+    help="Remove all cached responses and reset the counters",
+)
+def cache(clear):
+    response_cache = ResponseCache()
+    if clear:
+        response_cache.clear()
+        SemanticCache(response_cache.db).clear()
+        console.print("[bold blue]Cleared the command response cache[/bold blue]")
+    stats = response_cache.stats()
+    response_cache.close()
+    lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+    n_hits = stats["hits"] + stats["stale_hits"] + stats.get("semantic_hits", 0)
+    hit_rate = n_hits / lookups if lookups else 0.0
+    console.print(
+        f"""Entries: {stats["entries"]}\n"""
+        f"""Hits: {stats["hits"]} (stale: {stats["stale_hits"]})\n"""
+        f"""Similar request hits: {stats.get("semantic_hits", 0)}\n"""
+        f"""Misses: {stats["misses"]}\n"""
+        f"""Hit rate: {hit_rate:.1%}"""
+    )
+    console.print(
+        f"""Command JSON: {stats.get(json_repair.VALID, 0)} valid, """
+        f"""{stats.get(json_repair.REPAIRED, 0)} repaired locally, """
+        f"""{stats.get(json_repair.REASKED, 0)} fixed by the model, """
+        f"""{stats.get(json_repair.FAILED, 0)} failed"""
+    )
+
+
+@main.command(name="sessions", help="List or delete saved chat sessions")
+@click.option(
+    "--delete",
+    default=None,
+    help="Delete the chat session with this name",
+)
+def chat_sessions(delete):
+    if delete:
+        chat_log = sessions.ChatLog(delete)
+        if not sessions.is_valid_name(delete) or not chat_log.exists():
+            console.print(f"[bold red]No chat session named {delete}[/bold red]")
+            sys.exit(-1)
+        chat_log.delete()
+        console.print(f"[bold blue]Deleted the chat session {delete}[/bold blue]")
+        return
+    saved_sessions = sessions.list_sessions()
+    if not saved_sessions:
+        console.print("No saved chat sessions, start one with chat --session NAME")
+    for session in saved_sessions:
+        last_used = time.strftime(
+            "%Y-%m-%d %H:%M", time.localtime(session["last_used"])
+        )
+        console.print(
+            f"""{session["name"]}: {session["model"]}, {session["messages"]} messages, """
+            f"""last used {last_used}"""
+        )
+
+
+@main.command(
+    name="race-stats", help="Show how often and how fast each LLM won --race requests"
+)
+def race_stats():
+    stats = race.RaceStats()
+    summary = stats.summary()
+    stats.close()
+    if not summary:
+        console.print("No --race requests yet")
+    for row in summary:
+        latency = (
+            f"""p50 {row["p50"]:.1f}s, p95 {row["p95"]:.1f}s"""
+            if row["p50"] is not None
+            else "no valid responses"
+        )
+        console.print(
+            f"""{row["model"]}: won {row["wins"]}/{row["requests"]}, """
+            f"""valid {row["valid"]}/{row["requests"]} ({latency})"""
+        )
+
+
+@main.command(
+    name="daemon", help="Keep the offline model loaded in a background process"
+)
+@click.option(
+    "--idle-timeout",
+    default=config.DAEMON_IDLE_TIMEOUT,
+    type=float,
+    help="Seconds without requests before the daemon exits and unloads the model",
+)
+@click.option(
+    "--stop",
+    is_flag=True,
+    default=False,
+    help="Stop the running daemon",
+)
+@click.option(
+    "--foreground",
+    is_flag=True,
+    default=False,
+    help="Serve in the current process instead of starting a background process",
+)
+@click.pass_context
+def daemon_command(ctx, idle_timeout, stop, foreground):
+    model = ctx.obj["model"]
+    if model not in config.OFFLINE_MODELS:
+        console.print(
+            f"""[bold red]The daemon only serves offline models. """
+            f"""Options: {", ".join(config.OFFLINE_MODELS)}[/bold red]"""
+        )
+        sys.exit(-1)
+    if not daemon.is_supported():
+        console.print(
+            "[bold red]The daemon requires Unix domain sockets, which are not supported on this platform[/bold red]"
+        )
+        sys.exit(-1)
+
+    running = daemon.connect(model)
+    if stop:
+        if running is not None:
+            running.shutdown()
+            console.print(f"[bold blue]Stopped the daemon serving {model}[/bold blue]")
+        else:
+            console.print(f"[bold blue]No daemon is serving {model}[/bold blue]")
+        return
+    if running is not None:
+        console.print(f"[bold blue]The daemon is already serving {model}[/bold blue]")
+        return
+
+    if foreground:
+        client = preflight.run(model, console, draft=ctx.obj["draft"])
+        console.print(
+            f"[bold blue]Serving {model} at {daemon.socket_path(model)}[/bold blue]"
+        )
+        daemon.serve(model, idle_timeout, client)
+    else:
+        if not daemon.start(model, idle_timeout, console, ctx.obj["draft"]):
+            console.print(
+                f"[bold red]The daemon failed to start, see {daemon.log_path(model)}[/bold red]"
+            )
+            sys.exit(-1)
+        console.print(
+            f"""[bold blue]The daemon is serving {model} """
+            f"""(exits after {idle_timeout:g}s without requests)[/bold blue]"""
+        )
+
+
+@main.command(
+    help="Benchmark llama.cpp settings for the offline model and use the fastest from now on"
+)
+@click.option(
+    "--reset",
+    is_flag=True,
+    default=False,
+    help="Remove the tuned settings and use the defaults again",
+)
+@click.pass_context
+def tune(ctx, reset):
+    model = ctx.obj["model"]
+    if model not in config.OFFLINE_MODELS:
+        console.print(
+            f"""[bold red]Only offline models can be tuned. """
+            f"""Options: {", ".join(config.OFFLINE_MODELS)}[/bold red]"""
+        )
+        sys.exit(-1)
+    _, llm_file, _ = config.LLAMA_CPP_MODEL_MAP[model]
+    store = tuning.TuningStore()
+    if reset:
+        if store.remove(llm_file):
+            console.print(
+                f"[bold blue]Removed the tuned settings of {model}[/bold blue]"
+            )
+        else:
+            console.print(f"[bold blue]{model} has not been tuned[/bold blue]")
+        return
+
+    model_path = providers.llama_model_path(model)
+    if not os.path.exists(model_path):
+        console.print(
+            f"""[bold red]Model not found locally at {model_path}. """
+            f"""Run DeveloperGPT with --offline once to download it.[/bold red]"""
+        )
+        sys.exit(-1)
+
+    hardware = tuning.detect_hardware()
+    model_size = os.path.getsize(model_path)
+    ram = (
+        f"{hardware.available_ram / 2**30:.1f} GB"
+        if hardware.available_ram is not None
+        else "unknown"
+    )
+    console.print(
+        f"""{hardware.physical_cores} physical / {hardware.logical_cores} logical cores, """
+        f"""{ram} available RAM, model {model_size / 2**30:.1f} GB"""
+    )
+    if hardware.available_ram is not None and hardware.available_ram < model_size:
+        console.print(
+            "[bold yellow]The model does not fit in the available RAM, it will be paged from disk[/bold yellow]"
+        )
+    if daemon.connect(model) is not None:
+        console.print(
+            "[bold yellow]The daemon is running and competes for CPU and RAM, stop it for accurate results[/bold yellow]"
+        )
+
+    def report(result: tuning.BenchmarkResult) -> None:
+        settings = result.settings
+        console.print(
+            f"""n_threads={settings["n_threads"]} n_batch={settings["n_batch"]}: """
+            f"""prompt {result.prompt_tokens_per_second:.1f} tokens/s, """
+            f"""generation {result.generated_tokens_per_second:.1f} tokens/s"""
+        )
+
+    candidates = tuning.candidate_settings(hardware, model_size)
+    with console.status(
+        f"[bold blue]Benchmarking {len(candidates)} settings for {model}[/bold blue]"
+    ):
+        results = tuning.benchmark(
+            lambda settings: providers.load_llama(model, settings=settings),
+            candidates,
+            on_result=report,
+        )
+    best = tuning.best_settings(results)
+    store.put(llm_file, hardware, best)
+    console.print(
+        f"""[bold blue]Using {", ".join(f"{k}={v}" for k, v in best.items())} for {model} """
+        f"""from now on[/bold blue]"""
+    )
+    if daemon.connect(model) is not None:
+        console.print(
+            "[bold blue]Restart the daemon (developergpt --offline daemon --stop) to use them[/bold blue]"
+        )
+
+
+@main.group(help="List or update the downloaded offline models")
+def models():
+    pass
+
+
+@models.command(name="list", help="List the offline models and their downloaded files")
+def list_models():
+    manifest = model_manifest.ModelManifest()
+    for model in config.LLAMA_CPP_MODEL_MAP:
+        path = model_manifest.resolve(model, manifest)
+        if path is None:
+            console.print(f"{model}: not downloaded")
+            continue
+        entry = manifest.get(config.LLAMA_CPP_MODEL_MAP[model][1]) or {}
+        revision = (entry.get("revision") or "unknown")[:10]
+        sha256 = (entry.get("sha256") or "not verified")[:12]
+        console.print(
+            f"""{model}: {path} ({entry.get("size", 0) / 2**30:.1f} GB, """
+            f"""revision {revision}, sha256 {sha256})"""
+        )
+
+
+@models.command(help="Download newer revisions of the downloaded offline models")
+def update():
+    manifest = model_manifest.ModelManifest()
+    downloaded = [
+        m for m in config.LLAMA_CPP_MODEL_MAP if model_manifest.resolve(m, manifest)
+    ]
+    if not downloaded:
+        console.print("No offline models downloaded yet")
+    for model in downloaded:
+        # no status spinner, a download shows its own progress bar
+        console.print(f"Checking {model} for updates")
+        try:
+            updated = model_manifest.update(model, manifest)
+        except OSError as e:
+            console.print(f"[bold red]Failed to update {model}: {e}[/bold red]")
+            sys.exit(-1)
+        if updated:
+            console.print(f"[bold blue]Updated {model}[/bold blue]")
+        else:
+            console.print(f"[bold blue]{model} is up to date[/bold blue]")
+
+
 """
 @main.command()
 @click.pass_context
 def test(ctx):
     pass
     while True:
-        user_input = utils.prompt_user_input(
-            "Chat: ", session, console, auto_suggest=AutoSuggestFromHistory()
-        )
+        user_input = interactive.prompt_chat_input(console)
         if len(user_input) == 0:
             continue
 """
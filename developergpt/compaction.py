@@ -0,0 +1,242 @@
+"""
+DeveloperGPT by luo-anthony
+
+Background compaction of long chat histories.
+
+Instead of dropping the oldest turns once a chat no longer fits the context, old
+turns are folded into a rolling summary (a user/assistant message pair) while the
+user is typing. The summary is written by the cheapest model available: a running
+offline model daemon, otherwise the chat model itself or the cheapest model of its
+provider. A chat request never waits for a background summary, an unfinished summary
+is applied after a later turn.
+
+An offline chat model can only run one generation at a time, so offline chats are
+summarized by the chat model itself right before the request that would otherwise
+drop turns (the request waits for the summary).
+"""
+
+import threading
+from typing import Any, Callable, Optional
+
+from developergpt import config, daemon, few_shot_prompts, profiling, providers, utils
+
+# summarize(transcript, cancel) returns the summary, or None if cancelled
+Summarize = Callable[[str, threading.Event], Optional[str]]
+
+
+def format_dict_turn(user_message: str, assistant_message: str) -> list:
+    return [
+        {"role": "user", "content": user_message},
+        few_shot_prompts.format_assistant_response(assistant_message),
+    ]
+
+
+def message_text(message: Any) -> str:
+    if isinstance(message, dict):
+        return f"""{message["role"]}: {message["content"]}"""
+    return str(message)
+
+
+class _Job:
+    def __init__(self, old_messages: list):
+        self.old_messages = old_messages
+        self.summary: Optional[str] = None
+        self.cancel = threading.Event()
+        self.done = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+
+class Compactor:
+    """Folds old turns of a chat history into a rolling summary."""
+
+    def __init__(
+        self,
+        summarize: Summarize,
+        *,
+        first_index: int = 0,
+        max_tokens: int = config.CHAT_COMPACTION_TOKENS,
+        max_messages: Optional[int] = None,
+        keep_turns: int = config.CHAT_COMPACTION_KEEP_TURNS,
+        exclusive: bool = False,
+        format_turn: Callable[[str, str], list] = format_dict_turn,
+    ):
+        """
+        Args:
+            summarize (Summarize): Summarizes a transcript, returns None if cancelled.
+            first_index (int): Index of the first message that may be summarized (after system messages and examples).
+            max_tokens (int): Compact once the history is longer than this (the watermark).
+            max_messages (Optional[int]): Compact once the history has more messages than this.
+            keep_turns (int): Number of most recent turns that are never summarized.
+            exclusive (bool): Whether the summarizer uses the chat model itself (an offline model), so
+                the history is summarized by before_request instead of in the background.
+            format_turn (Callable[[str, str], list]): Formats a (user, assistant) turn as chat messages.
+        """
+        self.summarize = summarize
+        self.first_index = first_index
+        self.max_tokens = max_tokens
+        self.max_messages = max_messages
+        self.keep_turns = keep_turns
+        self.exclusive = exclusive
+        self.format_turn = format_turn
+        self._job: Optional[_Job] = None
+
+    def _n_tokens(self, messages: list) -> int:
+        if isinstance(messages, utils.ChatHistory):
+            return messages.n_tokens
+        encoding = utils.get_encoding("gpt-3.5-turbo")
+        return sum(len(encoding.encode(message_text(m))) for m in messages)
+
+    def _over_watermark(self, messages: list) -> bool:
+        if self.max_messages is not None and len(messages) > self.max_messages:
+            return True
+        return self._n_tokens(messages) > self.max_tokens
+
+    def _new_job(self, messages: list) -> Optional[_Job]:
+        if not self._over_watermark(messages):
+            return None
+        end = len(messages) - 2 * self.keep_turns
+        old_messages = list(messages[self.first_index : end])
+        if len(old_messages) < 2 or (
+            len(old_messages) == 2
+            and few_shot_prompts.SUMMARY_PREFIX in message_text(old_messages[0])
+        ):
+            return None  # nothing (but the summary itself) to summarize
+        return _Job(old_messages)
+
+    def due(self, messages: list) -> bool:
+        """Whether before_request will summarize the history (and wait for the summary)."""
+        return self.exclusive and self._new_job(messages) is not None
+
+    def after_turn(self, messages: list) -> None:
+        """Start summarizing old turns in the background if the history is over the watermark."""
+        if self.exclusive or self._job is not None:
+            return
+        job = self._new_job(messages)
+        if job is None:
+            return
+        job.thread = threading.Thread(
+            target=self._run, args=(job,), name="compaction", daemon=True
+        )
+        self._job = job
+        job.thread.start()
+
+    def close(self) -> None:
+        """Cancel an unfinished background summary (e.g. when the chat ends)."""
+        if self._job is not None:
+            self._job.cancel.set()
+            self._job = None
+
+    def _run(self, job: _Job) -> None:
+        transcript = "\n\n".join(message_text(m) for m in job.old_messages)
+        try:
+            with profiling.span("compaction"):
+                job.summary = self.summarize(transcript, job.cancel)
+        except Exception:
+            job.summary = None  # compaction is best effort, the turns are kept
+        finally:
+            job.done.set()
+
+    def before_request(self, messages: list) -> list:
+        """
+        Replace the summarized turns with the summary if it is ready. Only waits for a summary
+        of an exclusive summarizer, which is written here.
+
+        Args:
+            messages (list): The chat history.
+
+        Returns:
+            list: The chat history, compacted if a summary was ready.
+        """
+        if self.exclusive:
+            job = self._new_job(messages)
+            if job is None:
+                return messages
+            self._run(job)  # the chat model isn't generating anything else now
+            return self._apply(messages, job)
+
+        job = self._job
+        if job is None or not job.done.is_set():
+            return messages
+        self._job = None
+        return self._apply(messages, job)
+
+    def _apply(self, messages: list, job: _Job) -> list:
+        start, end = self.first_index, self.first_index + len(job.old_messages)
+        current = messages[start:end]
+        if not job.summary or len(current) != len(job.old_messages):
+            return messages
+        if any(a is not b for a, b in zip(current, job.old_messages)):
+            return messages  # the history changed meanwhile (e.g. context was dropped)
+        messages[start:end] = self.format_turn(
+            f"{few_shot_prompts.SUMMARY_PREFIX}\n{job.summary.strip()}",
+            few_shot_prompts.SUMMARY_ACKNOWLEDGEMENT,
+        )
+        return messages
+
+
+def _running_offline_model() -> Any:
+    """A (model, client) of an offline model served by a running daemon, if any."""
+    for model in config.OFFLINE_MODELS:
+        client = daemon.connect(model)
+        if client is not None:
+            return model, client
+    return None
+
+
+def create_compactor(model: str, client: Any) -> Optional[Compactor]:
+    """
+    Create the compactor for a chat with the given model.
+
+    Args:
+        model (str): The chat model.
+        client (Any): The chat model's client.
+
+    Returns:
+        Optional[Compactor]: The compactor, or None if the model's chat history isn't compacted.
+    """
+    if model in config.GOOGLE_MODEL_MAP:
+        return None  # Gemini keeps its own chat session history, bounded by the adapter
+
+    adapter = providers.load_adapter(model)
+    if model in config.LLAMA_CPP_MODEL_MAP:
+        # the local model is the cheapest model, but can only serve one request at a time
+        return Compactor(
+            lambda transcript, cancel: adapter.summarize_conversation(
+                transcript=transcript, client=client, model=model, cancel=cancel
+            ),
+            first_index=1,
+            max_tokens=config.OFFLINE_CHAT_COMPACTION_TOKENS,
+            exclusive=True,
+        )
+
+    def summarize(transcript: str, cancel: threading.Event) -> Optional[str]:
+        offline = _running_offline_model()
+        if offline is not None:
+            from developergpt import openai_adapter
+
+            offline_model, offline_client = offline
+            return openai_adapter.summarize_conversation(
+                transcript=transcript,
+                client=offline_client,
+                model=offline_model,
+                cancel=cancel,
+            )
+        return adapter.summarize_conversation(
+            transcript=transcript, client=client, model=model, cancel=cancel
+        )
+
+    if model in config.HF_MODEL_MAP:
+        if model not in config.HF_INSTRUCT_MODELS:
+            return None  # the history of foundation models is their few-shot prompt
+        return Compactor(
+            summarize,
+            # the Hugging Face adapter drops the oldest turn beyond MAX_HISTORY messages
+            max_messages=adapter.MAX_HISTORY - 2,
+            format_turn=lambda user_message, assistant_message: [
+                adapter.format_user_input(user_message),
+                adapter.format_assistant_output(assistant_message),
+            ],
+        )
+    # OpenAI chats start with the system message
+    first_index = 1 if model in config.OPENAI_MODEL_MAP else 0
+    return Compactor(summarize, first_index=first_index)
@@ -7,21 +7,11 @@ import platform
 import sys
 from typing import Optional
 
-from prompt_toolkit.key_binding import KeyBindings
-from prompt_toolkit.key_binding.key_processor import KeyPressEvent
-from prompt_toolkit.keys import Keys
-from prompt_toolkit.styles import Style
 from rich.console import Console
 
 ### Appearance Constants ###
 DEFAULT_COLUMN_WIDTH = 100
 
-INPUT_STYLE = Style.from_dict(
-    {
-        "prompt": "bold ansigreen",
-    }
-)
-
 ### Supported LLMs and Configuration ###
 GPT35 = "gpt35"
 GPT4 = "gpt4"
@@ -54,7 +44,9 @@ SUPPORTED_MODELS = set(
 )
 OFFLINE_MODEL_CTX = 4000
 OFFLINE_MODELS = set([MISTRAL_Q6, MISTRAL_Q4])
-OFFLINE_MODEL_CACHE_DIR = os.path.expanduser("~/.cache/developergpt")
+CACHE_DIR = os.path.expanduser("~/.cache/developergpt")
+OFFLINE_MODEL_CACHE_DIR = CACHE_DIR
+MODEL_MANIFEST_FILE = os.path.join(CACHE_DIR, "models.json")
 
 LLAMA_CPP_MODEL_MAP = {
     MISTRAL_Q6: (
@@ -109,6 +101,104 @@ ANTHROPIC_API_KEY = "ANTHROPIC_API_KEY"
 USER_PLATFORM = platform.platform()
 CMD_TEMP = 0.01
 
+### Startup Preflight Configuration ###
+
+PREFLIGHT_CACHE_FILE = os.path.join(CACHE_DIR, "preflight.json")
+PREFLIGHT_TTL = 600  # seconds a successful connectivity or API key check is reused
+PREFLIGHT_TIMEOUT = 3  # seconds
+
+# endpoints probed for connectivity (any HTTP response means the provider is reachable)
+OPENAI_ENDPOINT = "https://api.openai.com/v1/models"
+ANTHROPIC_ENDPOINT = "https://api.anthropic.com/v1/messages"
+GOOGLE_ENDPOINT = "https://generativelanguage.googleapis.com/v1beta/models"
+HUGGING_FACE_ENDPOINT = "https://huggingface.co/api/models"
+
+### Provider Connection Configuration ###
+
+HTTP_TIMEOUT = 600  # seconds, provider SDKs may set shorter per-request timeouts
+HTTP_CONNECT_TIMEOUT = 10  # seconds
+HTTP_MAX_CONNECTIONS = 10  # per provider
+HTTP_KEEPALIVE_EXPIRY = 120  # seconds an idle (pre-warmed) connection is kept open
+
+### Command Response Cache Configuration ###
+
+RESPONSE_CACHE_FILE = os.path.join(CACHE_DIR, "responses.sqlite3")
+RESPONSE_CACHE_MAX_ENTRIES = 2000
+RESPONSE_CACHE_TTL = 7 * 24 * 60 * 60  # seconds before a cached response is refreshed
+RESPONSE_CACHE_STALE_TTL = 30 * 24 * 60 * 60  # seconds a stale response is still served
+# minimum TF-IDF cosine similarity for reusing the response to a near-duplicate request (> 1 disables),
+# requests that differ in meaning are told apart by their salient tokens, not by this threshold
+SEMANTIC_CACHE_THRESHOLD = 0.6
+SEMANTIC_CACHE_MAX_ENTRIES = 50000
+
+### Offline Model Daemon Configuration ###
+
+DAEMON_IDLE_TIMEOUT = (
+    30 * 60
+)  # seconds without requests before the daemon unloads the model
+
+### Offline Model Tuning Configuration ###
+
+TUNING_FILE = os.path.join(CACHE_DIR, "llama_tuning.json")
+TUNE_BATCH_SIZES = (256, 512)  # n_batch candidates of `developergpt tune`
+TUNE_PROMPT_TOKENS = 512  # prompt tokens evaluated per candidate
+TUNE_GENERATED_TOKENS = 32  # tokens generated per candidate
+
+### Offline Speculative Decoding Configuration ###
+
+PROMPT_LOOKUP_MAX_NGRAM = 2  # longest n-gram matched against the prompt
+PROMPT_LOOKUP_TOKENS = 10  # tokens drafted per prompt lookup match
+DRAFT_MODEL_TOKENS = 4  # tokens drafted per step by a draft GGUF model
+
+### Chat Session Configuration ###
+
+SESSIONS_DIR = os.path.join(CACHE_DIR, "sessions")
+SESSION_RESUME_MESSAGES = 100  # most recent messages loaded when resuming a session
+SESSION_MAX_KV_STATES = 3  # saved llama.cpp KV states (each as large as the KV cache)
+
+### Token Budget Calibration Configuration ###
+
+TOKEN_CALIBRATION_FILE = os.path.join(CACHE_DIR, "token_calibration.json")
+TOKEN_CALIBRATION_WEIGHT = 0.2  # weight of a new response in the moving average
+# bounds of the per-provider correction factor for estimated token counts
+TOKEN_FACTOR_MIN = 0.5
+TOKEN_FACTOR_MAX = 2.0
+
+### Gemini Context Cache Configuration ###
+
+GEMINI_CONTEXT_CACHE_FILE = os.path.join(CACHE_DIR, "gemini_context_cache.json")
+# seconds an uploaded few-shot prefix is kept by Gemini
+GEMINI_CONTEXT_CACHE_TTL = 60 * 60
+# seconds before retrying to upload a prefix Gemini refused to cache (e.g. below its minimum size)
+GEMINI_CONTEXT_CACHE_RETRY = 24 * 60 * 60
+
+### Chat Compaction Configuration ###
+
+# chat histories longer than this are summarized in the background (below the
+# adapters' input limits, so old turns are summarized before they are dropped)
+CHAT_COMPACTION_TOKENS = 2000
+# offline chats are summarized by the chat model, in the foreground, only once the
+# next request would otherwise drop turns (the adapter's input limit, less a message)
+OFFLINE_CHAT_COMPACTION_TOKENS = 2500
+CHAT_COMPACTION_KEEP_TURNS = 2  # most recent user/assistant turns never summarized
+SUMMARY_MAX_TOKENS = 400
+
+### Model Race Configuration ###
+
+RACE_STATS_FILE = os.path.join(CACHE_DIR, "race_stats.sqlite3")
+RACE_STATS_WINDOW = 100  # most recent responses per model used for latency percentiles
+RACE_MIN_SAMPLES = 5  # responses needed before the p95 latency is used as hedge delay
+RACE_HEDGE_DELAY = 3.0  # seconds before hedging to a model without enough samples
+
+### Batch Command Configuration ###
+
+BATCH_CONCURRENCY = 4  # requests of `cmd --batch` in flight at once
+# default request rate limits of `cmd --batch` per provider (requests per minute)
+OPENAI_REQUESTS_PER_MINUTE = 500
+ANTHROPIC_REQUESTS_PER_MINUTE = 50
+GOOGLE_REQUESTS_PER_MINUTE = 15
+HUGGING_FACE_REQUESTS_PER_MINUTE = 60
+
 
 def get_environ_key(keyname: str, console: Console) -> str:
     key = os.environ.get(keyname, None)
@@ -129,17 +219,3 @@ def get_environ_key_optional(keyname: str, console: Console) -> Optional[str]:
 For full access, set the {keyname} environment variable.[/bold yellow]"""
         )
     return key
-
-
-kb = KeyBindings()
-
-
-@kb.add(Keys.Enter, eager=True)
-def _(event: KeyPressEvent):
-    buff = event.app.current_buffer
-    if buff.complete_state:
-        # during completion, enter will select the current completion instead of submitting input
-        if buff.complete_state.current_completion:
-            buff.apply_completion(buff.complete_state.current_completion)
-            return  # don't submit input
-    buff.validate_and_handle()
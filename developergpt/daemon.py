@@ -0,0 +1,302 @@
+"""
+DeveloperGPT by luo-anthony
+
+Resident warm-model daemon for offline mode. `developergpt daemon` keeps the selected
+llama.cpp model loaded in a background process and serves requests over a Unix domain
+socket, so later CLI invocations become thin clients instead of reloading the GGUF.
+
+Protocol: one JSON request line per connection ({"method": ..., "kwargs": {...}}),
+answered with JSON lines ({"chunk": ...} for streamed responses, {"result": ...},
+{"error": ...} or {"done": true}). Every connection is handled in its own thread, so
+pings are answered while the model generates; model requests queue for the model.
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Callable, Iterator, List, Optional
+
+from rich.console import Console
+
+from developergpt import config
+
+CONNECT_TIMEOUT = 0.5  # seconds to wait for a running daemon to answer a ping
+ACCEPT_POLL = 0.1  # seconds between checks for a shutdown request or the idle timeout
+
+
+class DaemonError(RuntimeError):
+    pass
+
+
+def is_supported() -> bool:
+    return hasattr(socket, "AF_UNIX")
+
+
+def socket_path(model: str) -> str:
+    return os.path.join(config.CACHE_DIR, f"daemon-{model}.sock")
+
+
+def log_path(model: str) -> str:
+    return os.path.join(config.CACHE_DIR, f"daemon-{model}.log")
+
+
+class _Response(dict):
+    """JSON response from the daemon with OpenAI-style attribute access (missing fields are None)."""
+
+    def __getattr__(self, name: str) -> Any:
+        return _wrap(self.get(name))
+
+
+def _wrap(value: Any) -> Any:
+    if isinstance(value, dict):
+        return _Response(value)
+    if isinstance(value, list):
+        return [_wrap(v) for v in value]
+    return value
+
+
+def _to_dict(response: Any) -> Any:
+    """Convert an OpenAI-style response object from llama-cpp-python to plain JSON data."""
+    if hasattr(response, "model_dump"):
+        return response.model_dump()
+    if hasattr(response, "dict"):
+        return response.dict()
+    return response
+
+
+class DaemonClient:
+    """Thin client for a running daemon, a drop-in for the llama_cpp.Llama methods DeveloperGPT uses."""
+
+    def __init__(self, model: str, path: str):
+        self.model = model
+        self.path = path
+
+    def _request(self, method: str, timeout: Optional[float] = None, **kwargs):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.settimeout(timeout)
+        try:
+            conn.connect(self.path)
+            stream = conn.makefile("rwb")
+            stream.write(json.dumps({"method": method, "kwargs": kwargs}).encode())
+            stream.write(b"\n")
+            stream.flush()
+            for line in stream:
+                message = json.loads(line)
+                if "error" in message:
+                    raise DaemonError(message["error"])
+                if message.get("done"):
+                    return
+                yield message
+        finally:
+            conn.close()
+
+    def ping(self) -> bool:
+        try:
+            return any(
+                m.get("result") == self.model
+                for m in self._request("ping", timeout=CONNECT_TIMEOUT)
+            )
+        except (OSError, ValueError, DaemonError):
+            return False
+
+    def shutdown(self) -> None:
+        for _ in self._request("shutdown", timeout=CONNECT_TIMEOUT):
+            pass
+
+    def tokenize(
+        self, text: bytes, add_bos: bool = True, special: bool = False
+    ) -> List[int]:
+        return self._result(
+            "tokenize", text=text.decode(), add_bos=add_bos, special=special
+        )
+
+    def create_chat_completion_openai_v1(self, stream: bool = False, **kwargs):
+        if stream:
+            return self._stream("chat", stream=True, **kwargs)
+        return self._result("chat", **kwargs)
+
+    def create_command_completion(self, stream: bool = False, **kwargs):
+        if stream:
+            return self._stream("command", stream=True, **kwargs)
+        return self._result("command", **kwargs)
+
+    def _stream(self, method: str, **kwargs) -> Iterator[_Response]:
+        for message in self._request(method, **kwargs):
+            yield _wrap(message["chunk"])
+
+    def _result(self, method: str, **kwargs) -> _Response:
+        for message in self._request(method, **kwargs):
+            return _wrap(message["result"])
+        raise DaemonError("No response from the DeveloperGPT daemon")
+
+
+def connect(model: str) -> Optional[DaemonClient]:
+    """Connect to a running daemon serving the given model, if there is one."""
+    if not is_supported():
+        return None
+    path = socket_path(model)
+    if not os.path.exists(path):
+        return None
+    client = DaemonClient(model, path)
+    return client if client.ping() else None
+
+
+def start(
+    model: str, idle_timeout: float, console: Console, draft: Optional[str] = None
+) -> bool:
+    """Start the daemon in a detached background process. Returns True once it serves requests."""
+    os.makedirs(config.CACHE_DIR, exist_ok=True)
+    draft_args = ["--draft", draft] if draft else []
+    with open(log_path(model), "ab") as log:
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "developergpt",
+                "--model",
+                model,
+                *draft_args,
+                "daemon",
+                "--foreground",
+                "--idle-timeout",
+                str(idle_timeout),
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=log,
+            start_new_session=True,
+        )
+
+    with console.status("[bold blue]Loading model in the DeveloperGPT daemon"):
+        while connect(model) is None:
+            if process.poll() is not None:
+                return False  # failed to load the model, see log_path(model)
+            time.sleep(0.5)
+    return True
+
+
+def serve(model: str, idle_timeout: float, client: Any) -> None:
+    """
+    Serve requests for a loaded model until idle for idle_timeout seconds or asked to shut down.
+
+    Args:
+        model (str): The offline model served by the daemon.
+        idle_timeout (float): Seconds without any request before the daemon exits.
+        client (Llama): The loaded llama.cpp model.
+    """
+    path = socket_path(model)
+    if os.path.exists(path):
+        os.remove(path)  # left behind by a daemon that didn't exit cleanly
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)  # only the current user may connect
+    try:
+        server.bind(path)
+    finally:
+        os.umask(old_umask)
+    server.listen()
+    server.settimeout(min(idle_timeout, ACCEPT_POLL))
+
+    shutdown = threading.Event()
+    # llama.cpp runs one generation at a time, concurrent model requests wait for it
+    model_lock = threading.Lock()
+    state_lock = threading.Lock()
+    n_active = 0
+    last_request = time.monotonic()
+
+    def handle(conn: socket.socket) -> None:
+        nonlocal n_active, last_request
+        try:
+            with conn:
+                if not _handle(conn, model, client, model_lock):
+                    shutdown.set()
+        finally:
+            with state_lock:
+                n_active -= 1
+                last_request = time.monotonic()
+
+    try:
+        while not shutdown.is_set():
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                with state_lock:
+                    idle = n_active == 0 and (
+                        time.monotonic() - last_request >= idle_timeout
+                    )
+                if idle:
+                    break  # idle shutdown
+                continue
+            conn.settimeout(None)
+            with state_lock:
+                n_active += 1
+                last_request = time.monotonic()
+            threading.Thread(
+                target=handle, args=(conn,), name="daemon-request", daemon=True
+            ).start()
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _handle(
+    conn: socket.socket, model: str, client: Any, model_lock: threading.Lock
+) -> bool:
+    """Handle a single request. Returns False if the daemon should shut down."""
+    stream = conn.makefile("rwb")
+
+    def send(message: dict) -> None:
+        stream.write(json.dumps(message).encode())
+        stream.write(b"\n")
+        stream.flush()
+
+    try:
+        request = json.loads(stream.readline())
+        method, kwargs = request["method"], request.get("kwargs", {})
+        if method == "ping":
+            send({"result": model})
+            return True
+        if method == "shutdown":
+            send({"done": True})
+            return False
+        with model_lock:
+            _handle_model_request(send, method, kwargs, client)
+    except (BrokenPipeError, ConnectionResetError):
+        pass  # the client went away (e.g. Ctrl-C), keep serving others
+    except Exception as e:
+        try:
+            send({"error": str(e)})
+        except OSError:
+            pass
+    return True
+
+
+def _handle_model_request(
+    send: Callable[[dict], None], method: str, kwargs: dict, client: Any
+) -> None:
+    """Run a request on the model (holding the model lock), sending the response."""
+    from developergpt import prefix_cache
+
+    if method == "chat" and kwargs.get("stream"):
+        for chunk in client.create_chat_completion(**kwargs):
+            send({"chunk": chunk})
+    elif method == "chat":
+        send({"result": client.create_chat_completion(**kwargs)})
+    elif method == "tokenize":
+        text = kwargs.pop("text").encode()
+        send({"result": client.tokenize(text, **kwargs)})
+    elif method == "command" and kwargs.get("stream"):
+        for chunk in prefix_cache.create_command_completion(client, **kwargs):
+            send({"chunk": _to_dict(chunk)})
+    elif method == "command":
+        response = prefix_cache.create_command_completion(client, **kwargs)
+        send({"result": _to_dict(response)})
+    else:
+        send({"error": f"Unknown method {method}"})
+        return
+    send({"done": True})
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date
 
 from developergpt import config
 
@@ -16,6 +16,23 @@ CMD_SYS_MSG = f"""
 As an assistant for a programmer on a {config.USER_PLATFORM} machine, your task is to provide the appropriate command-line commands to execute a user request.
 """
 
+SUMMARY_SYS_MSG = """
+You summarize conversations between a programmer and DeveloperGPT, a programming assistant.
+Keep every fact the conversation depends on: the programmer's goal, their environment, file names, code, commands, errors and decisions made.
+Write a concise summary in plain text, without a preamble.
+"""
+
+# the summary replaces the summarized turns as a user/assistant pair, which keeps the roles alternating
+SUMMARY_PREFIX = "Summary of our conversation so far:"
+SUMMARY_ACKNOWLEDGEMENT = "Understood, I will keep this context in mind."
+
+
+def format_summary_request(transcript: str) -> str:
+    return f"""Summarize the following conversation (it may start with a summary of earlier turns):
+
+{transcript}"""
+
+
 JSON_CMD_FORMAT = """
 {
     "input": "<user input>",
@@ -51,7 +68,7 @@ JSON_INVALID_FORMAT_FAST = """{"error": 1}"""
 def format_initial_cmd_msg(cmd_format: str, invalid_format: str) -> str:
     return f"""
                 Provide the appropriate command-line commands that can be executed for a user request (keep in mind the platform of the user).
-                Today's date/time is {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}.
+                Today's date is {date.today().isoformat()}.
                 If the request is possible, please provide commands that can be executed in the command line and do not require a GUI.
                 Do not include commands that require a yes/no response.
                 For each command, explain the command and any arguments used.
@@ -151,3 +168,53 @@ UNKNOWN_QUERY_OUTPUT_EXAMPLE_ONE = (
 UNKNOWN_QUERY_OUTPUT_EXAMPLE_ONE_FAST = """{"error": 1}"""
 
 EXAMPLE_PLATFORM = "macOS-13.3.1-x86-64bit"
+
+### OpenAI-style chat messages (shared by OpenAI, llama.cpp, Anthropic and Hugging Face) ###
+
+INITIAL_CHAT_SYSTEM_MSG = {
+    "role": "system",
+    "content": CHAT_SYS_MSG,
+}
+
+INITIAL_CMD_SYSTEM_MSG = {
+    "role": "system",
+    "content": CMD_SYS_MSG,
+}
+
+
+def format_user_request(
+    user_request: str, platform: str = config.USER_PLATFORM
+) -> dict:
+    return {
+        "role": "user",
+        "content": f"""Provide the appropriate command-line commands that can be executed on a {platform} machine for the user request: "{user_request}".""",
+    }
+
+
+def format_assistant_response(assistant_response: str) -> dict:
+    return {"role": "assistant", "content": assistant_response}
+
+
+BASE_INPUT_CMD_MSGS = [
+    INITIAL_CMD_SYSTEM_MSG,
+    {"role": "user", "content": INITIAL_USER_CMD_MSG},
+    format_user_request(CONDA_REQUEST, platform=EXAMPLE_PLATFORM),
+    format_assistant_response(CONDA_OUTPUT_EXAMPLE),
+    format_user_request(SEARCH_REQUEST, platform=EXAMPLE_PLATFORM),
+    format_assistant_response(SEARCH_OUTPUT_EXAMPLE),
+    format_user_request(UNKNOWN_REQUEST, platform=EXAMPLE_PLATFORM),
+    format_assistant_response(UNKNOWN_QUERY_OUTPUT_EXAMPLE_ONE),
+]
+
+BASE_INPUT_CMD_MSGS_FAST = [
+    INITIAL_CMD_SYSTEM_MSG,
+    {"role": "user", "content": INITIAL_USER_CMD_MSG_FAST},
+    format_user_request(CONDA_REQUEST, platform=EXAMPLE_PLATFORM),
+    format_assistant_response(CONDA_OUTPUT_EXAMPLE_FAST),
+    format_user_request(SEARCH_REQUEST, platform=EXAMPLE_PLATFORM),
+    format_assistant_response(SEARCH_OUTPUT_EXAMPLE_FAST),
+    format_user_request(PROCESS_REQUEST, platform=EXAMPLE_PLATFORM),
+    format_assistant_response(PROCESS_OUTPUT_EXAMPLE_FAST),
+    format_user_request(UNKNOWN_REQUEST, platform=EXAMPLE_PLATFORM),
+    format_assistant_response(UNKNOWN_QUERY_OUTPUT_EXAMPLE_ONE_FAST),
+]
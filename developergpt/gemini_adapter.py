@@ -2,16 +2,29 @@
 DeveloperGPT by luo-anthony
 """
 
+import datetime
+import functools
+import hashlib
 import json
+import os
+import time
+from collections import Counter
+from typing import NamedTuple, Optional
 
 import google.generativeai as genai
-from google.generativeai import ChatSession, GenerativeModel
+from google.api_core import exceptions as google_exceptions
+from google.generativeai import ChatSession, GenerativeModel, caching
 from rich.console import Console
-from rich.live import Live
-from rich.markdown import Markdown
-from rich.panel import Panel
 
-from developergpt import config, few_shot_prompts, utils
+from developergpt import (
+    aio,
+    config,
+    few_shot_prompts,
+    json_repair,
+    profiling,
+    streaming,
+    tokenizers,
+)
 from developergpt.few_shot_prompts import (
     INITIAL_USER_CMD_MSG,
     INITIAL_USER_CMD_MSG_FAST,
@@ -119,12 +132,169 @@ GEMINI_SAFETY_SETTING = {
 }
 
 
+@functools.lru_cache(maxsize=None)
+def get_model(model: str) -> GenerativeModel:
+    """The GenerativeModel of a Gemini model, created on first use."""
+    return GenerativeModel(config.GOOGLE_MODEL_MAP[model])
+
+
+class CachedPrefix(NamedTuple):
+    """A few-shot prefix uploaded through Gemini's context caching API."""
+
+    name: str  # name of the CachedContent
+    model: str  # Gemini model name the prefix was cached for
+    key: str  # ContextCacheStore key
+
+
+class ContextCacheStore:
+    """Uploaded few-shot prefixes (and refused uploads) per model and prefix, persisted as JSON."""
+
+    def __init__(self, path: str = config.GEMINI_CONTEXT_CACHE_FILE):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.entries: dict = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    @staticmethod
+    def key(model_name: str, contents: list) -> str:
+        # cached contents belong to the project of the API key
+        api_key = os.environ.get(config.GOOGLE_API_KEY, "")
+        fingerprint = json.dumps([api_key, model_name, contents], sort_keys=True)
+        return hashlib.sha256(fingerprint.encode()).hexdigest()[:32]
+
+    def get(self, key: str) -> Optional[dict]:
+        """The unexpired entry of a prefix, or None."""
+        entry = self.entries.get(key)
+        if not isinstance(entry, dict) or entry.get("expires", 0) <= time.time():
+            return None
+        return entry
+
+    def put(self, key: str, name: Optional[str], ttl: float) -> None:
+        self.entries = {k: e for k, e in self.entries.items() if self.get(k)}
+        self.entries[key] = {"name": name, "expires": time.time() + ttl}
+        self.save()
+
+    def remove(self, key: str) -> None:
+        if self.entries.pop(key, None) is not None:
+            self.save()
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+@functools.lru_cache(maxsize=None)
+def context_cache() -> ContextCacheStore:
+    """The uploaded prefixes of this user, loaded on first use."""
+    return ContextCacheStore()
+
+
+def cached_prefix(
+    model: str, contents: list, store: Optional[ContextCacheStore] = None
+) -> Optional[CachedPrefix]:
+    """
+    Upload a static prompt prefix once through Gemini's context caching API.
+
+    Args:
+        model (str): The Gemini model.
+        contents (list): The prefix messages.
+        store (Optional[ContextCacheStore]): The store of uploaded prefixes.
+
+    Returns:
+        Optional[CachedPrefix]: The uploaded prefix, or None if Gemini doesn't cache it (e.g. a prefix
+            below the minimum cached size or a model without context caching), then the prefix is
+            sent with the request and the upload is retried after config.GEMINI_CONTEXT_CACHE_RETRY.
+    """
+    store = store or context_cache()
+    model_name = config.GOOGLE_MODEL_MAP[model]
+    key = store.key(model_name, contents)
+    entry = store.get(key)
+    if entry is not None:
+        return CachedPrefix(entry["name"], model_name, key) if entry["name"] else None
+
+    try:
+        with profiling.span("gemini context cache"):
+            cache = caching.CachedContent.create(
+                model=model_name,
+                contents=contents,
+                ttl=datetime.timedelta(seconds=config.GEMINI_CONTEXT_CACHE_TTL),
+            )
+    except google_exceptions.GoogleAPIError:
+        store.put(key, None, config.GEMINI_CONTEXT_CACHE_RETRY)
+        return None
+    # forget the prefix a minute before Gemini does
+    store.put(key, cache.name, config.GEMINI_CONTEXT_CACHE_TTL - 60)
+    return CachedPrefix(cache.name, model_name, key)
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_prefix_model(prefix: CachedPrefix) -> GenerativeModel:
+    # from_cached_content only reads the name and model (a name string would be fetched first)
+    return GenerativeModel.from_cached_content(prefix)  # type: ignore
+
+
+def start_chat_session(model: str, history: Optional[list] = None) -> ChatSession:
+    """Start a chat session with the given Gemini model, optionally continuing a saved history."""
+    return get_model(model).start_chat(history=history or None)
+
+
+def history_messages(chat_session: "ChatSession") -> list:
+    """The messages of a chat session as JSON-serializable dicts (accepted by start_chat_session)."""
+    return [
+        {"role": content.role, "parts": [part.text for part in content.parts]}
+        for content in chat_session.history
+    ]
+
+
+def _content_message(content) -> dict:
+    return {"role": content.role, "content": "".join(p.text for p in content.parts)}
+
+
+def reduce_history(
+    chat_session: "ChatSession",
+    user_input: str,
+    token_limit: int,
+    tokenizer: tokenizers.Tokenizer,
+) -> int:
+    """
+    Drop the oldest turns of a chat session until the history and the next user input fit in token_limit.
+
+    Args:
+        chat_session (ChatSession): The chat session object.
+        user_input (str): The next user input.
+        token_limit (int): The maximum number of input tokens.
+        tokenizer (tokenizers.Tokenizer): The tokenizer estimating the Gemini token counts.
+
+    Returns:
+        int: The (calibrated) number of input tokens of the next request.
+    """
+    history = chat_session.history
+    counts = [tokenizer.count_message(_content_message(c)) for c in history]
+    n_tokens = sum(counts) + tokenizer.count_message(
+        {"role": "user", "content": user_input}
+    )
+    start = 0
+    while start < len(history) and tokenizer.prompt_tokens(n_tokens) > token_limit:
+        # remove the oldest user/model turn, the history must start with a user message
+        n_tokens -= sum(counts[start : start + 2])
+        start += 2
+    if start:
+        chat_session.history = history[start:]
+    return tokenizer.prompt_tokens(n_tokens)
+
+
 def get_model_chat_response(
     *,
     user_input: str,
     console: Console,
     chat_session: "ChatSession",
     temperature: float,
+    model: str,
 ) -> None:
     """
     Get the chat response from Gemini model.
@@ -134,35 +304,53 @@ def get_model_chat_response(
         console (Console): The console object for displaying the output.
         chat_session (ChatSession): The chat session object.
         temperature (float): The temperature value for generating the response.
+        model (str): The name of the model to use for generating the response.
 
     Returns:
         None
     """
-    response = chat_session.send_message(
-        user_input,
-        stream=True,
-        generation_config=genai.types.GenerationConfig(temperature=temperature),
+    MAX_INPUT_TOKENS = 8000
+    # Note: gpt-4-turbo token counts calibrated with the usage reported by Gemini
+    tokenizer = tokenizers.chat_tokenizer(model, None)
+    n_input_tokens = reduce_history(
+        chat_session, user_input, MAX_INPUT_TOKENS, tokenizer
     )
-    collected_messages = []
-    panel_width = min(console.width, config.DEFAULT_COLUMN_WIDTH)
-    output_panel = Panel(
-        "",
-        title="[bold blue]DeveloperGPT[/bold blue]",
-        title_align="left",
-        width=panel_width,
+    with profiling.span("gemini request"):
+        response = aio.run(
+            chat_session.send_message_async(
+                user_input,
+                stream=True,
+                generation_config=genai.types.GenerationConfig(temperature=temperature),
+            )
+        )
+    streaming.stream_chat_response(
+        (chunk.text for chunk in aio.iterate(response)), console  # type: ignore
     )
-    with Live(output_panel, refresh_per_second=4):
-        for chunk in response:  # type: ignore
-            msg = chunk.text
-            if msg:
-                collected_messages.append(msg)
-                output_panel.renderable = Markdown(
-                    "".join(collected_messages), inline_code_theme="monokai"
-                )
+    usage = getattr(response, "usage_metadata", None)
+    tokenizer.observe(n_input_tokens, usage.prompt_token_count if usage else None)
+
+
+def _stream_command(gemini_model: GenerativeModel, contents: list):
+    with profiling.span("gemini request"):
+        return aio.run(
+            gemini_model.generate_content_async(
+                contents=contents,
+                generation_config=genai.types.GenerationConfig(
+                    temperature=config.CMD_TEMP
+                ),
+                safety_settings=GEMINI_SAFETY_SETTING,
+                stream=True,
+            )
+        )
 
 
 def model_command(
-    *, user_input: str, console: Console, fast_mode: bool, model: str
+    *,
+    user_input: str,
+    console: Console,
+    fast_mode: bool,
+    model: str,
+    outcomes: Optional[Counter] = None,
 ) -> str:
     """
     Get model command suggestion.
@@ -172,43 +360,52 @@ def model_command(
         console (Console): The console object for displaying status messages.
         fast_mode (bool): Flag indicating whether to use fast mode or not.
         model (str): The model to use for generating the response.
+        outcomes (Optional[Counter]): Counts how the command JSON was resolved (see json_repair).
 
     Returns:
         str: The generated response as a string, or None if no response is generated.
     """
-    gemini_model = GenerativeModel(config.GOOGLE_MODEL_MAP[model])
+    base_msgs = BASE_INPUT_CMD_MSGS_FAST if fast_mode else BASE_INPUT_CMD_MSGS
+    request = format_user_request(user_input)
+    gemini_model = get_model(model)
 
-    if fast_mode:
-        input_messages = list(BASE_INPUT_CMD_MSGS_FAST)
-    else:
-        input_messages = list(BASE_INPUT_CMD_MSGS)
+    # the static few-shot prefix is uploaded once and referenced by later requests
+    prefix = cached_prefix(model, base_msgs)
+    response = None
+    if prefix is not None:
+        try:
+            response = _stream_command(_cached_prefix_model(prefix), [request])
+        except (google_exceptions.NotFound, google_exceptions.PermissionDenied):
+            # the cached prefix expired or was deleted on the server -> send it inline
+            context_cache().remove(prefix.key)
+    if response is None:
+        response = _stream_command(gemini_model, base_msgs + [request])
 
-    input_messages.append(format_user_request(user_input))
+    raw_output = streaming.stream_command_response(
+        (chunk.text for chunk in aio.iterate(response)), console, fast_mode
+    )
 
-    with console.status("[bold blue]Decoding request") as _:
-        response = gemini_model.generate_content(
-            contents=input_messages,
-            generation_config=genai.types.GenerationConfig(temperature=config.CMD_TEMP),
-            safety_settings=GEMINI_SAFETY_SETTING,
-        )
-        raw_output = utils.clean_model_output(response.text)
-        try:
-            _ = json.loads(raw_output)
-            # valid JSON -> return the cleaned output
-            return raw_output
-        except json.decoder.JSONDecodeError as e:
-            # invalid JSON -> ask model to fix JSON
-            fix_json_request = {
-                "role": "user",
-                "parts": [
-                    f"The following JSON cannot be parsed ({e}). Please fix any errors in the JSON and return it (only return the fixed JSON itself). The output should only be a single valid JSON block:\n {raw_output}"
-                ],
-            }
-            response_2 = gemini_model.generate_content(
-                contents=[fix_json_request],
-                generation_config=genai.types.GenerationConfig(
-                    temperature=config.CMD_TEMP
-                ),
-                safety_settings=GEMINI_SAFETY_SETTING,
-            )
-            return utils.clean_model_output(response_2.text)
+    def reask(cleaned_output: str, error: str) -> str:
+        # the JSON can't be repaired locally -> ask model to fix JSON
+        fix_json_request = {
+            "role": "user",
+            "parts": [
+                f"The following JSON cannot be parsed ({error}). Please fix any errors in the JSON and return it (only return the fixed JSON itself). The output should only be a single valid JSON block:\n {cleaned_output}"
+            ],
+        }
+        with console.status("[bold blue]Decoding request") as _:
+            with profiling.span("gemini request"):
+                response_2 = aio.run(
+                    gemini_model.generate_content_async(
+                        contents=[fix_json_request],
+                        generation_config=genai.types.GenerationConfig(
+                            temperature=config.CMD_TEMP
+                        ),
+                        safety_settings=GEMINI_SAFETY_SETTING,
+                    )
+                )
+        return response_2.text
+
+    return json_repair.resolve_command_output(
+        raw_output, fast_mode, reask, outcomes=outcomes
+    )
@@ -0,0 +1,159 @@
+"""
+DeveloperGPT by luo-anthony
+
+GBNF grammars for offline (llama.cpp) command generation.
+
+The grammars are derived from the command formats shown to the model
+(few_shot_prompts.JSON_CMD_FORMAT / JSON_CMD_FORMAT_FAST and the invalid request
+formats), so the prompt and the grammar can't drift apart. In the format templates
+a quoted placeholder ("<user input>") is any string, an unquoted placeholder
+(<Order of Command>) is any integer, other values are constants, `, ...` repeats
+the previous item and an object with placeholder keys is a string map. Sampling
+with the grammar only allows valid command JSON, and generation ends as soon as
+the top-level object is closed.
+"""
+
+import json
+import re
+from functools import lru_cache
+from typing import Any, Dict, List
+
+from developergpt import few_shot_prompts
+
+INTEGER_PLACEHOLDER = "<<integer>>"
+
+# shared rules
+STRING_RULE = r'string ::= "\"" ( [^"\\\x7F\x00-\x1F] | "\\" ( ["\\/bfnrt] | "u" [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] ) )* "\""'
+INTEGER_RULE = 'integer ::= "-"? [0-9]+'
+WS_RULE = r"ws ::= [ \t\n]*"
+
+
+def _is_placeholder(value: Any) -> bool:
+    return isinstance(value, str) and value.startswith("<") and value.endswith(">")
+
+
+def _schema(value: Any) -> dict:
+    """JSON schema of a parsed format template value."""
+    if value == INTEGER_PLACEHOLDER:
+        return {"type": "integer"}
+    if _is_placeholder(value):
+        return {"type": "string"}
+    if isinstance(value, list):
+        items = [_schema(v) for v in value]
+        if not items or any(item != items[0] for item in items):
+            raise ValueError(f"Format template list items differ: {value}")
+        return {"type": "array", "items": items[0], "minItems": 1}
+    if isinstance(value, dict):
+        if value and all(_is_placeholder(k) for k in value):
+            return {
+                "type": "object",
+                "additionalProperties": _schema(next(iter(value.values()))),
+            }
+        return {
+            "type": "object",
+            "properties": {k: _schema(v) for k, v in value.items()},
+            "required": list(value),
+        }
+    return {"const": value}
+
+
+def format_schema(cmd_format: str) -> dict:
+    """
+    Derive the JSON schema of a command format template.
+
+    Args:
+        cmd_format (str): A format template from few_shot_prompts, e.g. JSON_CMD_FORMAT.
+
+    Returns:
+        dict: The JSON schema of the format (properties keep the template order).
+    """
+    text = re.sub(r",\s*\.\.\.", "", cmd_format)
+    text = re.sub(r'(?<!")<[^<>"]+>(?!")', json.dumps(INTEGER_PLACEHOLDER), text)
+    return _schema(json.loads(text))
+
+
+def command_schema(fast_mode: bool) -> dict:
+    """JSON schema of a command response: the command format or the invalid request format."""
+    if fast_mode:
+        formats = (
+            few_shot_prompts.JSON_CMD_FORMAT_FAST,
+            few_shot_prompts.JSON_INVALID_FORMAT_FAST,
+        )
+    else:
+        formats = (
+            few_shot_prompts.JSON_CMD_FORMAT,
+            few_shot_prompts.JSON_INVALID_FORMAT,
+        )
+    return {"anyOf": [format_schema(f) for f in formats]}
+
+
+def _literal(text: str) -> str:
+    return json.dumps(text)
+
+
+class _GrammarBuilder:
+    """Converts the JSON schema subset used by the command formats to GBNF rules."""
+
+    def __init__(self):
+        self.rules: Dict[str, str] = {}
+
+    def rule(self, name: str, schema: dict) -> str:
+        """Add a rule for the schema and return the expression that references it."""
+        if "const" in schema:
+            return _literal(json.dumps(schema["const"]))
+        if schema.get("type") == "string":
+            return "string"
+        if schema.get("type") == "integer":
+            return "integer"
+
+        if "anyOf" in schema:
+            body = " | ".join(
+                self.rule(f"{name}-{i}", s) for i, s in enumerate(schema["anyOf"])
+            )
+        elif schema.get("type") == "array":
+            item = self.rule(f"{name}-item", schema["items"])
+            body = f'"[" ws {item} ( ws "," ws {item} )* ws "]"'
+        elif "additionalProperties" in schema:
+            value = self.rule(f"{name}-value", schema["additionalProperties"])
+            pair = f'string ws ":" ws {value}'
+            body = f'"{{" ws ( {pair} ( ws "," ws {pair} )* )? ws "}}"'
+        elif schema.get("type") == "object":
+            members: List[str] = []
+            for key, value_schema in schema["properties"].items():
+                value = self.rule(f"{name}-{key.replace('_', '-')}", value_schema)
+                members.append(f'{_literal(json.dumps(key))} ws ":" ws {value}')
+            body = '"{" ws ' + ' ws "," ws '.join(members) + ' ws "}"'
+        else:
+            raise ValueError(f"Unsupported schema: {schema}")
+
+        self.rules[name] = body
+        return name
+
+    def grammar(self, schema: dict) -> str:
+        self.rule("root", schema)
+        rules = [f"{name} ::= {body}" for name, body in self.rules.items()]
+        # rules are added after the rules they reference, list root first
+        rules.insert(0, rules.pop())
+        return "\n".join(rules + [STRING_RULE, INTEGER_RULE, WS_RULE]) + "\n"
+
+
+@lru_cache(maxsize=None)
+def command_gbnf(fast_mode: bool) -> str:
+    """
+    GBNF grammar for offline command responses.
+
+    Args:
+        fast_mode (bool): Whether to use the fast format (commands without explanations).
+
+    Returns:
+        str: The grammar, the root rule matches exactly one command response object.
+    """
+    return _GrammarBuilder().grammar(command_schema(fast_mode))
+
+
+@lru_cache(maxsize=None)
+def command_grammar(fast_mode: bool) -> Any:
+    """The parsed llama_cpp.LlamaGrammar of command_gbnf, parsed once per process."""
+    from llama_cpp import LlamaGrammar
+
+    return LlamaGrammar.from_string(command_gbnf(fast_mode), verbose=False)
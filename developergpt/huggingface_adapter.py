@@ -2,30 +2,25 @@
 DeveloperGPT by luo-anthony
 """
 
-import json
+import functools
 import re
 import sys
-from typing import Optional
+import threading
+from collections import Counter
+from typing import Iterable, Iterator, Optional
 
 import requests
 from huggingface_hub import InferenceClient
 from huggingface_hub import errors as hf_errors
+from huggingface_hub.utils import get_session, hf_raise_for_status
 from rich.console import Console
-from rich.live import Live
-from rich.markdown import Markdown
-from rich.panel import Panel
 
-# using: https://pypi.org/project/text-generation/
-from text_generation import InferenceAPIClient, errors
-
-from developergpt import config, few_shot_prompts, utils
+from developergpt import config, few_shot_prompts, json_repair, profiling, streaming
 from developergpt.few_shot_prompts import (
-    INITIAL_USER_CMD_MSG,
-    INITIAL_USER_CMD_MSG_FAST,
-)
-from developergpt.openai_adapter import (
     BASE_INPUT_CMD_MSGS,
     BASE_INPUT_CMD_MSGS_FAST,
+    INITIAL_USER_CMD_MSG,
+    INITIAL_USER_CMD_MSG_FAST,
     format_user_request,
 )
 
@@ -33,6 +28,94 @@ TIMEOUT: int = 30  # seconds
 MAX_RESPONSE_TOKENS = 784
 MAX_HISTORY = 8  # number of user/assistant output pairs to keep in chat history
 
+
+class _InferenceClient(InferenceClient):
+    """
+    InferenceClient that keeps the HTTP response of the last stream a thread started.
+    text_generation(stream=True) only returns the lines of the response, closing their
+    generator leaves the response (and its pooled connection) open.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._local = threading.local()
+
+    def _inner_post(self, request_parameters, *, stream: bool = False):
+        if not stream:
+            return super()._inner_post(request_parameters, stream=False)
+        # as InferenceClient._inner_post, keeping the response
+        try:
+            response = get_session().post(
+                request_parameters.url,
+                json=request_parameters.json,
+                data=request_parameters.data,
+                headers=request_parameters.headers,
+                cookies=self.cookies,
+                timeout=self.timeout,
+                stream=True,
+                proxies=self.proxies,
+            )
+        except TimeoutError as error:
+            raise hf_errors.InferenceTimeoutError(
+                f"Inference call timed out: {request_parameters.url}"
+            ) from error
+        try:
+            hf_raise_for_status(response)
+        except Exception:
+            response.close()
+            raise
+        self._local.response = response
+        return response.iter_lines()
+
+    def pop_stream_response(self) -> requests.Response:
+        """The HTTP response of the stream the current thread started last."""
+        response = self._local.response
+        self._local.response = None
+        return response
+
+
+def _closing(stream: Iterable, response: requests.Response) -> Iterator:
+    """Iterate a stream, closing its HTTP response once the stream is done or closed."""
+    try:
+        yield from stream
+    finally:
+        # a fully read response releases its connection to the pool (keep-alive), an
+        # unfinished one closes the connection, so the server stops generating
+        response.close()
+
+
+class HuggingFaceBackend:
+    """
+    Inference API client of a model, created once per (model, API token) and shared by
+    all command, chat and summary requests to the model. The requests go through the
+    pooled requests session of huggingface_hub, which keeps the connection to the
+    Inference API alive between chat turns.
+    """
+
+    def __init__(self, model: str, api_token: Optional[str]):
+        self.model = model
+        self.instruct_model = model in config.HF_INSTRUCT_MODELS
+        self.client = _InferenceClient(
+            config.HF_MODEL_MAP[model], token=api_token, timeout=TIMEOUT
+        )
+
+    def generate_stream(self, prompt: str, **kwargs) -> Iterator:
+        """
+        Stream the generated tokens (with details, e.g. whether a token is special). Closing
+        the stream closes the HTTP response.
+        """
+        stream = self.client.text_generation(
+            prompt, stream=True, details=True, **kwargs
+        )
+        return _closing(stream, self.client.pop_stream_response())
+
+
+@functools.lru_cache(maxsize=None)
+def get_backend(model: str, api_token: Optional[str]) -> HuggingFaceBackend:
+    """The backend of a model and API token, created on first use."""
+    return HuggingFaceBackend(model, api_token)
+
+
 ### Helper Functions and Prompts for Foundation Models and Non-Chat Completion Models ###
 
 HF_CMD_PROMPT_COMPLETION_MODEL = """The following is a software development command line system that allows a user to get the command(s) to execute their request in natural language. 
@@ -124,9 +207,10 @@ def model_command(
     *,
     user_input: str,
     console: Console,
-    api_token: Optional[str],
+    client: HuggingFaceBackend,
     fast_mode: bool,
     model: str,
+    outcomes: Optional[Counter] = None,
 ) -> str:
     """
     Get command suggestion from model.
@@ -134,39 +218,38 @@ def model_command(
     Args:
         user_input (str): The user natural language command request
         console (Console): The console object for printing output.
-        api_token (Optional[str]): The API token for accessing the Hugging Face Inference API.
+        client (HuggingFaceBackend): The model's Hugging Face Inference API backend.
         fast_mode (bool): Flag indicating whether to use fast mode for the command execution.
         model (str): The name of the LLM to use.
+        outcomes (Optional[Counter]): Counts how the command JSON was resolved (see json_repair).
 
     Returns:
         str: The output of the command execution.
     """
-    model_name = config.HF_MODEL_MAP[model]
-    instruct_model = model in config.HF_INSTRUCT_MODELS
-
     try:
-        if instruct_model:
+        if client.instruct_model:
             cmd_output = _instruct_model_command(
                 user_input=user_input,
                 console=console,
-                api_token=api_token,
+                client=client,
                 fast_mode=fast_mode,
                 model=model,
+                outcomes=outcomes,
             )
         else:
             cmd_output = _foundation_model_command(
                 user_input=user_input,
                 console=console,
-                api_token=api_token,
+                client=client,
                 fast_mode=fast_mode,
-                model_name=model_name,
+                outcomes=outcomes,
             )
-        return utils.clean_model_output(cmd_output)
-    except (hf_errors.InferenceTimeoutError, errors.RateLimitExceededError) as e:
+        return cmd_output
+    except (hf_errors.InferenceTimeoutError, hf_errors.OverloadedError) as e:
         console.print(
             "[bold red]Hugging Face Inference API request timed out or is unavailable. Try again later.[/bold red]"
         )
-    except errors.BadRequestError as e:
+    except (hf_errors.BadRequestError, hf_errors.ValidationError) as e:
         console.print(
             f"[bold red]Hugging Face Inference API returned a bad request. {e}[/bold red]"
         )
@@ -183,9 +266,10 @@ def _instruct_model_command(
     *,
     user_input: str,
     console: Console,
-    api_token: Optional[str],
+    client: HuggingFaceBackend,
     fast_mode: bool,
     model: str,
+    outcomes: Optional[Counter] = None,
 ) -> str:
     """
     Instruction-Tuned Model Command using huggingface inference API
@@ -193,82 +277,86 @@ def _instruct_model_command(
     Args:
         user_input (str): The user input to be processed by the model.
         console (Console): The console object for displaying status messages.
-        api_token (Optional[str]): The API token for authentication (optional).
+        client (HuggingFaceBackend): The model's Hugging Face Inference API backend.
         fast_mode (bool): Flag indicating whether to use fast mode or not.
         model (str): The name of the model to be used.
 
     Returns:
         str: The generated response from the model.
     """
-    model_name = config.HF_MODEL_MAP[model]
     chat_completion_model = model in config.HF_CHAT_COMPLETION_MODELS
-    client = InferenceClient(model_name, token=api_token, timeout=TIMEOUT)
-
-    with console.status("[bold blue]Decoding request") as _:
-        if chat_completion_model:
-            if fast_mode:
-                input_messages = list(BASE_INPUT_CMD_MSGS_FAST[1:])
-            else:
-                input_messages = list(BASE_INPUT_CMD_MSGS[1:])
-            input_messages.append(format_user_request(user_input))
-            response = client.chat_completion(
+
+    if chat_completion_model:
+        if fast_mode:
+            input_messages = list(BASE_INPUT_CMD_MSGS_FAST[1:])
+        else:
+            input_messages = list(BASE_INPUT_CMD_MSGS[1:])
+        input_messages.append(format_user_request(user_input))
+        chunks = (
+            chunk.choices[0].delta.content
+            for chunk in client.client.chat_completion(
                 input_messages,
                 max_tokens=MAX_RESPONSE_TOKENS,
                 temperature=config.CMD_TEMP,
+                stream=True,
             )
-            raw_output = response.choices[0].message.content
-        else:
-            if fast_mode:
-                model_input = (
-                    INITIAL_USER_CMD_MSG_FAST
-                    + "\n"
-                    + "\n".join(
-                        HF_EXAMPLE_CMDS_FAST + [format_user_cmd_request(user_input)]
-                    )
-                    + "\nAssistant:"
-                )
-            else:
-                model_input = (
-                    INITIAL_USER_CMD_MSG
-                    + "\n"
-                    + "\n".join(HF_EXAMPLE_CMDS + [format_user_cmd_request(user_input)])
-                    + "\nAssistant:"
+        )
+    else:
+        if fast_mode:
+            model_input = (
+                INITIAL_USER_CMD_MSG_FAST
+                + "\n"
+                + "\n".join(
+                    HF_EXAMPLE_CMDS_FAST + [format_user_cmd_request(user_input)]
                 )
-            raw_output = client.text_generation(
+                + "\nAssistant:"
+            )
+        else:
+            model_input = (
+                INITIAL_USER_CMD_MSG
+                + "\n"
+                + "\n".join(HF_EXAMPLE_CMDS + [format_user_cmd_request(user_input)])
+                + "\nAssistant:"
+            )
+        with profiling.span("huggingface request"):
+            chunks = client.client.text_generation(
                 model_input,
                 max_new_tokens=MAX_RESPONSE_TOKENS,
                 temperature=config.CMD_TEMP,
                 stop_sequences=["User:"],
+                stream=True,
             )
-        raw_output = utils.clean_model_output(raw_output)
-        try:
-            _ = json.loads(raw_output)
-            # valid JSON -> return the cleaned output
-            return raw_output
-        except json.decoder.JSONDecodeError as e:
-            # invalid JSON -> ask model to extract and fix the JSON
-            extract_json_request = f"""
-The following JSON cannot be parsed ({e}).
+    raw_output = streaming.stream_command_response(chunks, console, fast_mode)
+
+    def reask(cleaned_output: str, error: str) -> str:
+        # the JSON can't be repaired locally -> ask model to extract and fix the JSON
+        extract_json_request = f"""
+The following JSON cannot be parsed ({error}).
 Please fix any errors in the JSON and return it (only return the fixed JSON itself).
 The output should only be a single valid JSON block:\n
-{raw_output}
+{cleaned_output}
             """
-            second_attempt = client.text_generation(
-                extract_json_request,
-                max_new_tokens=MAX_RESPONSE_TOKENS,
-                temperature=config.CMD_TEMP,
-                stop_sequences=["User:"],
-            )
-            return second_attempt
+        with console.status("[bold blue]Decoding request") as _:
+            with profiling.span("huggingface request"):
+                return client.client.text_generation(
+                    extract_json_request,
+                    max_new_tokens=MAX_RESPONSE_TOKENS,
+                    temperature=config.CMD_TEMP,
+                    stop_sequences=["User:"],
+                )
+
+    return json_repair.resolve_command_output(
+        raw_output, fast_mode, reask, outcomes=outcomes
+    )
 
 
 def _foundation_model_command(
     *,
     user_input: str,
     console: Console,
-    api_token: Optional[str],
+    client: HuggingFaceBackend,
     fast_mode: bool,
-    model_name: str,
+    outcomes: Optional[Counter] = None,
 ) -> str:
     """
     Foundation Model Command using different prompts and text_generation api
@@ -276,14 +364,12 @@ def _foundation_model_command(
     Args:
         user_input (str): The user input for the command.
         console (Console): The console object for displaying status messages.
-        api_token (Optional[str]): The API token for authentication (optional).
+        client (HuggingFaceBackend): The model's Hugging Face Inference API backend.
         fast_mode (bool): Flag indicating whether to use fast mode or not.
-        model_name (str): The name of the model to use for generating responses.
 
     Returns:
         str: The generated text response from the model.
     """
-    client = InferenceAPIClient(model_name, token=api_token, timeout=TIMEOUT)
 
     if fast_mode:
         messages = list(HF_EXAMPLE_CMDS_FAST)
@@ -295,13 +381,17 @@ def _foundation_model_command(
         HF_CMD_PROMPT_COMPLETION_MODEL + "\n" + "\n".join(messages) + "\nAssistant:"
     )
 
-    with console.status("[bold blue]Decoding request") as _:
-        return client.generate(
+    with profiling.span("huggingface request"):
+        responses = client.generate_stream(
             model_input,
             max_new_tokens=MAX_RESPONSE_TOKENS,
             stop_sequences=["User:"],
             temperature=config.CMD_TEMP,
-        ).generated_text
+        )
+    raw_output = streaming.stream_command_response(
+        (r.token.text for r in responses if not r.token.special), console, fast_mode
+    )
+    return json_repair.resolve_command_output(raw_output, fast_mode, outcomes=outcomes)
 
 
 def get_model_chat_response(
@@ -309,7 +399,7 @@ def get_model_chat_response(
     user_input: str,
     console: Console,
     input_messages: list,
-    api_token: Optional[str],
+    client: HuggingFaceBackend,
     temperature: float,
     model: str,
 ) -> list:
@@ -320,51 +410,39 @@ def get_model_chat_response(
         user_input (str): The user's input message.
         console (Console): The console object for printing messages.
         input_messages (list): The list of input messages exchanged in the chat.
-        api_token (Optional[str]): The API token for accessing the Hugging Face Inference API.
+        client (HuggingFaceBackend): The model's Hugging Face Inference API backend.
         temperature (float): The temperature value for controlling the randomness of the model's output.
         model (str): The name of the model to use.
 
     Returns:
         list: The list of chat messages exchanged between the user and the model.
     """
-    model_name = config.HF_MODEL_MAP[model]
-    instruct_model = model in config.HF_INSTRUCT_MODELS
-
-    output_panel = Panel(
-        "",
-        title="[bold blue]DeveloperGPT[/bold blue]",
-        title_align="left",
-        width=min(console.width, config.DEFAULT_COLUMN_WIDTH),
-    )
-
     input_messages.append(format_user_input(user_input))
     try:
-        if instruct_model:
+        if client.instruct_model:
             messages = _instruct_mode_chat(
-                output_panel=output_panel,
+                console=console,
                 input_messages=input_messages,
-                api_token=api_token,
+                client=client,
                 temperature=temperature,
-                model_name=model_name,
             )
         else:
             messages = _foundation_model_chat(
-                output_panel=output_panel,
+                console=console,
                 input_messages=input_messages,
-                api_token=api_token,
+                client=client,
                 temperature=temperature,
-                model_name=model_name,
             )
         if len(messages) > MAX_HISTORY:
             # remove oldest 1 user/assistant output pair
             messages = messages[2:]
         return messages
 
-    except (hf_errors.InferenceTimeoutError, errors.RateLimitExceededError) as e:
+    except (hf_errors.InferenceTimeoutError, hf_errors.OverloadedError) as e:
         console.print(
             "[bold red]Hugging Face Inference API request timed out or is unavailable. Try again later.[/bold red]"
         )
-    except errors.BadRequestError as e:
+    except (hf_errors.BadRequestError, hf_errors.ValidationError) as e:
         console.print(
             f"[bold red]Hugging Face Inference API returned a bad request. {e}[/bold red]"
         )
@@ -377,49 +455,94 @@ def get_model_chat_response(
     sys.exit(-1)
 
 
+def summarize_conversation(
+    *,
+    transcript: str,
+    client: HuggingFaceBackend,
+    model: str,
+    cancel: threading.Event,
+) -> Optional[str]:
+    """
+    Summarize old chat turns for context compaction (runs in a background thread).
+
+    Args:
+        transcript (str): The chat turns to summarize.
+        client (HuggingFaceBackend): The model's Hugging Face Inference API backend.
+        model (str): The (instruction-tuned) chat model.
+        cancel (threading.Event): Set when the summary is no longer wanted.
+
+    Returns:
+        Optional[str]: The summary, or None if cancelled.
+    """
+    model_input = (
+        few_shot_prompts.SUMMARY_SYS_MSG
+        + "\n"
+        + format_user_input(few_shot_prompts.format_summary_request(transcript))
+        + "\nAssistant: "
+    )
+    summary = client.client.text_generation(
+        model_input,
+        max_new_tokens=config.SUMMARY_MAX_TOKENS,
+        stop_sequences=["\nUser:"],
+    )
+    if cancel.is_set():
+        return None
+    return summary.split("\nUser:")[0].strip()
+
+
+def _stream_until_user_turn(responses: Iterable) -> Iterator[str]:
+    """Yield the streamed response text until the model starts the next "User:" turn."""
+    # don't show "User:" in the live output
+    scanner = streaming.StopSequenceScanner(["User:"])
+    try:
+        for response in responses:
+            if response.token.special:
+                continue
+            text = scanner.feed(response.token.text)
+            if text:
+                yield text
+            if scanner.stopped:
+                return
+        yield scanner.flush()
+    finally:
+        close = getattr(responses, "close", None)
+        if close is not None:
+            # closing the backend's stream closes its HTTP response, so the server stops
+            # generating (see HuggingFaceBackend.generate_stream)
+            close()
+
+
 def _instruct_mode_chat(
     *,
-    output_panel: Panel,
+    console: Console,
     input_messages: list,
-    api_token: Optional[str],
+    client: HuggingFaceBackend,
     temperature: float,
-    model_name: str,
 ) -> list:
     """
     Perform chat conversation with instruction-tuned model.
 
     Args:
-        output_panel (Panel): The output panel to display the chat messages.
+        console (Console): The console object for displaying the chat messages.
         input_messages (list): The list of input messages from the user.
-        api_token (Optional[str]): The API token for authentication (optional).
+        client (HuggingFaceBackend): The model's Hugging Face Inference API backend.
         temperature (float): The temperature parameter for text generation.
-        model_name (str): The name of the model to use for text generation.
 
     Returns:
         list: The updated list of input messages, including the assistant's response.
     """
-    client = InferenceClient(model_name, token=api_token, timeout=TIMEOUT)
     model_input = "\n".join(input_messages) + "\nAssistant: "
 
-    output_text = ""
-    with Live(output_panel, refresh_per_second=4):
-        for response in client.text_generation(
+    with profiling.span("huggingface request"):
+        responses = client.generate_stream(
             model_input,
             max_new_tokens=MAX_RESPONSE_TOKENS,
             temperature=temperature,
             stop_sequences=["\nUser:"],
-            stream=True,
-            details=True,
-        ):
-            if not response.token.special:
-                output_text += response.token.text
-                # don't show "User:" in the live output
-                idx = output_text.find("User:")
-                if idx > 0:
-                    output_text = output_text[:idx].strip()
-                output_panel.renderable = Markdown(
-                    output_text, inline_code_theme="monokai"
-                )
+        )
+    output_text = streaming.stream_chat_response(
+        _stream_until_user_turn(responses), console
+    ).strip()
 
     input_messages.append(format_assistant_output(output_text))
     return input_messages
@@ -427,45 +550,35 @@ def _instruct_mode_chat(
 
 def _foundation_model_chat(
     *,
-    output_panel: Panel,
+    console: Console,
     input_messages: list,
-    api_token: Optional[str],
+    client: HuggingFaceBackend,
     temperature: float,
-    model_name: str,
 ) -> list:
     """
     Perform a chat conversation with the foundation model.
 
     Args:
-        output_panel (Panel): The output panel to display the chat conversation.
+        console (Console): The console object for displaying the chat conversation.
         input_messages (list): The list of input messages in the conversation.
-        api_token (Optional[str]): The API token for authentication (optional).
+        client (HuggingFaceBackend): The model's Hugging Face Inference API backend.
         temperature (float): The temperature value for controlling the randomness of the model's output.
-        model_name (str): The name of the foundation model to use.
 
     Returns:
         list: The updated list of input messages, including the assistant's response.
     """
-    client = InferenceAPIClient(model_name, token=api_token, timeout=TIMEOUT)
     model_input = HF_CHAT_PROMPT + "\n" + "\n".join(input_messages) + "\nAssistant: "
 
-    output_text = ""
-    with Live(output_panel, refresh_per_second=4):
-        for response in client.generate_stream(
+    with profiling.span("huggingface request"):
+        responses = client.generate_stream(
             model_input,
             max_new_tokens=MAX_RESPONSE_TOKENS,
             temperature=temperature,
             stop_sequences=["\nUser:"],
-        ):
-            if not response.token.special:
-                output_text += response.token.text
-                # don't show "User:" in the live output
-                idx = output_text.find("User:")
-                if idx > 0:
-                    output_text = output_text[:idx].strip()
-                output_panel.renderable = Markdown(
-                    output_text, inline_code_theme="monokai"
-                )
+        )
+    output_text = streaming.stream_chat_response(
+        _stream_until_user_turn(responses), console
+    ).strip()
 
     input_messages.append(format_assistant_output(output_text))
     return input_messages
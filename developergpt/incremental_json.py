@@ -0,0 +1,111 @@
+"""
+DeveloperGPT by luo-anthony
+
+Incremental parser for JSON that is streamed by a model.
+
+IncrementalJSONParser.value holds everything parsed so far: objects and arrays appear as
+soon as they are opened and are filled in as their members arrive, while strings,
+numbers and literals only appear once they are complete. The parser is lenient
+(text before the first `{`/`[` is skipped and invalid characters are ignored)
+because it only drives the live display; the full response is still parsed with
+json.loads once it is complete.
+"""
+
+import json
+from typing import Any, List, Optional
+
+LITERAL_CHARS = "-+.0123456789eEtruefalsn"
+
+
+class _Frame:
+    """An object or array that is still being parsed."""
+
+    __slots__ = ("container", "key", "expect_key")
+
+    def __init__(self, container: Any):
+        self.container = container
+        self.key: Optional[str] = None
+        self.expect_key = isinstance(container, dict)
+
+
+class IncrementalJSONParser:
+    """Parses a single JSON document that arrives in chunks."""
+
+    def __init__(self):
+        self.value: Any = None
+        self.done = False  # the top-level value is complete
+        self._stack: List[_Frame] = []
+        self._string: Optional[List[str]] = None  # raw characters of an open string
+        self._escaped = False
+        self._literal = ""
+
+    def feed(self, text: str) -> None:
+        for char in text:
+            if self.done:
+                return
+            self._feed_char(char)
+
+    def _feed_char(self, char: str) -> None:
+        if self._string is not None:
+            if self._escaped:
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == '"':
+                raw, self._string = "".join(self._string), None
+                try:
+                    self._add(json.loads(f'"{raw}"'))
+                except ValueError:
+                    self._add(raw)
+                return
+            self._string.append(char)
+            return
+
+        if self._literal:
+            if char in LITERAL_CHARS:
+                self._literal += char
+                return
+            literal, self._literal = self._literal, ""
+            try:
+                self._add(json.loads(literal))
+            except ValueError:
+                pass
+
+        if not self._stack:
+            # skip anything before the top-level value (e.g. a ```json fence)
+            if char in "{[":
+                self._open({} if char == "{" else [])
+            return
+
+        frame = self._stack[-1]
+        if char == '"':
+            self._string = []
+        elif char in "{[":
+            self._open({} if char == "{" else [])
+        elif char in "}]":
+            self._stack.pop()
+            if not self._stack:
+                self.done = True
+        elif char == ":":
+            frame.expect_key = False
+        elif char == ",":
+            frame.expect_key = isinstance(frame.container, dict)
+        elif char in LITERAL_CHARS:
+            self._literal = char
+
+    def _open(self, container: Any) -> None:
+        self._add(container)
+        self._stack.append(_Frame(container))
+
+    def _add(self, value: Any) -> None:
+        if not self._stack:
+            self.value = value
+            return
+        frame = self._stack[-1]
+        if isinstance(frame.container, list):
+            frame.container.append(value)
+        elif frame.expect_key:
+            frame.key = str(value)
+        elif frame.key is not None:
+            frame.container[frame.key] = value
+            frame.key = None
@@ -0,0 +1,154 @@
+"""
+DeveloperGPT by luo-anthony
+
+Interactive terminal UI (prompt_toolkit input prompts and inquirer menus).
+This module is only imported on interactive paths so one-shot commands don't pay for it.
+"""
+
+import os
+import sys
+from typing import Optional
+
+import inquirer
+from prompt_toolkit import PromptSession
+from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
+from prompt_toolkit.completion import Completer, Completion
+from prompt_toolkit.key_binding import KeyBindings
+from prompt_toolkit.key_binding.key_processor import KeyPressEvent
+from prompt_toolkit.keys import Keys
+from prompt_toolkit.shortcuts import CompleteStyle
+from prompt_toolkit.styles import Style
+from rich.console import Console
+
+INPUT_STYLE = Style.from_dict(
+    {
+        "prompt": "bold ansigreen",
+    }
+)
+
+kb = KeyBindings()
+
+
+@kb.add(Keys.Enter, eager=True)
+def _(event: KeyPressEvent):
+    buff = event.app.current_buffer
+    if buff.complete_state:
+        # during completion, enter will select the current completion instead of submitting input
+        if buff.complete_state.current_completion:
+            buff.apply_completion(buff.complete_state.current_completion)
+            return  # don't submit input
+    buff.validate_and_handle()
+
+
+_session: Optional[PromptSession] = None
+
+
+def get_session() -> PromptSession:
+    """Get the shared prompt session (created on first use)."""
+    global _session
+    if _session is None:
+        _session = PromptSession()
+    return _session
+
+
+def add_history(user_input: str) -> None:
+    """Add user input that was passed on the command line to the prompt history."""
+    get_session().history.append_string(user_input)
+
+
+def prompt_user_input(
+    input_request: str,
+    console: Console,
+    completer=None,
+    complete_style=None,
+    auto_suggest=None,
+    key_bindings=None,
+) -> str:
+    """Prompt the user for input and handle exit if requested."""
+    user_input = (
+        get_session()
+        .prompt(
+            input_request,
+            style=INPUT_STYLE,
+            completer=completer,
+            complete_style=complete_style,
+            auto_suggest=auto_suggest,
+            key_bindings=key_bindings,
+        )
+        .strip()
+    )
+
+    if len(user_input) == 0:
+        return ""
+
+    if user_input.lower() == "quit" or user_input.lower() == "exit":
+        console.print("[bold blue]Exiting... [/bold blue]")
+        sys.exit(0)
+
+    return user_input
+
+
+def prompt_chat_input(console: Console) -> str:
+    """Prompt the user for the next chat message."""
+    return prompt_user_input("Chat: ", console, auto_suggest=AutoSuggestFromHistory())
+
+
+def prompt_cmd_input(input_request: str, console: Console) -> str:
+    """Prompt the user for a command request with file path completion."""
+    return prompt_user_input(
+        input_request,
+        console,
+        completer=PathCompleter(),
+        complete_style=CompleteStyle.MULTI_COLUMN,
+        key_bindings=kb,
+    )
+
+
+def select_option(message: str, options: list) -> str:
+    """Let the user pick one of the options from a list menu."""
+    questions = [inquirer.List("Next", message=message, choices=options)]
+    return inquirer.prompt(questions)["Next"]  # type: ignore
+
+
+class PathCompleter(Completer):
+    """A completer for file paths for terminal input."""
+
+    def get_completions(self, document, complete_event):
+        if complete_event.completion_requested:
+            # only display completions when the user presses tab
+            cwd = os.getcwd()
+
+            text = document.text_before_cursor.lstrip().lower().split(" ")[-1]
+            auto_completion = []
+
+            if text.startswith("~/"):
+                f_path = os.path.expanduser(text)
+            elif text.startswith("/"):
+                f_path = text
+            else:
+                f_path = os.path.join(cwd, text)
+
+            curr_dir = os.path.dirname(f_path)
+            fname = os.path.basename(f_path) if len(text) > 0 else ""
+
+            if os.path.isdir(curr_dir):
+                # Generate a list of matching file names in the current directory
+                auto_completion = [
+                    os.path.join(curr_dir, f)
+                    for f in os.listdir(curr_dir)
+                    if fname in f.lower()
+                ]
+
+            for completion in auto_completion:
+                # simplify the completion substitution if possible
+                if text.startswith("~/"):
+                    completion = completion.replace(os.path.expanduser("~/"), "~/")
+                elif cwd in completion:
+                    completion = os.path.relpath(completion, cwd)
+
+                # substitute for the full path but only display the basename of the file
+                yield Completion(
+                    completion,
+                    display=os.path.basename(completion),
+                    start_position=-len(text),
+                )
@@ -0,0 +1,315 @@
+"""
+DeveloperGPT by luo-anthony
+
+Local repair of malformed command JSON.
+
+Models regularly return almost-valid JSON for `cmd` requests: trailing commas,
+single quotes, unescaped quotes or newlines inside strings, code fences or output
+that was cut off. Instead of asking the model to fix its response (a second round
+trip), the response is parsed with a tolerant parser and checked against the known
+command formats (few_shot_prompts.JSON_CMD_FORMAT / JSON_CMD_FORMAT_FAST). Asking
+the model again is only the last resort. Callers pass a Counter to see how often
+each path runs, the cli adds it to the response cache stats (`developergpt cache`).
+"""
+
+import json
+from collections import Counter
+from typing import Any, Callable, Optional, Tuple
+
+from developergpt import utils
+
+# outcome counters
+VALID = "json_valid"  # the response was valid command JSON
+REPAIRED = "json_repaired"  # repaired locally
+REASKED = "json_reasked"  # fixed by asking the model again
+FAILED = "json_failed"  # no usable command JSON
+
+ESCAPES = {
+    '"': '"',
+    "'": "'",
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+LITERALS = {
+    "true": True,
+    "false": False,
+    "null": None,
+    "True": True,
+    "False": False,
+    "None": None,
+}
+TOKEN_CHARS = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_.+-")
+# what may follow `",` when the quote closes a string (the command formats only have
+# strings, objects and arrays after a comma)
+AFTER_COMMA = set("\"'{[]}")
+
+_SKIP = object()  # an unparseable character
+
+
+class _TolerantParser:
+    """
+    Recursive descent JSON parser that accepts common model mistakes.
+
+    Every parse method returns (value, complete). At the end of truncated input the
+    open objects and arrays are closed, incomplete strings and numbers are dropped.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+
+    def parse(self) -> Any:
+        start = self.text.find("{")
+        if start == -1:
+            return None
+        self.pos = start
+        value, _ = self._object()
+        return value
+
+    def _skip(self, chars: str = " \t\r\n") -> None:
+        while self.pos < len(self.text) and self.text[self.pos] in chars:
+            self.pos += 1
+
+    def _peek(self) -> str:
+        return self.text[self.pos] if self.pos < len(self.text) else ""
+
+    def _value(self) -> Tuple[Any, bool]:
+        self._skip()
+        c = self._peek()
+        if not c:
+            return _SKIP, False
+        if c == "{":
+            return self._object()
+        if c == "[":
+            return self._array()
+        if c in "\"'":
+            return self._string()
+        return self._token()
+
+    def _object(self) -> Tuple[dict, bool]:
+        self.pos += 1  # {
+        obj: dict = {}
+        while True:
+            self._skip(" \t\r\n,")  # tolerates trailing and repeated commas
+            c = self._peek()
+            if not c:
+                return obj, False
+            if c in "}]":
+                self.pos += 1
+                return obj, True
+            if c in "\"'":
+                key, complete = self._string()
+            else:
+                key, complete = self._token(key=True)
+            if not complete:
+                return obj, False
+            if key is _SKIP:
+                continue
+            self._skip()
+            if self._peek() == ":":
+                self.pos += 1
+            value, complete = self._value()
+            if value is not _SKIP and (complete or isinstance(value, (dict, list))):
+                obj[str(key)] = value
+            if not complete:
+                return obj, False
+
+    def _array(self) -> Tuple[list, bool]:
+        self.pos += 1  # [
+        array: list = []
+        while True:
+            self._skip(" \t\r\n,")
+            c = self._peek()
+            if not c:
+                return array, False
+            if c in "]}":
+                self.pos += 1
+                return array, True
+            value, complete = self._value()
+            if value is not _SKIP and (complete or isinstance(value, (dict, list))):
+                array.append(value)
+            if not complete:
+                return array, False
+
+    def _string(self) -> Tuple[Optional[str], bool]:
+        quote = self.text[self.pos]
+        self.pos += 1
+        chars = []
+        while self.pos < len(self.text):
+            c = self.text[self.pos]
+            if c == "\\" and self.pos + 1 < len(self.text):
+                escaped = self.text[self.pos + 1]
+                if escaped in ESCAPES:
+                    chars.append(ESCAPES[escaped])
+                    self.pos += 2
+                    continue
+                if escaped == "u":
+                    try:
+                        chars.append(
+                            chr(int(self.text[self.pos + 2 : self.pos + 6], 16))
+                        )
+                        self.pos += 6
+                        continue
+                    except ValueError:
+                        pass
+                # not a JSON escape (e.g. `find -exec rm {} \;`), keep the backslash
+                chars.append(c)
+                self.pos += 1
+            elif c == quote and self._closes_string(self.pos + 1):
+                self.pos += 1
+                return "".join(chars), True
+            else:
+                # including raw newlines and unescaped quotes inside the string
+                chars.append(c)
+                self.pos += 1
+        return None, False
+
+    def _closes_string(self, pos: int) -> bool:
+        """Whether a quote is the end of the string, judging by what follows it."""
+        while pos < len(self.text) and self.text[pos] in " \t\r\n":
+            pos += 1
+        if pos == len(self.text) or self.text[pos] in ":}]":
+            return True
+        if self.text[pos] != ",":
+            return False
+        pos += 1
+        while pos < len(self.text) and self.text[pos] in " \t\r\n":
+            pos += 1
+        return pos == len(self.text) or self.text[pos] in AFTER_COMMA
+
+    def _token(self, key: bool = False) -> Tuple[Any, bool]:
+        start = self.pos
+        while self.pos < len(self.text) and self.text[self.pos] in TOKEN_CHARS:
+            self.pos += 1
+        token = self.text[start : self.pos]
+        if not token:
+            self.pos += 1
+            return _SKIP, True
+        if self.pos == len(self.text):
+            return None, False  # possibly cut off
+        if key:
+            return token, True  # unquoted key
+        if token in LITERALS:
+            return LITERALS[token], True
+        try:
+            return int(token), True
+        except ValueError:
+            pass
+        try:
+            return float(token), True
+        except ValueError:
+            return token, True
+
+
+def _command(command: Any, fast_mode: bool) -> Any:
+    """A single command in the expected format, or None if it is unusable."""
+    if fast_mode:
+        if isinstance(command, dict):
+            command = command.get("cmd_to_execute")
+        return command if isinstance(command, str) and command.strip() else None
+
+    if isinstance(command, str):
+        command = {"cmd_to_execute": command}
+    if not isinstance(command, dict):
+        return None
+    cmd_to_execute = command.get("cmd_to_execute")
+    if not isinstance(cmd_to_execute, str) or not cmd_to_execute.strip():
+        return None
+    explanations = command.get("cmd_explanations")
+    arg_explanations = command.get("arg_explanations")
+    return {
+        **command,
+        "cmd_explanations": [e for e in (explanations or []) if isinstance(e, str)],
+        "arg_explanations": {
+            str(arg): e
+            for arg, e in (
+                arg_explanations.items() if isinstance(arg_explanations, dict) else ()
+            )
+            if isinstance(e, str)
+        },
+    }
+
+
+def repair_command_output(raw_output: str, fast_mode: bool) -> Optional[str]:
+    """
+    Repair malformed command JSON locally.
+
+    Args:
+        raw_output (str): The model response.
+        fast_mode (bool): Whether the response is in the fast format (commands without explanations).
+
+    Returns:
+        Optional[str]: The repaired command JSON, or None if the response can't be repaired.
+    """
+    data = _TolerantParser(raw_output).parse()
+    if not isinstance(data, dict):
+        return None
+    if data.get("error", 0):
+        return json.dumps(data)  # the model reported an invalid request
+    if not isinstance(data.get("commands"), list):
+        return None
+    commands = [_command(c, fast_mode) for c in data["commands"]]
+    data["commands"] = [c for c in commands if c is not None]
+    if not data["commands"]:
+        return None
+    return json.dumps(data)
+
+
+def resolve_command_output(
+    raw_output: str,
+    fast_mode: bool,
+    reask: Optional[Callable[[str, str], str]] = None,
+    outcomes: Optional[Counter] = None,
+) -> str:
+    """
+    Get command JSON from a model response, repairing it locally if needed.
+
+    Args:
+        raw_output (str): The model response.
+        fast_mode (bool): Whether the response is in the fast format.
+        reask (Optional[Callable[[str, str], str]]): Last resort, asks the model to fix the
+            (cleaned output, JSON error) and returns its new response.
+        outcomes (Optional[Counter]): Counts the outcome (VALID, REPAIRED, REASKED or FAILED).
+
+    Returns:
+        str: The command JSON, or the cleaned model output if it can't be parsed.
+    """
+    cleaned_output = utils.clean_model_output(raw_output)
+    outcome, output = _resolve(raw_output, cleaned_output, fast_mode, reask)
+    if outcomes is not None:
+        outcomes[outcome] += 1
+    return output
+
+
+def _resolve(
+    raw_output: str,
+    cleaned_output: str,
+    fast_mode: bool,
+    reask: Optional[Callable[[str, str], str]],
+) -> Tuple[str, str]:
+    try:
+        data = json.loads(cleaned_output)
+    except json.decoder.JSONDecodeError as e:
+        error = str(e)
+    else:
+        if utils.is_valid_command_response(cleaned_output) or (
+            isinstance(data, dict) and data.get("error", 0)
+        ):
+            return VALID, cleaned_output  # commands or a reported invalid request
+        error = 'the JSON has no "commands" list'
+
+    repaired = repair_command_output(raw_output, fast_mode)
+    if repaired is not None:
+        return REPAIRED, repaired
+
+    if reask is not None:
+        second_attempt = reask(cleaned_output, error)
+        repaired = repair_command_output(second_attempt, fast_mode)
+        if repaired is not None:
+            return REASKED, repaired
+    return FAILED, cleaned_output
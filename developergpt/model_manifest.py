@@ -0,0 +1,172 @@
+"""
+DeveloperGPT by luo-anthony
+
+Local manifest of downloaded offline models (GGUF files).
+
+Each entry records the path, size, sha256 and Hugging Face Hub revision of a model
+file. Offline runs resolve the model from the manifest and the file on disk only,
+the Hub is contacted to download a missing model or by `developergpt models update`.
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Any, Optional
+
+from developergpt import config, providers
+
+
+class ModelManifest:
+    """Downloaded GGUF files by file name, persisted as JSON."""
+
+    def __init__(self, path: str = config.MODEL_MANIFEST_FILE):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.entries: dict = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, llm_file: str) -> Optional[dict]:
+        entry = self.entries.get(llm_file)
+        return entry if isinstance(entry, dict) else None
+
+    def put(self, llm_file: str, entry: dict) -> None:
+        self.entries[llm_file] = entry
+        self.save()
+
+    def save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass  # the manifest can always be rebuilt from the files on disk
+
+
+def file_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def _entry(
+    model: str, path: str, sha256: Optional[str], revision: Optional[str]
+) -> dict:
+    stat = os.stat(path)
+    return {
+        "repo": config.LLAMA_CPP_MODEL_MAP[model][0],
+        "path": path,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha256": sha256,
+        "revision": revision,
+        "updated_at": time.time(),
+    }
+
+
+def resolve(model: str, manifest: Optional[ModelManifest] = None) -> Optional[str]:
+    """
+    Find the GGUF file of an offline model on disk, without contacting the Hub.
+
+    Args:
+        model (str): The offline model.
+        manifest (Optional[ModelManifest]): The manifest (defaults to the on-disk manifest).
+
+    Returns:
+        Optional[str]: The path of the model file, or None if it has not been downloaded.
+    """
+    _, llm_file, _ = config.LLAMA_CPP_MODEL_MAP[model]
+    manifest = manifest or ModelManifest()
+    entry = manifest.get(llm_file)
+    path = providers.llama_model_path(model)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if entry is None or (entry["path"], entry["size"], entry["mtime"]) != (
+        path,
+        stat.st_size,
+        stat.st_mtime,
+    ):
+        # downloaded before the manifest existed (or replaced), hashing several GB would
+        # slow down this run, so the checksum is left to `developergpt models update`
+        manifest.put(llm_file, _entry(model, path, sha256=None, revision=None))
+    return path
+
+
+def _remote_file(model: str) -> Any:
+    """Metadata (commit_hash, etag = sha256, size) of the latest model file on the Hub."""
+    from huggingface_hub import get_hf_file_metadata, hf_hub_url
+
+    repo, llm_file, _ = config.LLAMA_CPP_MODEL_MAP[model]
+    return get_hf_file_metadata(hf_hub_url(repo, llm_file))
+
+
+def download(model: str, manifest: Optional[ModelManifest] = None) -> str:
+    """
+    Download the latest GGUF file of an offline model and record it in the manifest.
+
+    Args:
+        model (str): The offline model.
+        manifest (Optional[ModelManifest]): The manifest (defaults to the on-disk manifest).
+
+    Returns:
+        str: The path of the downloaded model file.
+
+    Raises:
+        OSError: If the download fails or the file doesn't match the Hub's checksum.
+    """
+    from huggingface_hub import hf_hub_download
+
+    repo, llm_file, _ = config.LLAMA_CPP_MODEL_MAP[model]
+    manifest = manifest or ModelManifest()
+    remote = _remote_file(model)
+    path = hf_hub_download(
+        repo,
+        llm_file,
+        revision=remote.commit_hash,
+        local_dir=config.OFFLINE_MODEL_CACHE_DIR,
+    )
+    sha256 = file_sha256(path)
+    if remote.etag and sha256 != remote.etag:
+        os.remove(path)
+        raise OSError(f"Checksum mismatch for {llm_file}, the download is corrupt")
+    manifest.put(llm_file, _entry(model, path, sha256, remote.commit_hash))
+    return path
+
+
+def update(model: str, manifest: Optional[ModelManifest] = None) -> bool:
+    """
+    Download a newer revision of a downloaded model if the file changed on the Hub.
+
+    Args:
+        model (str): The offline model.
+        manifest (Optional[ModelManifest]): The manifest (defaults to the on-disk manifest).
+
+    Returns:
+        bool: True if a new model file was downloaded.
+    """
+    _, llm_file, _ = config.LLAMA_CPP_MODEL_MAP[model]
+    manifest = manifest or ModelManifest()
+    path = resolve(model, manifest)
+    if path is None:
+        return False
+    remote = _remote_file(model)
+    entry = manifest.get(llm_file) or {}
+    sha256 = entry.get("sha256") or file_sha256(path)
+    up_to_date = (
+        sha256 == remote.etag
+        if remote.etag
+        else entry.get("revision") == remote.commit_hash
+    )
+    if up_to_date:
+        manifest.put(llm_file, _entry(model, path, sha256, remote.commit_hash))
+        return False
+    download(model, manifest)
+    return True
@@ -3,98 +3,36 @@ DeveloperGPT by luo-anthony
 """
 
 import sys
-from datetime import datetime
-from typing import Optional
+import threading
+from collections import Counter
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional
 
 import openai
-from llama_cpp import Llama
-from openai import OpenAI
+from openai import AsyncOpenAI
 from rich.console import Console
-from rich.live import Live
-from rich.markdown import Markdown
-from rich.panel import Panel
 
-from developergpt import config, few_shot_prompts, utils
+from developergpt import (
+    aio,
+    config,
+    json_repair,
+    prefix_cache,
+    profiling,
+    streaming,
+    tokenizers,
+    utils,
+)
 from developergpt.few_shot_prompts import (
-    CHAT_SYS_MSG,
-    CMD_SYS_MSG,
-    INITIAL_USER_CMD_MSG,
-    INITIAL_USER_CMD_MSG_FAST,
+    BASE_INPUT_CMD_MSGS,
+    BASE_INPUT_CMD_MSGS_FAST,
+    SUMMARY_SYS_MSG,
+    format_assistant_response,
+    format_summary_request,
+    format_user_request,
 )
 
-INITIAL_CHAT_SYSTEM_MSG = {
-    "role": "system",
-    "content": CHAT_SYS_MSG,
-}
-
-INITIAL_CMD_SYSTEM_MSG = {
-    "role": "system",
-    "content": CMD_SYS_MSG,
-}
-
-
-def format_user_request(
-    user_request: str, platform: str = config.USER_PLATFORM
-) -> dict:
-    return {
-        "role": "user",
-        "content": f"""Provide the appropriate command-line commands that can be executed on a {platform} machine for the user request: "{user_request}".""",
-    }
-
-
-def format_assistant_response(assistant_response: str) -> dict:
-    return {"role": "assistant", "content": assistant_response}
-
-
-BASE_INPUT_CMD_MSGS = [
-    INITIAL_CMD_SYSTEM_MSG,
-    {"role": "user", "content": INITIAL_USER_CMD_MSG},
-    format_user_request(
-        few_shot_prompts.CONDA_REQUEST, platform=few_shot_prompts.EXAMPLE_PLATFORM
-    ),
-    format_assistant_response(few_shot_prompts.CONDA_OUTPUT_EXAMPLE),
-    format_user_request(
-        few_shot_prompts.SEARCH_REQUEST, platform=few_shot_prompts.EXAMPLE_PLATFORM
-    ),
-    format_assistant_response(
-        few_shot_prompts.SEARCH_OUTPUT_EXAMPLE,
-    ),
-    format_user_request(
-        few_shot_prompts.UNKNOWN_REQUEST, platform=few_shot_prompts.EXAMPLE_PLATFORM
-    ),
-    format_assistant_response(
-        few_shot_prompts.UNKNOWN_QUERY_OUTPUT_EXAMPLE_ONE,
-    ),
-]
-
-BASE_INPUT_CMD_MSGS_FAST = [
-    INITIAL_CMD_SYSTEM_MSG,
-    {"role": "user", "content": INITIAL_USER_CMD_MSG_FAST},
-    format_user_request(
-        few_shot_prompts.CONDA_REQUEST, platform=few_shot_prompts.EXAMPLE_PLATFORM
-    ),
-    format_assistant_response(
-        few_shot_prompts.CONDA_OUTPUT_EXAMPLE_FAST,
-    ),
-    format_user_request(
-        few_shot_prompts.SEARCH_REQUEST, platform=few_shot_prompts.EXAMPLE_PLATFORM
-    ),
-    format_assistant_response(
-        few_shot_prompts.SEARCH_OUTPUT_EXAMPLE_FAST,
-    ),
-    format_user_request(
-        few_shot_prompts.PROCESS_REQUEST, platform=few_shot_prompts.EXAMPLE_PLATFORM
-    ),
-    format_assistant_response(
-        few_shot_prompts.PROCESS_OUTPUT_EXAMPLE_FAST,
-    ),
-    format_user_request(
-        few_shot_prompts.UNKNOWN_REQUEST, platform=few_shot_prompts.EXAMPLE_PLATFORM
-    ),
-    format_assistant_response(
-        few_shot_prompts.UNKNOWN_QUERY_OUTPUT_EXAMPLE_ONE_FAST,
-    ),
-]
+if TYPE_CHECKING:
+    # llama.cpp is only imported when an offline model is selected
+    from llama_cpp import Llama
 
 
 def get_model_chat_response(
@@ -104,7 +42,7 @@ def get_model_chat_response(
     input_messages: list,
     temperature: float,
     model: str,
-    client: OpenAI | Llama,
+    client: "AsyncOpenAI | Llama",
 ) -> list:
     """
     Get the chat response from the model.
@@ -115,7 +53,7 @@ def get_model_chat_response(
         input_messages (list): The list of input messages exchanged between the user and the model.
         temperature (float): The temperature parameter for controlling the randomness of the model's output.
         model (str): The name of the model to use for generating the response.
-        client (OpenAI | Llama): The client object for making API requests to the model.
+        client (AsyncOpenAI | Llama): The client object for making API requests to the model.
 
     Returns:
         list: The updated list of input messages, including the generated response.
@@ -123,54 +61,42 @@ def get_model_chat_response(
     MAX_TOKENS = 4000
     RESERVED_OUTPUT_TOKENS = 1024
     MAX_INPUT_TOKENS = MAX_TOKENS - RESERVED_OUTPUT_TOKENS
-    # Note: llama.cpp models use OpenAI token counts as rough estimate
-    if model in config.OFFLINE_MODELS:
-        model_name = "gpt-3.5-turbo"
-    else:
-        model_name = config.OPENAI_MODEL_MAP[model]
+    # llama.cpp models count with their own tokenizer, OpenAI token counts are calibrated
+    tokenizer = tokenizers.chat_tokenizer(model, client)
 
     input_messages.append({"role": "user", "content": user_input})
     input_messages, n_input_tokens = utils.check_reduce_context(
-        input_messages, MAX_INPUT_TOKENS, model_name, ctx_removal_index=1
+        input_messages, MAX_INPUT_TOKENS, tokenizer, ctx_removal_index=1
     )
     n_output_tokens = max(RESERVED_OUTPUT_TOKENS, MAX_TOKENS - n_input_tokens)
+    usage: dict = {}
     try:
         """Get the response from the model."""
         if model in config.OPENAI_MODEL_MAP:
-            assert isinstance(client, OpenAI)
-            response = client.chat.completions.create(
-                model=model_name,
-                messages=input_messages,
-                max_tokens=n_output_tokens,
-                temperature=temperature,
-                stream=True,
-            )
+            assert isinstance(client, AsyncOpenAI)
+            with profiling.span("openai request"):
+                stream = aio.run(
+                    client.chat.completions.create(
+                        model=config.OPENAI_MODEL_MAP[model],
+                        messages=input_messages,
+                        max_tokens=n_output_tokens,
+                        temperature=temperature,
+                        stream=True,
+                        stream_options={"include_usage": True},
+                    )
+                )
+            response = aio.iterate(stream)
         else:
-            assert isinstance(client, Llama)
             response = client.create_chat_completion_openai_v1(  # type: ignore
                 messages=input_messages,
                 max_tokens=n_output_tokens,
                 temperature=temperature,
                 stream=True,
             )
-        collected_messages = []
-        panel_width = min(console.width, config.DEFAULT_COLUMN_WIDTH)
-        output_panel = Panel(
-            "",
-            title="[bold blue]DeveloperGPT[/bold blue]",
-            title_align="left",
-            width=panel_width,
+        full_response = streaming.stream_chat_response(
+            _chunk_texts(response, usage), console
         )
-        with Live(output_panel, refresh_per_second=4):
-            for chunk in response:
-                msg = chunk.choices[0].delta.content
-                if msg:
-                    collected_messages.append(msg)
-                    output_panel.renderable = Markdown(
-                        "".join(collected_messages), inline_code_theme="monokai"
-                    )
-
-        full_response = "".join(collected_messages)
+        tokenizer.observe(n_input_tokens, usage.get("prompt_tokens"))
         input_messages.append(format_assistant_response(full_response))
         return input_messages
 
@@ -182,13 +108,79 @@ def get_model_chat_response(
     sys.exit(-1)
 
 
+def _chunk_texts(chunks: Iterable, usage: dict) -> Iterator[str]:
+    """Text of streamed chat completion chunks, recording the usage sent with the last chunk."""
+    for chunk in chunks:
+        if getattr(chunk, "usage", None) is not None:
+            usage["prompt_tokens"] = chunk.usage.prompt_tokens
+        if chunk.choices:
+            yield chunk.choices[0].delta.content
+
+
+def summarize_conversation(
+    *,
+    transcript: str,
+    client: "AsyncOpenAI | Llama",
+    model: str,
+    cancel: threading.Event,
+) -> Optional[str]:
+    """
+    Summarize old chat turns for context compaction (runs in a background thread).
+
+    Args:
+        transcript (str): The chat turns to summarize.
+        client (AsyncOpenAI | Llama): The client object for making API requests to the model.
+        model (str): The chat model, OpenAI chats are summarized by the cheapest OpenAI model.
+        cancel (threading.Event): Set when the summary is no longer wanted.
+
+    Returns:
+        Optional[str]: The summary, or None if cancelled.
+    """
+    messages = [
+        {"role": "system", "content": SUMMARY_SYS_MSG},
+        {"role": "user", "content": format_summary_request(transcript)},
+    ]
+    if model in config.OPENAI_MODEL_MAP:
+        assert isinstance(client, AsyncOpenAI)
+        response = aio.run(
+            client.chat.completions.create(
+                model=config.OPENAI_MODEL_MAP[config.GPT35],
+                messages=messages,
+                max_tokens=config.SUMMARY_MAX_TOKENS,
+                temperature=0.0,
+            )
+        )
+        return None if cancel.is_set() else response.choices[0].message.content
+
+    # a summary by an offline model daemon (for an API chat) stops at the next token once
+    # cancelled; an offline chat model summarizes in the foreground, between chat requests
+    state = client.save_state() if hasattr(client, "save_state") else None
+    try:
+        summary = ""
+        for chunk in client.create_chat_completion_openai_v1(  # type: ignore
+            messages=messages,
+            max_tokens=config.SUMMARY_MAX_TOKENS,
+            temperature=0.0,
+            stream=True,
+        ):
+            if cancel.is_set():
+                return None
+            summary += chunk.choices[0].delta.content or ""
+        return summary
+    finally:
+        if state is not None:
+            # keep the evaluated chat prefix (the system message) for the next chat request
+            client.load_state(state)
+
+
 def model_command(
     *,
     user_input: str,
     console: Console,
     fast_mode: bool,
     model: str,
-    client: OpenAI | Llama,
+    client: "AsyncOpenAI | Llama",
+    outcomes: Optional[Counter] = None,
 ) -> Optional[str]:
     """
     Get command suggestion from model.
@@ -198,7 +190,8 @@ def model_command(
         console (Console): The console object for displaying status messages.
         fast_mode (bool): Flag indicating whether to use fast mode.
         model (str): The model to use for generating the response.
-        client (OpenAI | Llama): The client object for making API requests.
+        client (AsyncOpenAI | Llama): The client object for making API requests.
+        outcomes (Optional[Counter]): Counts how the command JSON was resolved (see json_repair).
 
     Returns:
         Optional[str]: The model's response as a string, or None if there is no response.
@@ -215,25 +208,40 @@ def model_command(
         response_format = (
             None if fast_mode or model == config.GPT4 else {"type": "json_object"}
         )
-        with console.status("[bold blue]Decoding request") as _:
-            if model in config.OPENAI_MODEL_MAP:
-                assert isinstance(client, OpenAI)
-                model_name = config.OPENAI_MODEL_MAP[model]
-                response = client.chat.completions.create(  # type: ignore
-                    model=model_name,
-                    messages=input_messages,
-                    max_tokens=n_output_tokens,
-                    temperature=config.CMD_TEMP,
-                    response_format=response_format,
+        if model in config.OPENAI_MODEL_MAP:
+            assert isinstance(client, AsyncOpenAI)
+            model_name = config.OPENAI_MODEL_MAP[model]
+            with profiling.span("openai request"):
+                stream = aio.run(
+                    client.chat.completions.create(  # type: ignore
+                        model=model_name,
+                        messages=input_messages,
+                        max_tokens=n_output_tokens,
+                        temperature=config.CMD_TEMP,
+                        response_format=response_format,
+                        stream=True,
+                    )
                 )
-            else:
-                assert isinstance(client, Llama)
-                response = client.create_chat_completion_openai_v1(
+            response = aio.iterate(stream)
+        else:
+            # restores the saved state of the few-shot prefix so only the request is evaluated
+            response = aio.cancellable(
+                prefix_cache.create_command_completion(
+                    client,
+                    fast_mode=fast_mode,
+                    model=model,
                     messages=input_messages,
                     max_tokens=n_output_tokens,
                     temperature=config.CMD_TEMP,
                     response_format=response_format,
+                    stream=True,
                 )
+            )
+        raw_output = streaming.stream_command_response(
+            (chunk.choices[0].delta.content for chunk in response if chunk.choices),
+            console,
+            fast_mode,
+        )
     except openai.RateLimitError:
         console.print("[bold red] Rate limit exceeded. Try again later.[/bold red]")
         sys.exit(-1)
@@ -244,23 +252,29 @@ def model_command(
         console.log(f"[bold red] OpenAI API Error: {e}[/bold red]")
         sys.exit(-1)
 
-    raw_output = response.choices[0].message.content
-    return utils.clean_model_output(raw_output) if raw_output else None
+    return (
+        json_repair.resolve_command_output(raw_output, fast_mode, outcomes=outcomes)
+        if raw_output
+        else None
+    )
 
 
-def check_open_ai_key(console: "Console", client: "OpenAI") -> None:
-    """Check if the OpenAI API key is valid."""
+def validate_open_ai_key(client: "AsyncOpenAI") -> Optional[str]:
+    """Check if the OpenAI API key is valid. Returns an error message if it is not."""
     try:
-        _ = client.models.list()
-        return
+        _ = aio.run(client.models.list())
+        return None
     except openai.AuthenticationError:
-        console.print(
-            f"[bold red]Error: Invalid OpenAI API key. Check your {config.OPEN_AI_API_KEY} environment variable.[/bold red]"
-        )
+        return f"Invalid OpenAI API key. Check your {config.OPEN_AI_API_KEY} environment variable."
     except openai.PermissionDeniedError:
-        console.print(
-            "[bold red]Error: OpenAI API Permission Denied. Your location may not be supported by OpenAI.[/bold red]"
-        )
+        return "OpenAI API Permission Denied. Your location may not be supported by OpenAI."
     except openai.APIError as e:
-        console.print(f"[bold red]Error: OpenAI API error: {e}.[/bold red]")
-    sys.exit(-1)
+        return f"OpenAI API error: {e}."
+
+
+def check_open_ai_key(console: "Console", client: "AsyncOpenAI") -> None:
+    """Check if the OpenAI API key is valid."""
+    error = validate_open_ai_key(client)
+    if error:
+        console.print(f"[bold red]Error: {error}[/bold red]")
+        sys.exit(-1)
@@ -0,0 +1,173 @@
+"""
+DeveloperGPT by luo-anthony
+
+Saved llama.cpp KV-state snapshots of the fixed few-shot `cmd` prefix.
+
+Every offline `cmd` request starts with the same few-shot conversation. Once the
+token prefix shared by two requests is known, the evaluated state of that prefix
+is saved next to the model in config.OFFLINE_MODEL_CACHE_DIR. Later runs restore
+it, and llama.cpp's own prefix matching only evaluates the user-specific suffix.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+from typing import Any, Iterator
+
+from developergpt import config, few_shot_prompts, grammars, profiling
+
+# shorter shared prefixes are not worth a snapshot
+MIN_PREFIX_TOKENS = 64
+
+
+def _longest_common_prefix(a: list, b: list) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class PrefixStateCache:
+    """Snapshot of the evaluated few-shot prefix for one (GGUF file, fast/full mode)."""
+
+    def __init__(self, client: Any, model: str, fast_mode: bool):
+        import llama_cpp
+
+        self.client = client
+        _, llm_file, chat_format = config.LLAMA_CPP_MODEL_MAP[model]
+        base_msgs = (
+            few_shot_prompts.BASE_INPUT_CMD_MSGS_FAST
+            if fast_mode
+            else few_shot_prompts.BASE_INPUT_CMD_MSGS
+        )
+        # the GGUF file name includes the quantization
+        fingerprint = json.dumps(
+            [
+                base_msgs,
+                llm_file,
+                chat_format,
+                config.OFFLINE_MODEL_CTX,
+                llama_cpp.__version__,
+            ]
+        )
+        key = hashlib.sha256(fingerprint.encode()).hexdigest()[:16]
+        self.name_prefix = (
+            f"{os.path.splitext(llm_file)[0]}-{'fast' if fast_mode else 'full'}-"
+        )
+        self.cache_dir = os.path.join(config.OFFLINE_MODEL_CACHE_DIR, "kv_states")
+        base_path = os.path.join(self.cache_dir, self.name_prefix + key)
+        self.state_path = base_path + ".state"
+        self.tokens_path = base_path + ".tokens.json"
+
+    def restore(self) -> bool:
+        """Load the prefix snapshot into a freshly loaded model. Returns True if restored."""
+        if self.client.n_tokens > 0:
+            # the model already holds an evaluated prompt, llama.cpp reuses its common prefix
+            return False
+        try:
+            with open(self.state_path, "rb") as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False
+        self.client.load_state(state)
+        return True
+
+    def record(self, n_prompt_tokens: int) -> None:
+        """
+        Record the prompt that was just evaluated and save a snapshot once the shared prefix is known.
+
+        Args:
+            n_prompt_tokens (int): Number of prompt tokens of the last request (usage.prompt_tokens).
+        """
+        if os.path.exists(self.state_path):
+            return
+        prompt_tokens = [int(t) for t in self.client.input_ids[:n_prompt_tokens]]
+        try:
+            with open(self.tokens_path) as f:
+                previous_tokens = json.load(f)
+        except (OSError, ValueError):
+            previous_tokens = None
+
+        n_prefix = (
+            _longest_common_prefix(previous_tokens, prompt_tokens)
+            if previous_tokens
+            else 0
+        )
+        if n_prefix < MIN_PREFIX_TOKENS or n_prefix == len(prompt_tokens):
+            # first (or repeated) request, wait for a different one to find the shared prefix
+            self._write(self.tokens_path, json.dumps(prompt_tokens).encode())
+            return
+
+        # KV entries are causal, so the state of the first n_prefix tokens is exactly the prefix
+        # state. Anything evaluated after it is discarded by llama.cpp when the prompt diverges.
+        n_tokens = self.client.n_tokens
+        self.client.n_tokens = n_prefix
+        state = self.client.save_state()
+        self.client.n_tokens = n_tokens
+
+        self._prune()
+        self._write(self.state_path, pickle.dumps(state))
+
+    def _prune(self) -> None:
+        """Remove recorded tokens and snapshots of outdated prefixes for the same model and mode."""
+        for fname in os.listdir(self.cache_dir):
+            if fname.startswith(self.name_prefix):
+                os.remove(os.path.join(self.cache_dir, fname))
+
+    def _write(self, path: str, data: bytes) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+def create_command_completion(
+    client: Any, *, fast_mode: bool, model: str, **kwargs
+) -> Any:
+    """
+    Run an offline command completion, reusing the saved few-shot prefix state.
+
+    Sampling is constrained to the command format grammar, so the response is valid
+    command JSON and ends with the top-level object.
+    """
+    if hasattr(client, "create_command_completion"):
+        # developergpt.daemon.DaemonClient, the daemon keeps the prefix state warm itself
+        return client.create_command_completion(
+            fast_mode=fast_mode, model=model, **kwargs
+        )
+    prefix_cache = PrefixStateCache(client, model, fast_mode)
+    try:
+        with profiling.span("restore prefix state"):
+            prefix_cache.restore()
+    except Exception:
+        # an incompatible or corrupt snapshot only costs speed, never correctness
+        client.reset()
+        os.remove(prefix_cache.state_path)
+    kwargs.pop("response_format", None)  # superseded by the grammar
+    kwargs["grammar"] = grammars.command_grammar(fast_mode)
+    if kwargs.get("stream"):
+        return _record_after_stream(
+            prefix_cache, client.create_chat_completion_openai_v1(**kwargs)
+        )
+    response = client.create_chat_completion_openai_v1(**kwargs)
+    if response.usage:
+        _record(prefix_cache, response.usage.prompt_tokens)
+    return response
+
+
+def _record_after_stream(prefix_cache: PrefixStateCache, chunks: Iterator) -> Iterator:
+    yield from chunks
+    # streamed chunks have no usage, record all evaluated tokens instead (the prefix
+    # shared by two different requests ends in the prompt all the same)
+    _record(prefix_cache, prefix_cache.client.n_tokens)
+
+
+def _record(prefix_cache: PrefixStateCache, n_prompt_tokens: int) -> None:
+    try:
+        prefix_cache.record(n_prompt_tokens)
+    except OSError:
+        pass  # snapshots are best effort
@@ -0,0 +1,196 @@
+"""
+DeveloperGPT by luo-anthony
+
+Startup preflight checks: connectivity to the selected provider, API key validation
+and offline model loading run concurrently. Successful checks are cached on disk
+for a short time so repeated invocations skip the network entirely.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Optional
+
+from rich.console import Console
+
+from developergpt import config, daemon, model_manifest, profiling, providers, utils
+
+
+class PreflightCache:
+    """Timestamps of successful preflight checks, persisted as JSON."""
+
+    def __init__(
+        self, path: str = config.PREFLIGHT_CACHE_FILE, ttl: float = config.PREFLIGHT_TTL
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.entries: dict = {}
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def is_fresh(self, key: str) -> bool:
+        checked_at = self.entries.get(key)
+        return (
+            isinstance(checked_at, (int, float))
+            and 0 <= time.time() - checked_at < self.ttl
+        )
+
+    def mark(self, key: str) -> None:
+        self.entries[key] = time.time()
+
+    def save(self) -> None:
+        # drop expired entries and write atomically so concurrent runs never see a partial file
+        now = time.time()
+        self.entries = {k: t for k, t in self.entries.items() if now - t < self.ttl}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass  # caching is best effort
+
+
+def _connectivity_key(url: str) -> str:
+    return f"connectivity:{url}"
+
+
+def _api_key_key(provider: providers.Provider) -> Optional[str]:
+    api_key = os.environ.get(provider.api_key_env or "", "")
+    if not api_key:
+        return None
+    # never store the API key itself, only a fingerprint of it
+    fingerprint = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    return f"api_key:{provider.name}:{fingerprint}"
+
+
+def check_connectivity(url: str, cache: PreflightCache) -> bool:
+    """Check connectivity to the given endpoint, reusing a recent successful check."""
+    key = _connectivity_key(url)
+    if cache.is_fresh(key):
+        return True
+    with profiling.span("connectivity check"):
+        connected = utils.check_connectivity(url, timeout=config.PREFLIGHT_TIMEOUT)
+    if connected:
+        cache.mark(key)
+    return connected
+
+
+def validate_client(
+    provider: providers.Provider, client: Any, cache: PreflightCache
+) -> Optional[str]:
+    """Validate the client's API key, reusing a recent successful validation."""
+    if provider.validate_client is None:
+        return None
+    key = _api_key_key(provider)
+    if key and cache.is_fresh(key):
+        return None
+    with profiling.span("API key validation"):
+        error = provider.validate_client(client)
+    if not error and key:
+        cache.mark(key)
+    return error
+
+
+def run(
+    model: str,
+    console: Console,
+    cache: Optional[PreflightCache] = None,
+    draft: Optional[str] = None,
+) -> Any:
+    """
+    Run the startup preflight checks for the selected model and return its client.
+
+    Args:
+        model (str): The selected model.
+        console (Console): The console object for printing messages.
+        cache (Optional[PreflightCache]): Cache of recent successful checks (defaults to the on-disk cache).
+        draft (Optional[str]): Speculative decoding draft for offline models (see developergpt.speculative).
+
+    Returns:
+        Any: The API client (or loaded llama.cpp model) for the selected model.
+    """
+    provider = providers.get_provider(model)
+    cache = cache or PreflightCache()
+    pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="preflight")
+    try:
+        if provider.name == providers.LLAMA_CPP:
+            client = _run_offline(model, provider, console, cache, draft)
+        else:
+            client = _run_online(model, provider, console, cache, pool)
+    finally:
+        # don't wait on probes whose result is no longer needed
+        pool.shutdown(wait=False, cancel_futures=True)
+    cache.save()
+    return client
+
+
+def _run_offline(
+    model: str,
+    provider: providers.Provider,
+    console: Console,
+    cache: PreflightCache,
+    draft: Optional[str],
+) -> Any:
+    provider.create_client(model, console)
+    with profiling.span("daemon connect"):
+        warm_client = daemon.connect(model)
+    if warm_client is not None:
+        # the model is already loaded by `developergpt daemon`
+        return warm_client
+
+    with profiling.span("resolve offline model"):
+        model_path = model_manifest.resolve(model)
+    if model_path is None:
+        if not check_connectivity(provider.endpoint, cache):
+            console.print(
+                f"""[bold red]No internet connection and model not found locally at {providers.llama_model_path(model)}. """
+                """Please download the model first when on internet using --offline.[/bold red]"""
+            )
+            sys.exit(-1)
+        try:
+            with profiling.span("download offline model"):
+                model_manifest.download(model)
+        except OSError as e:
+            console.print(f"[bold red]Failed to download the model: {e}[/bold red]")
+            sys.exit(-1)
+
+    # the model is on disk, no network access needed
+    try:
+        with profiling.span("load offline model"):
+            return providers.load_llama(model, draft=draft)
+    except ValueError as e:
+        console.print(f"[bold red]Failed to load the model: {e}[/bold red]")
+        sys.exit(-1)
+
+
+def _run_online(
+    model: str,
+    provider: providers.Provider,
+    console: Console,
+    cache: PreflightCache,
+    pool: ThreadPoolExecutor,
+) -> Any:
+    connected: Future = pool.submit(check_connectivity, provider.endpoint, cache)
+    with profiling.span("create client"):
+        client = provider.create_client(model, console)
+    key_error: Future = pool.submit(validate_client, provider, client, cache)
+
+    if not connected.result():
+        console.print(
+            """[bold red]No internet connection. """
+            """Please check your internet connection or use --offline mode.[/bold red]"""
+        )
+        sys.exit(-1)
+    error = key_error.result()
+    if error:
+        console.print(f"[bold red]Error: {error}[/bold red]")
+        sys.exit(-1)
+    return client
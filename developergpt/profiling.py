@@ -0,0 +1,150 @@
+"""
+DeveloperGPT by luo-anthony
+
+Phase timing for `--profile`.
+
+Named spans wrap the phases of an invocation (imports, preflight checks, model
+loading, requests, time to first token, generation, rendering). When profiling
+is disabled a span is a no-op. The recorded spans are summarized per phase at
+exit and can be exported as a Chrome trace (chrome://tracing, ui.perfetto.dev).
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, NamedTuple, TypeVar
+
+from rich.console import Console
+
+import developergpt
+
+T = TypeVar("T")
+
+
+class Span(NamedTuple):
+    name: str
+    start: float  # time.perf_counter()
+    end: float
+    thread_id: int
+    thread_name: str
+
+
+_enabled = False
+_spans: List[Span] = []
+_lock = threading.Lock()
+
+
+def enable() -> None:
+    """Start recording spans. Everything before (the imports) is recorded as one span."""
+    global _enabled
+    _enabled = True
+    record("imports", developergpt.IMPORT_START, time.perf_counter())
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def record(name: str, start: float, end: float) -> None:
+    if not _enabled:
+        return
+    thread = threading.current_thread()
+    with _lock:
+        _spans.append(Span(name, start, end, thread.ident or 0, thread.name))
+
+
+def spans() -> List[Span]:
+    with _lock:
+        return sorted(_spans, key=lambda s: s.start)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time the enclosed phase."""
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, start, time.perf_counter())
+
+
+def traced_stream(chunks: Iterable[T]) -> Iterator[T]:
+    """
+    Time a streamed response: the wait for the first chunk (including the prompt
+    evaluation of offline models) and the generation of the remaining chunks.
+    """
+    if not _enabled:
+        yield from chunks
+        return
+    start = time.perf_counter()
+    first_chunk_at = None
+    try:
+        for chunk in chunks:
+            if first_chunk_at is None:
+                first_chunk_at = time.perf_counter()
+                record("time to first token", start, first_chunk_at)
+            yield chunk
+    finally:
+        if first_chunk_at is not None:
+            record("generation", first_chunk_at, time.perf_counter())
+
+
+def print_summary(console: Console) -> None:
+    """Print the total time, number of calls and longest call of each phase."""
+    from rich.table import Table
+
+    phases: dict = {}
+    for s in spans():
+        total, n_calls, longest = phases.get(s.name, (0.0, 0, 0.0))
+        duration = s.end - s.start
+        phases[s.name] = (total + duration, n_calls + 1, max(longest, duration))
+
+    table = Table(title="DeveloperGPT profile", title_justify="left")
+    table.add_column("Phase")
+    table.add_column("Calls", justify="right")
+    table.add_column("Total (ms)", justify="right")
+    table.add_column("Max (ms)", justify="right")
+    for name, (total, n_calls, longest) in phases.items():
+        table.add_row(
+            name, str(n_calls), f"{total * 1000:.1f}", f"{longest * 1000:.1f}"
+        )
+    elapsed = time.perf_counter() - developergpt.IMPORT_START
+    table.caption = f"Wall time: {elapsed * 1000:.1f} ms (phases may overlap)"
+    console.print(table)
+
+
+def export_chrome_trace(path: str) -> None:
+    """Write the spans in the Chrome trace event format."""
+    pid = os.getpid()
+    events: list = []
+    thread_names: dict = {}
+    for s in spans():
+        thread_names[s.thread_id] = s.thread_name
+        events.append(
+            {
+                "name": s.name,
+                "cat": "developergpt",
+                "ph": "X",  # complete event
+                "ts": (s.start - developergpt.IMPORT_START) * 1e6,  # microseconds
+                "dur": (s.end - s.start) * 1e6,
+                "pid": pid,
+                "tid": s.thread_id,
+            }
+        )
+    for thread_id, thread_name in thread_names.items():
+        events.append(
+            {
+                "name": "thread_name",
+                "ph": "M",  # metadata event
+                "pid": pid,
+                "tid": thread_id,
+                "args": {"name": thread_name},
+            }
+        )
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
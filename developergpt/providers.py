@@ -0,0 +1,233 @@
+"""
+DeveloperGPT by luo-anthony
+
+Registry of LLM providers. Each provider's adapter module and client library
+is only imported once one of its models has been selected.
+"""
+
+import importlib
+import os
+from types import ModuleType
+from typing import Any, Callable, NamedTuple, Optional
+
+from rich.console import Console
+
+from developergpt import aio, config, profiling
+
+LLAMA_CPP = "llama.cpp"
+OPENAI = "openai"
+HUGGING_FACE = "huggingface"
+GOOGLE = "google"
+ANTHROPIC = "anthropic"
+
+
+class Provider(NamedTuple):
+    name: str
+    models: dict
+    adapter: str  # module path of the adapter, imported on first use
+    create_client: Callable[[str, Console], Any]
+    endpoint: str  # probed to check connectivity to the provider
+    api_key_env: Optional[str] = None
+    # returns an error message if the client's API key is invalid
+    validate_client: Optional[Callable[[Any], Optional[str]]] = None
+    # opens a connection to the provider in the background (see developergpt.aio)
+    warm_up: Optional[Callable[[str], Any]] = None
+    # default rate limit of batch requests (None means unlimited)
+    requests_per_minute: Optional[float] = None
+
+
+def llama_model_path(model: str) -> str:
+    """Path of the GGUF file for an offline model in the local model cache."""
+    _, llm_file, _ = config.LLAMA_CPP_MODEL_MAP[model]
+    return os.path.join(config.OFFLINE_MODEL_CACHE_DIR, llm_file)
+
+
+def load_llama(
+    model: str, settings: Optional[dict] = None, draft: Optional[str] = None
+) -> Any:
+    """
+    Load a downloaded offline model (see developergpt.model_manifest).
+
+    Uses the settings stored by `developergpt tune` unless settings are given, and
+    speculative decoding if a draft is given (see developergpt.speculative).
+    """
+    from llama_cpp import Llama
+
+    from developergpt import speculative, tuning
+
+    _, _, chat_format = config.LLAMA_CPP_MODEL_MAP[model]
+    draft_model = speculative.load_draft_model(draft)
+    llm = Llama(
+        model_path=llama_model_path(model),
+        n_ctx=config.OFFLINE_MODEL_CTX,
+        verbose=False,
+        chat_format=chat_format,
+        draft_model=draft_model,
+        **(settings or tuning.llama_settings(model)),
+    )
+    speculative.check_vocabulary(llm, draft_model)
+    return llm
+
+
+def _create_llama_client(model: str, console: Console) -> Any:
+    # the model itself is loaded by developergpt.preflight (concurrently with other checks)
+    console.print(
+        f"""[bold yellow]Using quantized {' '.join(config.LLAMA_CPP_MODEL_MAP[model])} running on-device (offline)."""
+    )
+    return None
+
+
+def _create_openai_client(model: str, console: Console) -> Any:
+    from openai import AsyncOpenAI
+
+    client = AsyncOpenAI(
+        api_key=config.get_environ_key(config.OPEN_AI_API_KEY, console),
+        http_client=_openai_http_client(),
+    )
+    console.print(f"[bold yellow]Using OpenAI {config.OPENAI_MODEL_MAP[model]}.")
+    return client
+
+
+def _validate_openai_client(client: Any) -> Optional[str]:
+    from developergpt import openai_adapter
+
+    return openai_adapter.validate_open_ai_key(client)
+
+
+def _create_huggingface_client(model: str, console: Console) -> Any:
+    api_key = config.get_environ_key_optional(config.HUGGING_FACE_API_KEY, console)
+    console.print(
+        f"[bold yellow]Using {config.HF_MODEL_MAP[model]} via Hugging Face Inference API."
+    )
+    # one pooled backend per (model, API token), shared by all requests to the model
+    return load_adapter(model).get_backend(model, api_key)
+
+
+def _create_google_client(model: str, console: Console) -> Any:
+    import google.generativeai as genai
+
+    api_key = config.get_environ_key(config.GOOGLE_API_KEY, console)
+    genai.configure(api_key=api_key)
+    return None
+
+
+def _create_anthropic_client(model: str, console: Console) -> Any:
+    from anthropic import AsyncAnthropic
+
+    api_key = config.get_environ_key(config.ANTHROPIC_API_KEY, console)
+    return AsyncAnthropic(api_key=api_key, http_client=_anthropic_http_client())
+
+
+def _openai_http_client() -> Any:
+    import openai
+
+    return aio.http_client(OPENAI, getattr(openai, "DefaultAsyncHttpxClient", None))
+
+
+def _anthropic_http_client() -> Any:
+    import anthropic
+
+    return aio.http_client(
+        ANTHROPIC, getattr(anthropic, "DefaultAsyncHttpxClient", None)
+    )
+
+
+def _warm_up_openai(model: str) -> Any:
+    return aio.warm_up(_openai_http_client(), config.OPENAI_ENDPOINT)
+
+
+def _warm_up_anthropic(model: str) -> Any:
+    return aio.warm_up(_anthropic_http_client(), config.ANTHROPIC_ENDPOINT)
+
+
+def _warm_up_google(model: str) -> Any:
+    gemini_model = load_adapter(model).get_model(model)
+
+    async def count_tokens():
+        # Gemini uses its own gRPC channel, a free token count request opens it
+        try:
+            await gemini_model.count_tokens_async("warm up")
+        except Exception:
+            pass
+
+    return aio.submit(count_tokens())
+
+
+# NOTE: order matters, offline models are resolved before any hosted model
+PROVIDERS = [
+    Provider(
+        LLAMA_CPP,
+        config.LLAMA_CPP_MODEL_MAP,
+        # llama.cpp models are OpenAI API drop-in compatible
+        "developergpt.openai_adapter",
+        _create_llama_client,
+        # models are downloaded from the Hugging Face Hub
+        config.HUGGING_FACE_ENDPOINT,
+    ),
+    Provider(
+        OPENAI,
+        config.OPENAI_MODEL_MAP,
+        "developergpt.openai_adapter",
+        _create_openai_client,
+        config.OPENAI_ENDPOINT,
+        config.OPEN_AI_API_KEY,
+        _validate_openai_client,
+        _warm_up_openai,
+        config.OPENAI_REQUESTS_PER_MINUTE,
+    ),
+    Provider(
+        HUGGING_FACE,
+        config.HF_MODEL_MAP,
+        "developergpt.huggingface_adapter",
+        _create_huggingface_client,
+        config.HUGGING_FACE_ENDPOINT,
+        config.HUGGING_FACE_API_KEY,
+        requests_per_minute=config.HUGGING_FACE_REQUESTS_PER_MINUTE,
+    ),
+    Provider(
+        GOOGLE,
+        config.GOOGLE_MODEL_MAP,
+        "developergpt.gemini_adapter",
+        _create_google_client,
+        config.GOOGLE_ENDPOINT,
+        config.GOOGLE_API_KEY,
+        warm_up=_warm_up_google,
+        requests_per_minute=config.GOOGLE_REQUESTS_PER_MINUTE,
+    ),
+    Provider(
+        ANTHROPIC,
+        config.ANTHROPIC_MODEL_MAP,
+        "developergpt.anthropic_adapter",
+        _create_anthropic_client,
+        config.ANTHROPIC_ENDPOINT,
+        config.ANTHROPIC_API_KEY,
+        warm_up=_warm_up_anthropic,
+        requests_per_minute=config.ANTHROPIC_REQUESTS_PER_MINUTE,
+    ),
+]
+
+
+def get_provider(model: str) -> Provider:
+    """Get the provider serving the given model."""
+    for provider in PROVIDERS:
+        if model in provider.models:
+            return provider
+    raise KeyError(f"No provider found for model {model}")
+
+
+def load_adapter(model: str) -> ModuleType:
+    """Import (on first use) and return the adapter module for the given model."""
+    with profiling.span("import adapter"):
+        return importlib.import_module(get_provider(model).adapter)
+
+
+def create_client(model: str, console: Console) -> Any:
+    """Create the API client for the given model (offline models are loaded by developergpt.preflight)."""
+    return get_provider(model).create_client(model, console)
+
+
+def warm_up(model: str) -> None:
+    """Open the connection to the model's provider in the background (e.g. while the user is typing)."""
+    provider = get_provider(model)
+    if provider.warm_up is not None:
+        provider.warm_up(model)
@@ -0,0 +1,213 @@
+"""
+DeveloperGPT by luo-anthony
+
+Racing `cmd` requests across several models (`cmd --race gpt4,haiku,flash`).
+
+All models are asked concurrently and the first response that is valid command JSON
+wins, the requests of the other models are cancelled. An offline model stops at its
+next token and is waited for, the next request uses the same loaded model. In hedged mode the next model is
+only asked once the previous one has taken longer than its recorded p95 latency (or
+failed). Per-model latencies and wins are recorded in SQLite to derive the hedge
+delays. A cancelled request only tells that the model would have taken longer than it
+ran, so it is recorded as a censored sample and the percentiles are Kaplan-Meier
+estimates.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from developergpt import aio, config, utils
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS race_results (
+    id INTEGER PRIMARY KEY,
+    model TEXT NOT NULL,
+    latency REAL,  -- elapsed time when cancelled after another model won
+    valid INTEGER NOT NULL,
+    censored INTEGER NOT NULL,  -- cancelled, the latency is a lower bound
+    won INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS race_results_model ON race_results (model, id);
+"""
+
+
+class RaceResult(NamedTuple):
+    model: str
+    response: str
+    latency: float  # seconds
+
+
+class Sample(NamedTuple):
+    latency: float  # seconds
+    censored: bool  # the request was cancelled, its latency is a lower bound
+
+
+def _percentile(samples: List[Sample], q: float) -> float:
+    """
+    Kaplan-Meier estimate of a latency percentile. If too many requests were cancelled to
+    estimate it, the longest latency is returned (a lower bound).
+    """
+    samples = sorted(samples, key=lambda s: (s.latency, s.censored))
+    survival = 1.0
+    for i, sample in enumerate(samples):
+        if not sample.censored:
+            survival *= 1 - 1 / (len(samples) - i)
+            if survival <= 1 - q + 1e-9:
+                return sample.latency
+    return samples[-1].latency
+
+
+class RaceStats:
+    """Per-model latencies and wins of raced command requests."""
+
+    def __init__(self, path: str = config.RACE_STATS_FILE):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=5)
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def record(
+        self,
+        model: str,
+        latency: float,
+        valid: bool,
+        won: bool,
+        censored: bool = False,
+    ) -> None:
+        with self.db:
+            self.db.execute(
+                """INSERT INTO race_results (model, latency, valid, censored, won, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                (model, latency, int(valid), int(censored), int(won), time.time()),
+            )
+
+    def latencies(self, model: str) -> List[Sample]:
+        """Latencies of the model's most recent valid responses and cancelled requests."""
+        rows = self.db.execute(
+            """SELECT latency, censored FROM race_results WHERE model = ? AND (valid OR censored)
+            ORDER BY id DESC LIMIT ?""",
+            (model, config.RACE_STATS_WINDOW),
+        ).fetchall()
+        return [Sample(latency, bool(censored)) for latency, censored in rows]
+
+    def hedge_delay(self, model: str) -> float:
+        """Seconds to wait for the model before asking the next one: its p95 latency."""
+        latencies = self.latencies(model)
+        if len(latencies) < config.RACE_MIN_SAMPLES:
+            return config.RACE_HEDGE_DELAY
+        return _percentile(latencies, 0.95)
+
+    def summary(self) -> List[dict]:
+        """Requests, wins and latency percentiles per model."""
+        rows = self.db.execute(
+            "SELECT model, COUNT(*), SUM(won), SUM(valid) FROM race_results GROUP BY model ORDER BY SUM(won) DESC"
+        ).fetchall()
+        summary = []
+        for model, n_requests, n_wins, n_valid in rows:
+            latencies = self.latencies(model)
+            summary.append(
+                {
+                    "model": model,
+                    "requests": n_requests,
+                    "wins": n_wins,
+                    "valid": n_valid,
+                    "p50": _percentile(latencies, 0.5) if latencies else None,
+                    "p95": _percentile(latencies, 0.95) if latencies else None,
+                }
+            )
+        return summary
+
+
+def race_command(
+    contestants: List[Tuple[str, Callable[[], Optional[str]]]],
+    stats: RaceStats,
+    hedge: bool = False,
+) -> Optional[RaceResult]:
+    """
+    Race command requests and return the first valid response.
+
+    Args:
+        contestants (List[Tuple[str, Callable]]): (model, function returning the model output) pairs in priority order.
+        stats (RaceStats): Latency statistics, used for hedge delays and updated with the results.
+        hedge (bool): Only ask the next model once the previous one exceeded its p95 latency or failed.
+
+    Returns:
+        Optional[RaceResult]: The winning response, or None if no model returned valid command JSON.
+    """
+    results: queue.Queue = queue.Queue()
+    running: dict = {}  # model -> (start time, cancel scope, thread)
+
+    def run(
+        model: str, get_output: Callable[[], Optional[str]], scope: aio.CancelScope
+    ) -> None:
+        start = time.perf_counter()
+        try:
+            with scope:
+                output = get_output()
+        except BaseException:
+            # adapters exit on API errors, a failed (or cancelled) contestant simply loses
+            output = None
+        results.put((model, output, time.perf_counter() - start))
+
+    def start_next() -> None:
+        model, get_output = contestants[len(running) + len(finished)]
+        scope = aio.CancelScope()
+        # daemon threads: a request stuck outside the loop never delays exiting
+        thread = threading.Thread(
+            target=run,
+            args=(model, get_output, scope),
+            name=f"race-{model}",
+            daemon=True,
+        )
+        running[model] = (time.perf_counter(), scope, thread)
+        thread.start()
+
+    finished: set = set()
+    start_next()
+    last_start = time.perf_counter()
+    while not hedge and len(running) < len(contestants):
+        start_next()
+
+    winner = None
+    while running:
+        n_started = len(running) + len(finished)
+        timeout = None
+        if hedge and n_started < len(contestants):
+            previous_model = contestants[n_started - 1][0]
+            elapsed = time.perf_counter() - last_start
+            timeout = max(0.0, stats.hedge_delay(previous_model) - elapsed)
+        try:
+            model, output, latency = results.get(timeout=timeout)
+        except queue.Empty:
+            start_next()  # the previous model is slower than usual, hedge
+            last_start = time.perf_counter()
+            continue
+
+        del running[model]
+        finished.add(model)
+        valid = utils.is_valid_command_response(output)
+        stats.record(model, latency, valid, won=valid)
+        if valid:
+            winner = RaceResult(model, output, latency)  # type: ignore
+            break
+        if hedge and len(running) + len(finished) < len(contestants):
+            start_next()  # failed, ask the next model right away
+            last_start = time.perf_counter()
+
+    for model, (start, scope, thread) in running.items():
+        scope.cancel()
+        # the model would have taken at least this long
+        latency = time.perf_counter() - start
+        stats.record(model, latency, False, won=False, censored=True)
+        if model in config.OFFLINE_MODELS:
+            # the loaded model can't run two generations at once, wait for it to stop
+            thread.join()
+    return winner
@@ -0,0 +1,173 @@
+"""
+DeveloperGPT by luo-anthony
+
+Persistent on-disk cache of `cmd` responses (SQLite) with size-bounded LRU eviction,
+per-entry TTL and stale-while-revalidate refresh.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from typing import NamedTuple, Optional
+
+from developergpt import config
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    request TEXT NOT NULL,
+    model TEXT NOT NULL,
+    fast_mode INTEGER NOT NULL,
+    platform TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    stale_until REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+HITS = "hits"
+STALE_HITS = "stale_hits"
+MISSES = "misses"
+
+
+class CachedResponse(NamedTuple):
+    response: str
+    stale: bool  # expired but still usable while a fresh response is fetched
+
+
+def normalize_request(user_input: str) -> str:
+    """Normalize a natural language request so trivially different inputs share a cache entry."""
+    request = re.sub(r"\s+", " ", user_input.strip().lower())
+    return request.rstrip(".?! ")
+
+
+def cache_key(
+    user_input: str, model: str, fast_mode: bool, platform: str = config.USER_PLATFORM
+) -> str:
+    key = json.dumps([normalize_request(user_input), model, fast_mode, platform])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed cache of model command responses."""
+
+    def __init__(
+        self,
+        path: str = config.RESPONSE_CACHE_FILE,
+        max_entries: int = config.RESPONSE_CACHE_MAX_ENTRIES,
+        ttl: float = config.RESPONSE_CACHE_TTL,
+        stale_ttl: float = config.RESPONSE_CACHE_STALE_TTL,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=5)
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def get(
+        self,
+        user_input: str,
+        model: str,
+        fast_mode: bool,
+        platform: str = config.USER_PLATFORM,
+    ) -> Optional[CachedResponse]:
+        """Look up a cached response. Expired entries are still returned (as stale) until stale_until."""
+        key = cache_key(user_input, model, fast_mode, platform)
+        now = time.time()
+        with self.db:
+            row = self.db.execute(
+                "SELECT response, expires_at, stale_until FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None or row[2] <= now:
+                if row is not None:
+                    self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._increment(MISSES)
+                return None
+
+            response, expires_at, _ = row
+            self.db.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (now, key)
+            )
+            stale = expires_at <= now
+            self._increment(STALE_HITS if stale else HITS)
+            return CachedResponse(response, stale)
+
+    def put(
+        self,
+        user_input: str,
+        model: str,
+        fast_mode: bool,
+        response: str,
+        platform: str = config.USER_PLATFORM,
+        ttl: Optional[float] = None,
+    ) -> None:
+        """Store a response and evict the least recently used entries beyond max_entries."""
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    cache_key(user_input, model, fast_mode, platform),
+                    normalize_request(user_input),
+                    model,
+                    int(fast_mode),
+                    platform,
+                    response,
+                    now,
+                    expires_at,
+                    expires_at + self.stale_ttl,
+                    now,
+                ),
+            )
+            self.db.execute(
+                """DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,),
+            )
+
+    def clear(self) -> None:
+        with self.db:
+            self.db.execute("DELETE FROM responses")
+            self.db.execute("DELETE FROM stats")
+
+    def stats(self) -> dict:
+        """Hit/miss counters and the number of cached entries."""
+        counters = dict(self.db.execute("SELECT name, value FROM stats").fetchall())
+        (n_entries,) = self.db.execute("SELECT COUNT(*) FROM responses").fetchone()
+        return {
+            HITS: counters.pop(HITS, 0),
+            STALE_HITS: counters.pop(STALE_HITS, 0),
+            MISSES: counters.pop(MISSES, 0),
+            **counters,  # e.g. near-duplicate hits from developergpt.semantic_cache
+            "entries": n_entries,
+        }
+
+    def count(self, name: str, n: int = 1) -> None:
+        """Increment a named counter (shown with the cache statistics)."""
+        with self.db:
+            self._increment(name, n)
+
+    def _increment(self, name: str, n: int = 1) -> None:
+        self.db.execute(
+            """INSERT INTO stats VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value""",
+            (name, n),
+        )
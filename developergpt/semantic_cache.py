@@ -0,0 +1,455 @@
+"""
+DeveloperGPT by luo-anthony
+
+Fuzzy cache of `cmd` responses for near-duplicate requests. Requests are reduced to a
+canonical wording (common synonyms, filler words and plurals) and indexed as character
+n-gram TF-IDF vectors in SQLite (next to the exact response cache), so lookups work
+fully offline and stay fast for tens of thousands of stored requests. Entries expire
+like the exact response cache entries.
+"""
+
+import math
+import re
+import sqlite3
+import time
+from collections import Counter
+from typing import Iterable, NamedTuple, Optional
+
+from developergpt import config
+from developergpt.response_cache import normalize_request
+
+NGRAM_SIZE = 3
+# only the rarest query n-grams are used to find candidates, the rest only affect scoring
+MAX_CANDIDATE_NGRAMS = 8
+MAX_CANDIDATES = 50
+
+SEMANTIC_HITS = "semantic_hits"
+
+# words with the same meaning in command requests
+SYNONYMS = {
+    "remove": "delete",
+    "erase": "delete",
+    "rm": "delete",
+    "show": "list",
+    "display": "list",
+    "ls": "list",
+    "locate": "find",
+    "search": "find",
+    "terminate": "kill",
+    "make": "create",
+    "duplicate": "copy",
+    "cp": "copy",
+    "mv": "move",
+    "zip": "compress",
+    "unzip": "extract",
+    "folder": "directory",
+    "dir": "directory",
+    "every": "all",
+    "each": "all",
+    "any": "all",
+    "larger": "bigger",
+    "greater": "bigger",
+    "don't": "not",
+    "dont": "not",
+    "never": "not",
+    "excluding": "except",
+}
+# words that don't change the requested command
+FILLER_WORDS = {"a", "an", "the", "all", "this", "these", "my", "please"}
+# the action of a request must match exactly, "list all .pyc files" is not "delete all .pyc files"
+ACTION_WORDS = {
+    "delete",
+    "list",
+    "find",
+    "kill",
+    "create",
+    "copy",
+    "move",
+    "rename",
+    "compress",
+    "extract",
+    "count",
+    "install",
+    "uninstall",
+    "update",
+    "start",
+    "stop",
+    "restart",
+    "download",
+    "upload",
+}
+# negations and comparisons flip the meaning of an otherwise identical request,
+# "do not delete .pyc files" is not "delete all .pyc files"
+QUALIFIER_WORDS = {
+    "not",
+    "no",
+    "except",
+    "without",
+    "bigger",
+    "smaller",
+    "older",
+    "newer",
+    "more",
+    "less",
+}
+# the word after these names where the command runs or what it creates, "delete all
+# .pyc files in src" is not "delete all .pyc files"
+SCOPE_WORDS = {"in", "inside", "under", "within", "from", "named", "called"}
+# scopes that name the working directory, the default of every command
+CURRENT_DIRECTORY_WORDS = {"directory", "current", "here", "working"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS semantic_entries (
+    id INTEGER PRIMARY KEY,
+    scope TEXT NOT NULL,
+    request TEXT NOT NULL,
+    response TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    stale_until REAL NOT NULL,
+    last_used REAL NOT NULL,
+    UNIQUE (scope, request)
+);
+CREATE INDEX IF NOT EXISTS semantic_entries_last_used ON semantic_entries (last_used);
+CREATE TABLE IF NOT EXISTS semantic_ngrams (
+    scope TEXT NOT NULL,
+    ngram TEXT NOT NULL,
+    entry_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS semantic_ngrams_lookup ON semantic_ngrams (scope, ngram, entry_id);
+CREATE INDEX IF NOT EXISTS semantic_ngrams_entry ON semantic_ngrams (entry_id);
+CREATE TABLE IF NOT EXISTS semantic_scopes (
+    scope TEXT PRIMARY KEY,
+    n_entries INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS semantic_df (
+    scope TEXT NOT NULL,
+    ngram TEXT NOT NULL,
+    df INTEGER NOT NULL,
+    PRIMARY KEY (scope, ngram)
+);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class SimilarResponse(NamedTuple):
+    request: str
+    response: str
+    similarity: float
+    stale: bool  # expired but still usable while a fresh response is fetched
+
+
+def _stem(word: str) -> str:
+    if len(word) <= 3 or not word.endswith("s") or word.endswith(("ss", "us", "is")):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("ches", "shes", "xes", "sses")):
+        return word[:-2]
+    return word[:-1]
+
+
+def _extension(token: str) -> str:
+    # ".pyc", "*.pyc" and "pyc" name the same file type
+    return re.sub(r"^\*?\.(?=\w+$)", "", token)
+
+
+def canonical_words(request: str) -> list:
+    """
+    The words of a normalized request with synonyms, plurals and file extensions unified, and
+    without scopes naming the working directory ("in the current directory").
+    """
+    words: list = []
+    in_current_directory = False
+    for token in request.split(" "):
+        word = SYNONYMS.get(token, token)
+        if word in FILLER_WORDS:
+            continue
+        if word in CURRENT_DIRECTORY_WORDS:
+            if not in_current_directory and words and words[-1] in SCOPE_WORDS:
+                words.pop()
+                in_current_directory = True
+            if in_current_directory:
+                continue
+        in_current_directory = False
+        words.append(_stem(_extension(word)) if word.isalpha() else _extension(word))
+    return words
+
+
+def ngrams(request: str) -> Counter:
+    """Character n-gram counts of the canonical wording of a normalized request."""
+    padded = f" {' '.join(canonical_words(request))} "
+    return Counter(
+        padded[i : i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)
+    )
+
+
+def _scopes(words: list) -> set:
+    # the directories named by `in <dir>`, the names of `named <name>` and the like
+    # (canonical words skip filler words)
+    return {
+        target
+        for word, target in zip(words, words[1:])
+        if word in SCOPE_WORDS and target not in CURRENT_DIRECTORY_WORDS
+    }
+
+
+def salient_tokens(request: str) -> set:
+    """
+    Tokens that must match exactly between near-duplicate requests.
+    Numbers, paths, file extensions, flags, the requested action, negations, comparisons and
+    `in <dir>` scopes change the command even when the wording is similar (e.g. "kill process
+    on port 8080" vs. "kill process on port 3000", "do not delete .pyc files" vs. "delete all
+    .pyc files").
+    """
+    words = canonical_words(request)
+    return (
+        {
+            _extension(t)
+            for t in request.split(" ")
+            if re.search(r"[0-9/.~\-*]", t) and _extension(t)
+        }
+        | (set(words) & (ACTION_WORDS | QUALIFIER_WORDS))
+        | _scopes(words)
+    )
+
+
+def salient_match(request: str, other: str) -> bool:
+    """Whether the salient tokens of each request also occur in the other one."""
+    return salient_tokens(request) <= set(canonical_words(other)) and salient_tokens(
+        other
+    ) <= set(canonical_words(request))
+
+
+def _scope(model: str, fast_mode: bool, platform: str) -> str:
+    return f"{platform}|{model}|{int(fast_mode)}"
+
+
+class SemanticCache:
+    """Near-duplicate lookup of previously answered command requests."""
+
+    def __init__(
+        self,
+        db: sqlite3.Connection,
+        threshold: float = config.SEMANTIC_CACHE_THRESHOLD,
+        max_entries: int = config.SEMANTIC_CACHE_MAX_ENTRIES,
+        ttl: float = config.RESPONSE_CACHE_TTL,
+        stale_ttl: float = config.RESPONSE_CACHE_STALE_TTL,
+    ):
+        self.db = db
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.db.executescript(SCHEMA)
+
+    def lookup(
+        self,
+        user_input: str,
+        model: str,
+        fast_mode: bool,
+        platform: str = config.USER_PLATFORM,
+    ) -> Optional[SimilarResponse]:
+        """
+        Find the most similar previously answered request above the similarity threshold.
+        Expired entries are still returned (as stale) until their stale_until.
+        """
+        request = normalize_request(user_input)
+        scope = _scope(model, fast_mode, platform)
+        query = ngrams(request)
+        if not query:
+            return None
+
+        n_docs = self._count(scope)
+        if n_docs == 0:
+            return None
+        df = self._df(scope, query.keys())
+        idf = _idf(query.keys(), df, n_docs)
+
+        # candidates share at least one of the rarest (most informative) query n-grams,
+        # n-grams no stored request contains can't find any candidate
+        rare = sorted(df, key=lambda g: idf[g], reverse=True)[:MAX_CANDIDATE_NGRAMS]
+        if not rare:
+            return None
+        now = time.time()
+        candidates = self.db.execute(
+            f"""SELECT e.id, e.request, e.response, e.expires_at FROM (
+                SELECT entry_id, COUNT(*) AS shared FROM semantic_ngrams
+                WHERE scope = ? AND ngram IN ({",".join("?" * len(rare))})
+                GROUP BY entry_id ORDER BY shared DESC LIMIT ?
+            ) c JOIN semantic_entries e ON e.id = c.entry_id
+            WHERE e.stale_until > ?""",
+            (scope, *rare, MAX_CANDIDATES, now),
+        ).fetchall()
+        # numbers, paths, the action etc. must match exactly before the wording is compared
+        candidates = [c for c in candidates if salient_match(request, c[1])]
+        if not candidates:
+            return None
+
+        candidate_ngrams = {c[0]: ngrams(c[1]) for c in candidates}
+        all_ngrams = set().union(*candidate_ngrams.values()) - idf.keys()
+        idf.update(_idf(all_ngrams, self._df(scope, all_ngrams), n_docs))
+
+        query_vec = _tfidf(query, idf)
+        best: Optional[SimilarResponse] = None
+        best_id = None
+        for entry_id, entry_request, response, expires_at in candidates:
+            similarity = _cosine(query_vec, _tfidf(candidate_ngrams[entry_id], idf))
+            if similarity >= self.threshold and (
+                best is None or similarity > best.similarity
+            ):
+                stale = expires_at <= now
+                best = SimilarResponse(entry_request, response, similarity, stale)
+                best_id = entry_id
+
+        if best is not None:
+            with self.db:
+                self.db.execute(
+                    "UPDATE semantic_entries SET last_used = ? WHERE id = ?",
+                    (now, best_id),
+                )
+                self.db.execute(
+                    """INSERT INTO stats VALUES (?, 1)
+                    ON CONFLICT(name) DO UPDATE SET value = value + 1""",
+                    (SEMANTIC_HITS,),
+                )
+        return best
+
+    def add(
+        self,
+        user_input: str,
+        model: str,
+        fast_mode: bool,
+        response: str,
+        platform: str = config.USER_PLATFORM,
+    ) -> None:
+        """Index a request and its response."""
+        self.add_many([(user_input, response)], model, fast_mode, platform)
+
+    def add_many(
+        self,
+        entries: Iterable[tuple],
+        model: str,
+        fast_mode: bool,
+        platform: str = config.USER_PLATFORM,
+    ) -> None:
+        """Index (request, response) pairs in a single transaction."""
+        scope = _scope(model, fast_mode, platform)
+        now = time.time()
+        expires_at = now + self.ttl
+        stale_until = expires_at + self.stale_ttl
+        with self.db:
+            for user_input, response in entries:
+                request = normalize_request(user_input)
+                existing = self.db.execute(
+                    "SELECT id FROM semantic_entries WHERE scope = ? AND request = ?",
+                    (scope, request),
+                ).fetchone()
+                if existing:
+                    self.db.execute(
+                        """UPDATE semantic_entries
+                        SET response = ?, expires_at = ?, stale_until = ?, last_used = ?
+                        WHERE id = ?""",
+                        (response, expires_at, stale_until, now, existing[0]),
+                    )
+                    continue
+                entry_id = self.db.execute(
+                    """INSERT INTO semantic_entries
+                    (scope, request, response, expires_at, stale_until, last_used)
+                    VALUES (?, ?, ?, ?, ?, ?)""",
+                    (scope, request, response, expires_at, stale_until, now),
+                ).lastrowid
+                grams = list(ngrams(request))
+                self.db.executemany(
+                    "INSERT INTO semantic_ngrams VALUES (?, ?, ?)",
+                    [(scope, g, entry_id) for g in grams],
+                )
+                self.db.executemany(
+                    """INSERT INTO semantic_df VALUES (?, ?, 1)
+                    ON CONFLICT(scope, ngram) DO UPDATE SET df = df + 1""",
+                    [(scope, g) for g in grams],
+                )
+                self.db.execute(
+                    """INSERT INTO semantic_scopes VALUES (?, 1)
+                    ON CONFLICT(scope) DO UPDATE SET n_entries = n_entries + 1""",
+                    (scope,),
+                )
+            self._evict()
+
+    def clear(self) -> None:
+        with self.db:
+            self.db.execute("DELETE FROM semantic_entries")
+            self.db.execute("DELETE FROM semantic_ngrams")
+            self.db.execute("DELETE FROM semantic_df")
+            self.db.execute("DELETE FROM semantic_scopes")
+
+    def _evict(self) -> None:
+        """Remove expired entries and the least recently used entries beyond max_entries."""
+        evicted = self.db.execute(
+            """SELECT id, scope FROM semantic_entries WHERE stale_until <= ?
+            UNION SELECT * FROM (
+                SELECT id, scope FROM semantic_entries
+                ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )""",
+            (time.time(), self.max_entries),
+        ).fetchall()
+        for entry_id, scope in evicted:
+            self.db.execute(
+                "UPDATE semantic_scopes SET n_entries = n_entries - 1 WHERE scope = ?",
+                (scope,),
+            )
+            self.db.execute(
+                """UPDATE semantic_df SET df = df - 1 WHERE (scope, ngram) IN (
+                    SELECT scope, ngram FROM semantic_ngrams WHERE entry_id = ?
+                )""",
+                (entry_id,),
+            )
+            self.db.execute(
+                "DELETE FROM semantic_ngrams WHERE entry_id = ?", (entry_id,)
+            )
+            self.db.execute("DELETE FROM semantic_entries WHERE id = ?", (entry_id,))
+        if evicted:
+            self.db.execute("DELETE FROM semantic_df WHERE df <= 0")
+
+    def _count(self, scope: str) -> int:
+        row = self.db.execute(
+            "SELECT n_entries FROM semantic_scopes WHERE scope = ?", (scope,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _df(self, scope: str, grams: Iterable[str]) -> dict:
+        """Document frequencies of the n-grams contained in any stored request."""
+        grams = list(grams)
+        df: dict = {}
+        # stay below SQLite's limit on the number of query parameters
+        for i in range(0, len(grams), 500):
+            chunk = grams[i : i + 500]
+            df.update(
+                self.db.execute(
+                    f"""SELECT ngram, df FROM semantic_df
+                    WHERE scope = ? AND ngram IN ({",".join("?" * len(chunk))})""",
+                    (scope, *chunk),
+                ).fetchall()
+            )
+        return df
+
+
+def _idf(grams: Iterable[str], df: dict, n_docs: int) -> dict:
+    # smoothed idf, n-grams never seen before are the most informative
+    return {g: math.log((1 + n_docs) / (1 + df.get(g, 0))) + 1 for g in grams}
+
+
+def _tfidf(counts: Counter, idf: dict) -> dict:
+    return {g: (1 + math.log(tf)) * idf[g] for g, tf in counts.items()}
+
+
+def _cosine(a: dict, b: dict) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    dot = sum(w * b.get(g, 0.0) for g, w in a.items())
+    norm = math.sqrt(sum(w * w for w in a.values())) * math.sqrt(
+        sum(w * w for w in b.values())
+    )
+    return dot / norm if norm else 0.0
@@ -0,0 +1,194 @@
+"""
+DeveloperGPT by luo-anthony
+
+Named chat sessions (`chat --session NAME` / `chat --resume NAME`).
+
+Each session is an append-only JSON lines log in config.SESSIONS_DIR: a header
+line with the model, then one compact line per chat message in the adapter's own
+message format. Resuming only parses the most recent messages, read backwards from
+the end of the log, so old turns of long sessions stay on disk. For llama.cpp
+models the evaluated KV state is saved when the session ends and restored on
+resume, so the history isn't evaluated again.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import re
+import time
+from typing import Any, Iterator, List, Optional
+
+from developergpt import config
+
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+BLOCK_SIZE = 1 << 16
+
+
+def is_valid_name(name: str) -> bool:
+    return bool(NAME_PATTERN.match(name)) and len(name) <= 100
+
+
+def _compact(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def _reversed_lines(path: str) -> Iterator[bytes]:
+    """The lines of a file from last to first, reading backwards in blocks."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b""
+        while position > 0:
+            size = min(BLOCK_SIZE, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + remainder).split(b"\n")
+            remainder = lines.pop(0)  # may continue in the previous block
+            for line in reversed(lines):
+                if line:
+                    yield line
+        if remainder:
+            yield remainder
+
+
+class ChatLog:
+    """Append-only log of the messages of a named chat session."""
+
+    def __init__(self, name: str, directory: str = config.SESSIONS_DIR):
+        self.name = name
+        self.directory = directory
+        self.path = os.path.join(directory, f"{name}.jsonl")
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def header(self) -> dict:
+        with open(self.path, "rb") as f:
+            return json.loads(f.readline())
+
+    def create(self, model: str) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path, "x") as f:
+            f.write(_compact({"model": model, "created_at": time.time()}) + "\n")
+
+    def append(self, messages: List[Any]) -> None:
+        """Append messages (in the adapter's format) to the log."""
+        with open(self.path, "a") as f:
+            f.write("".join(_compact(m) + "\n" for m in messages))
+
+    def recent(self, n_messages: int) -> List[Any]:
+        """
+        Load the most recent messages of the session.
+
+        Args:
+            n_messages (int): Maximum number of messages to load.
+
+        Returns:
+            List[Any]: The messages in chat order, starting with a user message.
+        """
+        messages: List[Any] = []
+        for line in _reversed_lines(self.path):
+            if len(messages) == n_messages:
+                break
+            messages.append(json.loads(line))
+        else:
+            messages.pop()  # reached the header line
+        messages.reverse()
+        if len(messages) % 2:
+            messages = messages[1:]  # turns are saved as (user, assistant) pairs
+        return messages
+
+    def delete(self) -> None:
+        session_files = re.compile(
+            re.escape(self.name) + r"(\.jsonl|\.[0-9a-f]{16}\.state)"
+        )
+        for fname in os.listdir(self.directory):
+            if session_files.fullmatch(fname):
+                os.remove(os.path.join(self.directory, fname))
+
+
+def list_sessions(directory: str = config.SESSIONS_DIR) -> List[dict]:
+    """Name, model, number of messages and last use of every session, most recent first."""
+    if not os.path.isdir(directory):
+        return []
+    sessions = []
+    for fname in os.listdir(directory):
+        if not fname.endswith(".jsonl"):
+            continue
+        log = ChatLog(fname[: -len(".jsonl")], directory)
+        try:
+            with open(log.path, "rb") as f:
+                model = json.loads(f.readline()).get("model")
+                n_messages = sum(1 for _ in f)
+        except (OSError, ValueError):
+            continue
+        sessions.append(
+            {
+                "name": log.name,
+                "model": model,
+                "messages": n_messages,
+                "last_used": os.path.getmtime(log.path),
+            }
+        )
+    return sorted(sessions, key=lambda s: s["last_used"], reverse=True)
+
+
+class SessionState:
+    """Evaluated llama.cpp KV state at the end of a session."""
+
+    def __init__(self, log: ChatLog, client: Any, model: str):
+        import llama_cpp
+
+        self.client = client
+        _, llm_file, chat_format = config.LLAMA_CPP_MODEL_MAP[model]
+        fingerprint = json.dumps(
+            [llm_file, chat_format, config.OFFLINE_MODEL_CTX, llama_cpp.__version__]
+        )
+        key = hashlib.sha256(fingerprint.encode()).hexdigest()[:16]
+        self.directory = log.directory
+        self.path = os.path.join(log.directory, f"{log.name}.{key}.state")
+
+    def restore(self) -> bool:
+        """Load the saved state into the model. Returns True if restored."""
+        try:
+            with open(self.path, "rb") as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False
+        self.client.load_state(state)
+        return True
+
+    def save(self) -> None:
+        """Save the state of the model and prune the states of older sessions."""
+        if self.client.n_tokens == 0:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.client.save_state(), f)
+        os.replace(tmp_path, self.path)
+
+        # a state is as large as the evaluated KV cache, keep only the latest ones
+        states = sorted(
+            (
+                os.path.join(self.directory, fname)
+                for fname in os.listdir(self.directory)
+                if fname.endswith(".state")
+            ),
+            key=os.path.getmtime,
+            reverse=True,
+        )
+        for path in states[config.SESSION_MAX_KV_STATES :]:
+            os.remove(path)
+
+
+def session_state(log: Optional[ChatLog], client: Any, model: str) -> Any:
+    """The KV state of a session, if the model is a llama.cpp model loaded in this process."""
+    if (
+        log is None
+        or model not in config.LLAMA_CPP_MODEL_MAP
+        or not hasattr(client, "save_state")
+    ):
+        # the daemon (developergpt.daemon.DaemonClient) keeps its own state warm
+        return None
+    return SessionState(log, client, model)
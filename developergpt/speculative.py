@@ -0,0 +1,93 @@
+"""
+DeveloperGPT by luo-anthony
+
+Speculative decoding for offline models (`--draft`).
+
+A draft proposes the next few tokens and llama.cpp verifies them in a single batch
+with the main model, accepting the ones the main model would have sampled anyway.
+Command answers copy a lot from the prompt (paths and flags from the request, JSON
+keys from the few-shot examples), which prompt lookup decoding drafts for free by
+matching the last n-gram against the prompt. A small GGUF model with the same
+vocabulary as the main model can be used as draft instead.
+"""
+
+import os
+from typing import Any, List, Optional
+
+from developergpt import config
+
+PROMPT_LOOKUP = "prompt-lookup"
+
+
+class GGUFDraftModel:
+    """Drafts tokens by greedy generation with a small llama.cpp model (a llama_cpp.LlamaDraftModel)."""
+
+    def __init__(self, llm: Any, num_pred_tokens: int = config.DRAFT_MODEL_TOKENS):
+        self.llm = llm
+        self.num_pred_tokens = num_pred_tokens
+
+    def draft(self, input_ids: List[int]) -> List[int]:
+        drafted: List[int] = []
+        if not input_ids:
+            return drafted
+        # llama.cpp reuses the evaluated prefix of the previous call
+        for token in self.llm.generate(input_ids, temp=0.0):
+            if token == self.llm.token_eos():
+                break
+            drafted.append(token)
+            if len(drafted) == self.num_pred_tokens:
+                break
+        return drafted
+
+    def __call__(self, input_ids: Any, /, **kwargs: Any) -> Any:
+        import numpy as np
+
+        drafted = self.draft([int(t) for t in input_ids])
+        return np.array(drafted, dtype=np.intc)
+
+
+def is_valid_draft(draft: str) -> bool:
+    return draft == PROMPT_LOOKUP or os.path.isfile(draft)
+
+
+def load_draft_model(draft: Optional[str]) -> Any:
+    """
+    Create the draft model for an offline model.
+
+    Args:
+        draft (Optional[str]): PROMPT_LOOKUP, the path of a small GGUF model, or None for no draft.
+
+    Returns:
+        Any: The llama_cpp draft model, or None.
+    """
+    if not draft:
+        return None
+    if draft == PROMPT_LOOKUP:
+        from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+
+        return LlamaPromptLookupDecoding(
+            max_ngram_size=config.PROMPT_LOOKUP_MAX_NGRAM,
+            num_pred_tokens=config.PROMPT_LOOKUP_TOKENS,
+        )
+
+    from llama_cpp import Llama
+
+    from developergpt import tuning
+
+    llm = Llama(
+        model_path=draft,
+        n_ctx=config.OFFLINE_MODEL_CTX,
+        verbose=False,
+        **tuning.default_settings(tuning.detect_hardware()),
+    )
+    return GGUFDraftModel(llm)
+
+
+def check_vocabulary(llm: Any, draft_model: Any) -> None:
+    """Raise ValueError if a draft GGUF can't draft for the main model."""
+    if isinstance(draft_model, GGUFDraftModel) and (
+        draft_model.llm.n_vocab() != llm.n_vocab()
+    ):
+        raise ValueError(
+            "The draft model must use the same vocabulary as the offline model"
+        )
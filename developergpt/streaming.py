@@ -0,0 +1,266 @@
+"""
+DeveloperGPT by luo-anthony
+
+Incremental rendering of streamed chat and command responses.
+
+Re-parsing the whole response on every streamed chunk is quadratic in the response
+length. StreamingMarkdown splits the response into top-level Markdown blocks instead:
+completed blocks are parsed and rendered once and then frozen, and only the trailing,
+still open block is re-parsed when new text arrives.
+
+Command (JSON) responses are parsed incrementally as well, so each command is shown as
+soon as its string is complete instead of after the whole response is generated.
+Stop sequences are detected by scanning a rolling tail window of the streamed text.
+"""
+
+import itertools
+import re
+from typing import Iterable, List
+
+from rich.console import Console, ConsoleOptions, RenderResult
+from rich.live import Live
+from rich.markdown import Markdown
+from rich.panel import Panel
+from rich.segment import Segment
+from rich.spinner import Spinner
+
+from developergpt import config, profiling, utils
+from developergpt.incremental_json import IncrementalJSONParser
+
+FENCES = ("```", "~~~")
+LIST_ITEM = re.compile(r"([-*+]|\d+[.)])(\s|$)")
+
+
+class StreamingMarkdown:
+    """Rich renderable for a Markdown response that is streamed in chunks."""
+
+    def __init__(self, inline_code_theme: str = "monokai"):
+        self.inline_code_theme = inline_code_theme
+        self.blocks: List[str] = []  # completed top-level blocks
+        self.tail = ""  # the trailing block that may still change
+        self._scan_pos = 0  # end of the complete lines of tail already scanned
+        self._fence = ""  # opening fence of the code block tail is inside of, if any
+        self._fence_indented = False
+        self._after_blank = False  # the last scanned line of tail was blank
+        self._rendered: dict = {}  # width -> (number of rendered blocks, lines)
+
+    @property
+    def text(self) -> str:
+        return "".join(self.blocks) + self.tail
+
+    def append(self, text: str) -> None:
+        self.tail += text
+        self._freeze_completed_blocks()
+
+    def _freeze_completed_blocks(self) -> None:
+        """Move blocks that can no longer change from tail to blocks."""
+        while True:
+            line_end = self.tail.find("\n", self._scan_pos)
+            if line_end == -1:
+                return
+            line_start, self._scan_pos = self._scan_pos, line_end + 1
+            line = self.tail[line_start : self._scan_pos]
+            stripped = line.strip()
+
+            if self._fence:
+                if stripped.startswith(self._fence) and not stripped.strip("`~"):
+                    self._fence = ""
+                    self._after_blank = False
+                    if not self._fence_indented:
+                        # the closing fence completes a top-level code block
+                        self._freeze(self._scan_pos)
+                continue
+
+            if (
+                self._after_blank
+                and stripped
+                and not line[0].isspace()
+                and not LIST_ITEM.match(stripped)
+                and line_start > 0
+            ):
+                # an unindented line after a blank line starts a new block (indented lines
+                # and list items may still continue a list or an indented code block)
+                self._freeze(line_start)
+            self._after_blank = not stripped
+            if stripped.startswith(FENCES):
+                self._fence = stripped[:3]
+                self._fence_indented = line[0].isspace()  # e.g. inside a list item
+
+    def _freeze(self, end: int) -> None:
+        block = self.tail[:end]
+        self.tail = self.tail[end:]
+        self._scan_pos -= end
+        if block.strip():
+            self.blocks.append(block)
+        elif self.blocks:
+            self.blocks[-1] += block
+
+    def _render_blocks(self, console: Console, options: ConsoleOptions) -> list:
+        """Rendered lines of all completed blocks, each block is only rendered once per width."""
+        n_rendered, lines = self._rendered.get(options.max_width, (0, []))
+        for block in self.blocks[n_rendered:]:
+            block_lines = self._render_block(block, console, options)
+            if lines and block_lines:
+                lines.append([])  # blank line between top-level blocks
+            lines.extend(block_lines)
+        self._rendered[options.max_width] = (len(self.blocks), lines)
+        return lines
+
+    def _render_block(
+        self, block: str, console: Console, options: ConsoleOptions
+    ) -> list:
+        markdown = Markdown(block, inline_code_theme=self.inline_code_theme)
+        lines = console.render_lines(markdown, options, pad=False)
+        # blank lines between blocks are added when joining them
+        while lines and _is_blank(lines[-1]):
+            lines.pop()
+        while lines and _is_blank(lines[0]):
+            lines.pop(0)
+        return lines
+
+    def __rich_console__(
+        self, console: Console, options: ConsoleOptions
+    ) -> RenderResult:
+        options = options.update(height=None)
+        lines = self._render_blocks(console, options)
+        tail_lines = self._render_block(self.tail, console, options)
+        separator = [[]] if lines and tail_lines else []
+        for line in itertools.chain(lines, separator, tail_lines):
+            yield from line
+            yield Segment.line()
+
+
+def _is_blank(line: List[Segment]) -> bool:
+    # styled whitespace (e.g. code block padding or table borders) is part of the block
+    return all(not segment.text.strip() and not segment.style for segment in line)
+
+
+class StopSequenceScanner:
+    """
+    Detects stop sequences in streamed text in linear time. Only the new text and the
+    held back tail that may still be the start of a stop sequence (shorter than the
+    longest stop sequence) are scanned, never the whole response.
+    """
+
+    def __init__(self, stop_sequences: Iterable[str]):
+        self.stop_sequences = [stop for stop in stop_sequences if stop]
+        self.max_length = max((len(stop) for stop in self.stop_sequences), default=0)
+        self.pending = ""  # held back, may be the start of a stop sequence
+        self.stopped = False
+
+    def feed(self, text: str) -> str:
+        """Returns the text that can be shown, stopped is set once a stop sequence is found."""
+        if self.stopped:
+            return ""
+        window = self.pending + text
+        matches = [window.find(stop) for stop in self.stop_sequences]
+        stop_index = min((i for i in matches if i != -1), default=-1)
+        if stop_index != -1:
+            self.stopped = True
+            self.pending = ""
+            return window[:stop_index]
+        n_safe = max(len(window) - self.max_length + 1, 0)
+        self.pending = window[n_safe:]
+        return window[:n_safe]
+
+    def flush(self) -> str:
+        """Returns the held back text once the stream ended without a stop sequence."""
+        text, self.pending = self.pending, ""
+        return text
+
+
+def stream_chat_response(chunks: Iterable[str], console: Console) -> str:
+    """
+    Display a streamed chat response in the DeveloperGPT panel.
+
+    Args:
+        chunks (Iterable[str]): The streamed text chunks of the response.
+        console (Console): The console object for displaying the response.
+
+    Returns:
+        str: The full response text.
+    """
+    markdown = StreamingMarkdown()
+    output_panel = Panel(
+        markdown,
+        title="[bold blue]DeveloperGPT[/bold blue]",
+        title_align="left",
+        width=min(console.width, config.DEFAULT_COLUMN_WIDTH),
+    )
+    with Live(output_panel, console=console, refresh_per_second=4):
+        for chunk in profiling.traced_stream(chunks):
+            if chunk:
+                markdown.append(chunk)
+    return markdown.text
+
+
+class StreamingCommands:
+    """Rich renderable for a streamed `cmd` JSON response."""
+
+    def __init__(self, fast_mode: bool, panel_width: int):
+        self.fast_mode = fast_mode
+        self.panel_width = panel_width
+        self.parser = IncrementalJSONParser()
+        self.chunks: List[str] = []
+        self.spinner = Spinner("dots", text="[bold blue]Decoding request")
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    def append(self, text: str) -> None:
+        self.chunks.append(text)
+        self.parser.feed(text)
+
+    def commands(self) -> list:
+        """The commands parsed so far (in non-fast mode the command objects, which may be incomplete)."""
+        output_data = self.parser.value
+        commands = output_data.get("commands") if isinstance(output_data, dict) else []
+        if not isinstance(commands, list):
+            return []
+        if self.fast_mode:
+            return [c for c in commands if isinstance(c, str)]
+        return [
+            c
+            for c in commands
+            if isinstance(c, dict) and isinstance(c.get("cmd_to_execute"), str)
+        ]
+
+    def __rich_console__(
+        self, console: Console, options: ConsoleOptions
+    ) -> RenderResult:
+        commands = self.commands()
+        if commands:
+            if self.fast_mode:
+                yield utils.commands_panel(commands, self.panel_width)
+            else:
+                cmd_strings = [c["cmd_to_execute"] for c in commands]
+                yield utils.commands_panel(cmd_strings, self.panel_width)
+                yield utils.explanations_panel(commands, self.panel_width)
+        if not self.parser.done:
+            yield self.spinner
+
+
+def stream_command_response(
+    chunks: Iterable[str], console: Console, fast_mode: bool
+) -> str:
+    """
+    Display the commands of a streamed command response as soon as they are parsed.
+
+    The live display is removed once the response is complete, the final response is
+    printed by utils.print_command_response.
+
+    Args:
+        chunks (Iterable[str]): The streamed text chunks of the response.
+        console (Console): The console object for displaying the response.
+        fast_mode (bool): Whether the response is in fast mode (commands without explanations).
+
+    Returns:
+        str: The full response text.
+    """
+    view = StreamingCommands(fast_mode, min(console.width, config.DEFAULT_COLUMN_WIDTH))
+    with Live(view, console=console, refresh_per_second=8, transient=True):
+        for chunk in profiling.traced_stream(chunks):
+            if chunk:
+                view.append(chunk)
+    return view.text
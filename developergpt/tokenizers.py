@@ -0,0 +1,168 @@
+"""
+DeveloperGPT by luo-anthony
+
+Token counting for chat context budgets.
+
+Offline models count tokens with the llama.cpp model's own tokenizer. Cloud models
+are estimated with a tiktoken encoding times a per-provider correction factor,
+which is learned from the prompt token usage the provider reports with every chat
+response and saved in config.TOKEN_CALIBRATION_FILE.
+"""
+
+import functools
+import json
+import math
+import os
+from typing import Any, Optional
+
+from developergpt import config, providers, utils
+
+
+class TokenCalibration:
+    """Per-provider ratio of reported to estimated prompt tokens, persisted as JSON."""
+
+    def __init__(self, path: str = config.TOKEN_CALIBRATION_FILE):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.entries: dict = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def factor(self, key: str) -> float:
+        entry = self.entries.get(key)
+        if not isinstance(entry, dict):
+            return 1.0
+        return float(entry.get("factor", 1.0))
+
+    def observe(self, key: str, n_estimated: int, n_actual: int) -> None:
+        """Update the factor of a provider with the tokens it reported for an (uncalibrated) estimate."""
+        if n_estimated <= 0 or n_actual <= 0:
+            return
+        entry = self.entries.get(key)
+        n_samples = entry.get("samples", 0) if isinstance(entry, dict) else 0
+        # a single odd response (e.g. a mostly non-English prompt) only moves the factor so far
+        ratio = min(max(n_actual / n_estimated, 0.5), 2.0)
+        # running (geometric) mean for the first responses, then an exponential moving average
+        weight = max(1 / (n_samples + 1), config.TOKEN_CALIBRATION_WEIGHT)
+        factor = self.factor(key) ** (1 - weight) * ratio**weight
+        factor = min(max(factor, config.TOKEN_FACTOR_MIN), config.TOKEN_FACTOR_MAX)
+        self.entries[key] = {"factor": round(factor, 4), "samples": n_samples + 1}
+        self.save()
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+@functools.lru_cache(maxsize=None)
+def calibration() -> TokenCalibration:
+    """The token calibration of this user, loaded on first use."""
+    return TokenCalibration()
+
+
+class Tokenizer:
+    """Counts the tokens of chat messages for a model."""
+
+    tokens_per_message = 3
+    tokens_per_name = 1
+    reply_priming_tokens = utils.REPLY_PRIMING_TOKENS
+    calibration_key: Optional[str] = None  # None for exact token counts
+
+    def count(self, text: str) -> int:
+        raise NotImplementedError
+
+    def count_message(self, message: dict) -> int:
+        """Returns the (uncalibrated) number of tokens used by a single message."""
+        num_tokens = self.tokens_per_message
+        for key, value in message.items():
+            num_tokens += self.count(value)
+            if key == "name":
+                num_tokens += self.tokens_per_name
+        return num_tokens
+
+    @property
+    def scale(self) -> float:
+        if self.calibration_key is None:
+            return 1.0
+        return calibration().factor(self.calibration_key)
+
+    def prompt_tokens(self, n_message_tokens: int) -> int:
+        """The calibrated number of prompt tokens for messages of n_message_tokens (uncalibrated) tokens."""
+        return math.ceil((n_message_tokens + self.reply_priming_tokens) * self.scale)
+
+    def observe(self, n_estimated: int, n_actual: Optional[int]) -> None:
+        """Calibrate with the prompt tokens the provider reported for a calibrated estimate."""
+        if self.calibration_key is None or n_actual is None:
+            return
+        # the factor is learned from uncalibrated estimates
+        calibration().observe(
+            self.calibration_key, math.ceil(n_estimated / self.scale), n_actual
+        )
+
+
+class TiktokenTokenizer(Tokenizer):
+    """Estimates tokens with an OpenAI tiktoken encoding."""
+
+    def __init__(self, model: str, calibration_key: Optional[str] = None):
+        self.model, self.tokens_per_message, self.tokens_per_name = (
+            utils._message_format(model)
+        )
+        self.calibration_key = calibration_key
+
+    def count(self, text: str) -> int:
+        return len(utils.get_encoding(self.model).encode(text))
+
+
+class LlamaTokenizer(Tokenizer):
+    """Counts tokens with the tokenizer of a llama.cpp model (or a daemon serving it)."""
+
+    # chat template tokens, e.g. Mistral's "[INST] ... [/INST]" around user messages and
+    # "</s>" after assistant messages (averaged over the two)
+    tokens_per_message = 5
+    reply_priming_tokens = 1  # BOS
+
+    def __init__(self, llm: Any):
+        self.llm = llm
+
+    def count(self, text: str) -> int:
+        return len(self.llm.tokenize(text.encode(), add_bos=False, special=True))
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer(model: str) -> Tokenizer:
+    """The tiktoken tokenizer for an OpenAI model name (e.g. gpt-3.5-turbo)."""
+    return TiktokenTokenizer(model)
+
+
+@functools.lru_cache(maxsize=None)
+def _llama_tokenizer(llm: Any) -> Tokenizer:
+    return LlamaTokenizer(llm)
+
+
+@functools.lru_cache(maxsize=None)
+def _calibrated_tokenizer(model: str, provider: str) -> Tokenizer:
+    return TiktokenTokenizer(model, calibration_key=provider)
+
+
+def chat_tokenizer(model: str, client: Any) -> Tokenizer:
+    """
+    The tokenizer for the chat context budget of a model.
+
+    Args:
+        model (str): The DeveloperGPT model name.
+        client (Any): The model's client (the llama.cpp model for offline models).
+
+    Returns:
+        Tokenizer: The model's own tokenizer for offline models, a calibrated estimate otherwise.
+    """
+    if model in config.LLAMA_CPP_MODEL_MAP:
+        return _llama_tokenizer(client)
+    provider = providers.get_provider(model).name
+    if model in config.OPENAI_MODEL_MAP:
+        return _calibrated_tokenizer(config.OPENAI_MODEL_MAP[model], provider)
+    # other providers don't publish a tokenizer, start from the gpt-4 encoding
+    return _calibrated_tokenizer("gpt-4-turbo", provider)
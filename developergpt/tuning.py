@@ -0,0 +1,259 @@
+"""
+DeveloperGPT by luo-anthony
+
+Hardware-aware llama.cpp settings for offline models (`developergpt --offline tune`).
+
+Without tuning, offline models use as many threads as there are physical cores.
+`developergpt tune` benchmarks prompt evaluation and generation speed of the GGUF
+for candidate thread counts and batch sizes and stores the fastest settings per
+machine and model in config.TUNING_FILE, which every later model load uses.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from developergpt import config, few_shot_prompts
+
+
+class Hardware(NamedTuple):
+    physical_cores: int
+    logical_cores: int
+    available_ram: Optional[int]  # bytes, None if unknown
+
+
+class BenchmarkResult(NamedTuple):
+    settings: dict
+    prompt_tokens_per_second: float
+    generated_tokens_per_second: float
+
+
+def _logical_cores() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        # CPUs this process may run on (respects taskset and container limits)
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _physical_cores() -> Optional[int]:
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/cpuinfo") as f:
+                cpuinfo = f.read()
+        except OSError:
+            return None
+        cores = set()
+        for block in cpuinfo.split("\n\n"):
+            fields = dict(
+                (k.strip(), v.strip())
+                for k, _, v in (line.partition(":") for line in block.splitlines())
+            )
+            if "core id" in fields:
+                cores.add((fields.get("physical id"), fields["core id"]))
+        return len(cores) or None
+    if sys.platform == "darwin":
+        try:
+            output = subprocess.run(
+                ["sysctl", "-n", "hw.physicalcpu"],
+                capture_output=True,
+                text=True,
+                timeout=2,
+            ).stdout
+            return int(output)
+        except (OSError, ValueError, subprocess.SubprocessError):
+            return None
+    return None
+
+
+def _available_ram() -> Optional[int]:
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            return None
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def detect_hardware() -> Hardware:
+    """Detect the physical and logical CPU cores available to this process and the free RAM."""
+    logical = _logical_cores()
+    # physical cores without the ones we may not run on, hyper-threads don't speed up llama.cpp
+    physical = min(_physical_cores() or logical, logical)
+    return Hardware(physical, logical, _available_ram())
+
+
+def default_settings(hardware: Hardware) -> dict:
+    """Settings used before `developergpt tune` has been run."""
+    return {
+        "n_threads": hardware.physical_cores,
+        "n_threads_batch": hardware.physical_cores,
+    }
+
+
+def candidate_settings(hardware: Hardware, model_size: int) -> List[dict]:
+    """
+    Settings to benchmark for a model.
+
+    Args:
+        hardware (Hardware): The detected hardware.
+        model_size (int): Size of the GGUF file in bytes.
+
+    Returns:
+        List[dict]: Llama keyword arguments, one per candidate.
+    """
+    thread_counts = sorted(
+        {
+            max(1, hardware.physical_cores // 2),
+            hardware.physical_cores,
+            hardware.logical_cores,
+        }
+    )
+    # pinning the weights keeps them from being paged out between requests, but only
+    # if they fit comfortably next to everything else
+    use_mlock = (
+        hardware.available_ram is not None and hardware.available_ram > 2 * model_size
+    )
+    return [
+        {
+            "n_threads": n_threads,
+            "n_threads_batch": n_threads,
+            "n_batch": n_batch,
+            "use_mmap": True,
+            "use_mlock": use_mlock,
+        }
+        for n_threads in thread_counts
+        for n_batch in config.TUNE_BATCH_SIZES
+    ]
+
+
+def benchmark_prompt() -> str:
+    """A prompt like the ones of `cmd` requests (the few-shot conversation)."""
+    return "\n".join(m["content"] for m in few_shot_prompts.BASE_INPUT_CMD_MSGS)
+
+
+def benchmark(
+    load: Callable[[dict], Any],
+    candidates: List[dict],
+    on_result: Optional[Callable[[BenchmarkResult], None]] = None,
+) -> List[BenchmarkResult]:
+    """
+    Measure prompt evaluation and generation speed for each candidate.
+
+    Args:
+        load (Callable[[dict], Llama]): Loads the model with the given settings.
+        candidates (List[dict]): The settings to benchmark.
+        on_result (Optional[Callable[[BenchmarkResult], None]]): Called after each candidate.
+
+    Returns:
+        List[BenchmarkResult]: The measured speed of each candidate.
+    """
+    results = []
+    for settings in candidates:
+        llm = load(settings)
+        tokens = llm.tokenize(benchmark_prompt().encode())[: config.TUNE_PROMPT_TOKENS]
+        # warm up (the first evaluation also pages in the weights)
+        llm.eval(tokens[:8])
+        llm.reset()
+
+        start = time.perf_counter()
+        prompt_done = start
+        n_generated = -1
+        for _ in llm.generate(tokens, temp=0.0):
+            if n_generated == -1:
+                # the first token is sampled right after the prompt is evaluated
+                prompt_done = time.perf_counter()
+            n_generated += 1
+            if n_generated == config.TUNE_GENERATED_TOKENS:
+                break
+        end = time.perf_counter()
+        if hasattr(llm, "close"):
+            llm.close()  # free the model before loading the next candidate
+
+        result = BenchmarkResult(
+            settings,
+            len(tokens) / max(prompt_done - start, 1e-9),
+            max(n_generated, 0) / max(end - prompt_done, 1e-9),
+        )
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+    return results
+
+
+def best_settings(results: List[BenchmarkResult]) -> dict:
+    """
+    Combine the fastest settings for prompt evaluation and generation.
+
+    Prompt evaluation only depends on n_threads_batch and n_batch, generation only on
+    n_threads, so both are picked independently.
+    """
+    fastest_prompt = max(results, key=lambda r: r.prompt_tokens_per_second)
+    fastest_generation = max(results, key=lambda r: r.generated_tokens_per_second)
+    return {
+        **fastest_prompt.settings,
+        "n_threads": fastest_generation.settings["n_threads"],
+    }
+
+
+class TuningStore:
+    """Tuned llama.cpp settings per machine and GGUF file, persisted as JSON."""
+
+    def __init__(self, path: str = config.TUNING_FILE):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.entries: dict = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    @staticmethod
+    def _key(llm_file: str) -> str:
+        # the cache dir may be shared between machines (e.g. a network home directory)
+        return f"{platform.node()}/{llm_file}"
+
+    def get(self, llm_file: str, hardware: Hardware) -> Optional[dict]:
+        """The stored settings, or None if the model wasn't tuned on this hardware."""
+        entry = self.entries.get(self._key(llm_file))
+        if not isinstance(entry, dict) or entry.get("cores") != [
+            hardware.physical_cores,
+            hardware.logical_cores,
+        ]:
+            return None
+        return entry.get("settings")
+
+    def put(self, llm_file: str, hardware: Hardware, settings: dict) -> None:
+        self.entries[self._key(llm_file)] = {
+            "cores": [hardware.physical_cores, hardware.logical_cores],
+            "settings": settings,
+            "tuned_at": time.time(),
+        }
+        self.save()
+
+    def remove(self, llm_file: str) -> bool:
+        removed = self.entries.pop(self._key(llm_file), None) is not None
+        self.save()
+        return removed
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def llama_settings(model: str) -> Dict[str, Any]:
+    """The tuned llama.cpp settings for an offline model, or the defaults for this machine."""
+    _, llm_file, _ = config.LLAMA_CPP_MODEL_MAP[model]
+    hardware = detect_hardware()
+    return TuningStore().get(llm_file, hardware) or default_settings(hardware)
@@ -2,22 +2,19 @@
 DeveloperGPT by luo-anthony
 """
 
+import functools
 import json
-import os
-import sys
-from typing import Optional
-
-import pyperclip
-import requests
-import tiktoken
-from prompt_toolkit import PromptSession
-from prompt_toolkit.completion import Completer, Completion
+from typing import TYPE_CHECKING, Iterable, Optional, SupportsIndex
+
 from rich.console import Console
 from rich.markdown import Markdown
 from rich.panel import Panel
 
 from developergpt import config
 
+if TYPE_CHECKING:
+    from developergpt.tokenizers import Tokenizer
+
 
 def clean_model_output(raw_output: str) -> str:
     """
@@ -35,25 +32,60 @@ def clean_model_output(raw_output: str) -> str:
     return model_output
 
 
-def pretty_print_commands(commands: list, console: Console, panel_width: int) -> None:
-    """Pretty print the commands in a panel"""
+def is_valid_command_response(model_output: Optional[str]) -> bool:
+    """Check if the model output is command JSON that print_command_response can display."""
+    if not model_output:
+        return False
+    try:
+        output_data = json.loads(model_output)
+    except json.decoder.JSONDecodeError:
+        return False
+    return (
+        isinstance(output_data, dict)
+        and not output_data.get("error", 0)
+        and "commands" in output_data
+    )
+
+
+def commands_panel(commands: list, panel_width: int) -> Panel:
+    """Panel listing the commands"""
     commands_format = "\n\n".join([f"""- `{c}`""" for c in commands])
 
     cmd_out = Markdown(
         commands_format,
         inline_code_lexer="bash",
     )
+    return Panel(
+        cmd_out,
+        title="[bold blue]Command(s)[/bold blue]",
+        title_align="left",
+        width=panel_width,
+    )
 
-    console.print(
-        Panel(
-            cmd_out,
-            title="[bold blue]Command(s)[/bold blue]",
-            title_align="left",
-            width=panel_width,
-        )
+
+def explanations_panel(commands: list, panel_width: int) -> Panel:
+    """Panel with the command and argument explanations of (non-fast mode) commands"""
+    explanation_items = []
+    for cmd in commands:
+        explanation_items.extend([f"- {c}" for c in cmd.get("cmd_explanations", [])])
+        arg_expl = cmd.get("arg_explanations", {})
+        for k, v in arg_expl.items():
+            explanation_items.append(f"\t- `{k}` {v}")
+
+    arg_out = Markdown("\n".join(explanation_items))
+    return Panel(
+        arg_out,
+        title="[bold blue]Explanation[/bold blue]",
+        title_align="left",
+        width=panel_width,
     )
 
 
+def pretty_print_commands(commands: list, console: Console, panel_width: int) -> None:
+    """Pretty print the commands in a panel"""
+    console.print(commands_panel(commands, panel_width))
+
+
 def print_command_response(
     model_output: Optional[str], console: Console, fast_mode: bool
 ) -> list:
@@ -88,66 +120,25 @@ def print_command_response(
 
     if not fast_mode:
         # print all the explanations in a panel
-        explanation_items = []
-        for cmd in commands:
-            explanation_items.extend(
-                [f"- {c}" for c in cmd.get("cmd_explanations", [])]
-            )
-            arg_expl = cmd.get("arg_explanations", {})
-            for k, v in arg_expl.items():
-                explanation_items.append(f"\t- `{k}` {v}")
-
-        arg_out = Markdown("\n".join(explanation_items))
-
-        console.print(
-            Panel(
-                arg_out,
-                title="[bold blue]Explanation[/bold blue]",
-                title_align="left",
-                width=panel_width,
-            )
-        )
+        console.print(explanations_panel(commands, panel_width))
     return cmd_strings
 
 
 def copy_comands_to_cliboard(commands: list):
-    pyperclip.copy("\n".join(commands))
-
-
-def prompt_user_input(
-    input_request: str,
-    session: PromptSession,
-    console: Console,
-    completer=None,
-    complete_style=None,
-    auto_suggest=None,
-    key_bindings=None,
-) -> str:
-    """Prompt the user for input and handle exit if requested."""
-    user_input = session.prompt(
-        input_request,
-        style=config.INPUT_STYLE,
-        completer=completer,
-        complete_style=complete_style,
-        auto_suggest=auto_suggest,
-        key_bindings=key_bindings,
-    ).strip()
-
-    if len(user_input) == 0:
-        return ""
+    import pyperclip
 
-    if user_input.lower() == "quit" or user_input.lower() == "exit":
-        console.print("[bold blue]Exiting... [/bold blue]")
-        sys.exit(0)
-
-    return user_input
+    pyperclip.copy("\n".join(commands))
 
 
 def check_reduce_context(
-    messages: list, token_limit: int, model: str, ctx_removal_index: int
+    messages: list, token_limit: int, model: "str | Tokenizer", ctx_removal_index: int
 ) -> tuple:
     """Check if token limit is exceeded and remove old context starting at ctx_removal_index if so."""
-    n_tokens = count_msg_tokens(messages, model)
+    if isinstance(messages, ChatHistory):
+        messages.set_model(model)
+    else:
+        messages = ChatHistory(messages, model)
+    n_tokens = messages.n_tokens
     if n_tokens > token_limit:
         messages, n_tokens = remove_old_contexts(
             messages, token_limit, n_tokens, model, ctx_removal_index
@@ -155,16 +146,24 @@ def check_reduce_context(
     return messages, n_tokens
 
 
-def count_msg_tokens(messages: list, model: str) -> int:
-    """
-    Returns the approximate number of tokens used by a list of messages
-    function adapted from: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
-    """
+REPLY_PRIMING_TOKENS = 3  # every reply is primed with <|start|>assistant<|message|>
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """Returns the (cached) tiktoken encoding for a model, loading an encoding is slow."""
+    import tiktoken
+
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except KeyError:
         print("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+        return tiktoken.get_encoding("cl100k_base")
+
+
+@functools.lru_cache(maxsize=None)
+def _message_format(model: str) -> tuple:
+    """Returns (model, tokens_per_message, tokens_per_name) used to count message tokens."""
     if model in {
         "gpt-3.5-turbo-0613",
         "gpt-3.5-turbo-16k-0613",
@@ -173,93 +172,149 @@ def count_msg_tokens(messages: list, model: str) -> int:
         "gpt-4-0613",
         "gpt-4-32k-0613",
     }:
-        tokens_per_message = 3
-        tokens_per_name = 1
+        return model, 3, 1
     elif model == "gpt-3.5-turbo-0301":
-        tokens_per_message = (
-            4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
-        )
-        tokens_per_name = -1  # if there's a name, the role is omitted
+        # every message follows <|start|>{role/name}\n{content}<|end|>\n
+        # if there's a name, the role is omitted
+        return model, 4, -1
     elif "gpt-3.5-turbo" in model:
         # print("Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0613.")
-        return count_msg_tokens(messages, model="gpt-3.5-turbo-0613")
+        return _message_format("gpt-3.5-turbo-0613")
     elif "gpt-4" in model:
         # print("Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613.")
-        return count_msg_tokens(messages, model="gpt-4-0613")
+        return _message_format("gpt-4-0613")
     else:
-        raise NotImplementedError(
-            f"""num_tokens_from_messages() is not implemented for model {model}. See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens."""
-        )
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
-            if key == "name":
-                num_tokens += tokens_per_name
-    num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
-    return num_tokens
+        # other models are estimated like gpt-4 (see developergpt.tokenizers for calibration)
+        return _message_format("gpt-4-0613")
 
 
-def remove_old_contexts(
-    messages: list, token_limit: int, n_tokens: int, model: str, ctx_removal_index: int
-) -> tuple:
-    """Remove old contexts until token limit is not exceeded."""
-    while n_tokens > token_limit:
-        removed_ctx = messages.pop(ctx_removal_index)
-        n_removed = count_msg_tokens([removed_ctx], model)
-        n_tokens -= n_removed
+def _tokenizer(model: "str | Tokenizer") -> "Tokenizer":
+    if not isinstance(model, str):
+        return model
+    from developergpt import tokenizers  # imports utils
 
-    return messages, n_tokens
+    return tokenizers.get_tokenizer(model)
 
 
-class PathCompleter(Completer):
-    """A completer for file paths for terminal input."""
+def count_message_tokens(message: dict, model: "str | Tokenizer") -> int:
+    """Returns the approximate number of tokens used by a single message."""
+    return _tokenizer(model).count_message(message)
 
-    def get_completions(self, document, complete_event):
-        if complete_event.completion_requested:
-            # only display completions when the user presses tab
-            cwd = os.getcwd()
 
-            text = document.text_before_cursor.lstrip().lower().split(" ")[-1]
-            auto_completion = []
+def count_msg_tokens(messages: list, model: "str | Tokenizer") -> int:
+    """
+    Returns the approximate number of tokens used by a list of messages
+    function adapted from: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+    """
+    tokenizer = _tokenizer(model)
+    num_tokens = sum(tokenizer.count_message(message) for message in messages)
+    return tokenizer.prompt_tokens(num_tokens)
 
-            if text.startswith("~/"):
-                f_path = os.path.expanduser(text)
-            elif text.startswith("/"):
-                f_path = text
-            else:
-                f_path = os.path.join(cwd, text)
 
-            curr_dir = os.path.dirname(f_path)
-            fname = os.path.basename(f_path) if len(text) > 0 else ""
+def remove_old_contexts(
+    messages: list,
+    token_limit: int,
+    n_tokens: int,
+    model: "str | Tokenizer",
+    ctx_removal_index: int,
+) -> tuple:
+    """Remove old contexts until token limit is not exceeded."""
+    while n_tokens > token_limit:
+        removed_ctx = messages.pop(ctx_removal_index)
+        if isinstance(messages, ChatHistory):
+            n_tokens = messages.n_tokens
+        else:
+            n_tokens -= count_message_tokens(removed_ctx, model)
 
-            if os.path.isdir(curr_dir):
-                # Generate a list of matching file names in the current directory
-                auto_completion = [
-                    os.path.join(curr_dir, f)
-                    for f in os.listdir(curr_dir)
-                    if fname in f.lower()
-                ]
+    return messages, n_tokens
 
-            for completion in auto_completion:
-                # simplify the completion substitution if possible
-                if text.startswith("~/"):
-                    completion = completion.replace(os.path.expanduser("~/"), "~/")
-                elif cwd in completion:
-                    completion = os.path.relpath(completion, cwd)
 
-                # substitute for the full path but only display the basename of the file
-                yield Completion(
-                    completion,
-                    display=os.path.basename(completion),
-                    start_position=-len(text),
-                )
+class ChatHistory(list):
+    """
+    List of chat messages with a running token count.
+    Each message is encoded once when it is added, so adding and removing messages
+    doesn't re-encode the rest of the history.
+    """
+
+    def __init__(
+        self, messages: Iterable = (), model: "str | Tokenizer" = "gpt-3.5-turbo"
+    ):
+        super().__init__(messages)
+        self.model = _tokenizer(model)
+        self._recount()
+
+    @property
+    def n_tokens(self) -> int:
+        """Approximate number of tokens used by all messages (see count_msg_tokens)."""
+        return self.model.prompt_tokens(self._total)
+
+    def set_model(self, model: "str | Tokenizer") -> None:
+        tokenizer = _tokenizer(model)
+        if tokenizer is not self.model:
+            self.model = tokenizer
+            self._recount()
+
+    def append(self, message: dict) -> None:
+        n_tokens = count_message_tokens(message, self.model)
+        super().append(message)
+        self._message_tokens.append(n_tokens)
+        self._total += n_tokens
+
+    def extend(self, messages: Iterable) -> None:
+        for message in messages:
+            self.append(message)
+
+    def __iadd__(self, messages: Iterable):  # type: ignore[override]
+        self.extend(messages)
+        return self
+
+    def insert(self, index: SupportsIndex, message: dict) -> None:
+        n_tokens = count_message_tokens(message, self.model)
+        super().insert(index, message)
+        self._message_tokens.insert(index, n_tokens)
+        self._total += n_tokens
+
+    def pop(self, index: SupportsIndex = -1) -> dict:
+        message = super().pop(index)
+        self._total -= self._message_tokens.pop(index)
+        return message
+
+    def clear(self) -> None:
+        super().clear()
+        self._message_tokens = []
+        self._total = 0
+
+    def _recount(self) -> None:
+        self._message_tokens = [count_message_tokens(m, self.model) for m in self]
+        self._total = sum(self._message_tokens)
+
+    # less common mutations recount the whole history
+    def __setitem__(self, index, value) -> None:
+        super().__setitem__(index, value)
+        self._recount()
+
+    def __delitem__(self, index) -> None:
+        super().__delitem__(index)
+        self._recount()
+
+    def remove(self, message: dict) -> None:
+        super().remove(message)
+        self._recount()
+
+    def sort(self, *args, **kwargs) -> None:
+        super().sort(*args, **kwargs)
+        self._recount()
+
+    def reverse(self) -> None:
+        super().reverse()
+        self._recount()
 
 
 def check_connectivity(url: str = "http://www.google.com", timeout: int = 8) -> bool:
+    import requests
+
     try:
-        _ = requests.get(url, timeout=timeout)
+        _ = requests.head(url, timeout=timeout)
         return True
-    except requests.ConnectionError:
+    except (requests.ConnectionError, requests.Timeout):
         return False
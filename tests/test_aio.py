@@ -0,0 +1,66 @@
+import asyncio
+import io
+import threading
+
+import anthropic
+import openai
+import pytest
+from rich.console import Console
+
+from developergpt import aio, config, providers
+
+
+async def _numbers(n: int):
+    for i in range(n):
+        await asyncio.sleep(0)
+        yield i
+
+
+def test_run_uses_one_background_loop():
+    async def current_loop():
+        return asyncio.get_running_loop(), threading.current_thread()
+
+    loop, thread = aio.run(current_loop())
+    assert aio.run(current_loop()) == (loop, thread)
+    assert thread is not threading.current_thread()
+
+
+def test_iterate_async_stream():
+    assert list(aio.iterate(_numbers(5))) == [0, 1, 2, 3, 4]
+
+
+def test_run_raises_coroutine_errors():
+    async def fail():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError, match="bad request"):
+        aio.run(fail())
+
+
+def test_http_client_is_shared_per_provider():
+    client = providers._openai_http_client()
+    assert isinstance(client, openai.DefaultAsyncHttpxClient)
+    assert providers._openai_http_client() is client
+    assert isinstance(
+        providers._anthropic_http_client(), anthropic.DefaultAsyncHttpxClient
+    )
+
+
+def test_sdk_clients_use_the_pool(monkeypatch):
+    monkeypatch.setenv(config.OPEN_AI_API_KEY, "sk-test")
+    monkeypatch.setenv(config.ANTHROPIC_API_KEY, "sk-ant-test")
+    console = Console(file=io.StringIO())
+    client = providers.create_client(config.GPT4, console)
+    assert client._client is providers._openai_http_client()
+    client = providers.create_client(config.HAIKU, console)
+    assert client._client is providers._anthropic_http_client()
+
+
+def test_sdk_without_httpx_client_class_uses_its_default():
+    assert aio.http_client("legacy", None) is None
+    assert aio.warm_up(None, config.OPENAI_ENDPOINT) is None
+
+
+def test_warm_up_is_a_no_op_for_offline_models():
+    # nothing to connect to, must not start any network request
+    providers.warm_up(config.MISTRAL_Q6)
@@ -0,0 +1,84 @@
+import json
+import threading
+import time
+
+import pytest
+
+from developergpt import batch
+
+
+def _command(request: str) -> str:
+    return json.dumps({"commands": [request]})
+
+
+def test_read_requests():
+    lines = ["list files\n", "\n", "# a comment\n", "  show disk usage  \n"]
+    assert batch.read_requests(lines) == ["list files", "show disk usage"]
+
+
+def test_results_are_ordered_and_parsed():
+    delays = {"a": 0.1, "b": 0.0, "c": 0.05}
+
+    def get_output(request):
+        time.sleep(delays[request])
+        return _command(request)
+
+    results = list(batch.run_batch(["a", "b", "c"], get_output, concurrency=3))
+    assert [r["index"] for r in results] == [0, 1, 2]
+    assert results[0]["response"] == {"commands": ["a"]}
+    assert results[0]["timings"]["seconds"] >= 0.1
+
+    unordered = batch.run_batch(
+        ["a", "b", "c"], get_output, concurrency=3, ordered=False
+    )
+    assert [r["request"] for r in unordered] == ["b", "c", "a"]
+
+
+def test_concurrency_is_bounded():
+    lock = threading.Lock()
+    in_flight = []
+    max_in_flight = []
+
+    def get_output(request):
+        with lock:
+            in_flight.append(request)
+            max_in_flight.append(len(in_flight))
+        time.sleep(0.02)
+        with lock:
+            in_flight.remove(request)
+        return _command(request)
+
+    requests = [str(i) for i in range(12)]
+    results = list(batch.run_batch(requests, get_output, concurrency=3))
+    assert len(results) == 12
+    assert max(max_in_flight) == 3
+
+
+def test_failed_requests_are_reported():
+    def get_output(request):
+        if request == "exit":
+            raise SystemExit(-1)  # adapters exit on API errors
+        if request == "error":
+            raise ValueError("rate limited")
+        return "not json"
+
+    results = list(
+        batch.run_batch(["exit", "error", "invalid"], get_output, concurrency=2)
+    )
+    assert [r["response"] for r in results] == [None, None, None]
+    assert [r["error"] for r in results] == [
+        "-1",
+        "rate limited",
+        "no valid command response",
+    ]
+
+
+def test_rate_limiter_spaces_requests():
+    limiter = batch.RateLimiter(requests_per_minute=60 * 20)  # one per 50ms
+    start = time.monotonic()
+    threads = [threading.Thread(target=limiter.acquire) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - start == pytest.approx(0.2, abs=0.08)
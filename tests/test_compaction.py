@@ -0,0 +1,173 @@
+import threading
+
+import tiktoken
+
+from developergpt import compaction, few_shot_prompts, utils
+from developergpt.few_shot_prompts import INITIAL_CHAT_SYSTEM_MSG
+
+# byte-level encoding built in-process, the real encodings are downloaded on first use
+BYTE_ENCODING = tiktoken.Encoding(
+    name="bytes",
+    pat_str=r"\S+|\s+",
+    mergeable_ranks={bytes([i]): i for i in range(256)},
+    special_tokens={},
+)
+
+
+def _turn(i: int) -> list:
+    return [
+        {"role": "user", "content": f"question {i}"},
+        {"role": "assistant", "content": f"answer {i}"},
+    ]
+
+
+def _history(n_turns: int) -> list:
+    messages = [INITIAL_CHAT_SYSTEM_MSG]
+    for i in range(n_turns):
+        messages += _turn(i)
+    return messages
+
+
+class BlockingSummarizer:
+    """Summarizer that only finishes once released (or cancelled)."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.transcripts = []
+
+    def __call__(self, transcript, cancel):
+        self.transcripts.append(transcript)
+        while not self.release.wait(0.01):
+            if cancel.is_set():
+                return None
+        return f"summary {len(self.transcripts)}"
+
+
+def _compactor(summarize, **kwargs):
+    # over the watermark beyond 6 messages, without counting tokens
+    return compaction.Compactor(
+        summarize, first_index=1, max_tokens=10**6, max_messages=6, **kwargs
+    )
+
+
+def _wait(compactor):
+    compactor._job.done.wait(5)
+
+
+def test_under_watermark_is_not_compacted(monkeypatch):
+    monkeypatch.setattr(utils, "get_encoding", lambda model: BYTE_ENCODING)
+    summarizer = BlockingSummarizer()
+    compactor = compaction.Compactor(summarizer, first_index=1, max_tokens=10**6)
+    messages = _history(4)
+    compactor.after_turn(messages)
+    assert compactor._job is None
+
+    compactor.max_tokens = 100
+    compactor.after_turn(messages)  # over the token watermark
+    assert compactor._job is not None
+    summarizer.release.set()
+    assert compactor.before_request(messages) is messages
+
+
+def test_request_does_not_wait_for_summary():
+    summarizer = BlockingSummarizer()
+    compactor = _compactor(summarizer)
+    messages = _history(4)
+    compactor.after_turn(messages)
+
+    # the summary isn't ready, the full history is used
+    assert compactor.before_request(messages) == _history(4)
+
+    summarizer.release.set()
+    _wait(compactor)
+    messages = compactor.before_request(messages)
+    assert messages[0] is INITIAL_CHAT_SYSTEM_MSG
+    assert messages[1]["content"] == f"{few_shot_prompts.SUMMARY_PREFIX}\nsummary 1"
+    assert messages[2]["role"] == "assistant"
+    # the most recent turns are kept as they are
+    assert messages[3:] == _turn(2) + _turn(3)
+    assert "question 0" in summarizer.transcripts[0]
+    assert "question 2" not in summarizer.transcripts[0]
+
+
+def test_summary_is_rolling():
+    summarizer = BlockingSummarizer()
+    summarizer.release.set()
+    compactor = _compactor(summarizer)
+    messages = _history(4)
+    compactor.after_turn(messages)
+    _wait(compactor)
+    messages = compactor.before_request(messages) + _turn(4)
+
+    compactor.after_turn(messages)
+    _wait(compactor)
+    messages = compactor.before_request(messages)
+    assert few_shot_prompts.SUMMARY_PREFIX in summarizer.transcripts[1]
+    assert messages[1]["content"].endswith("summary 2")
+    assert messages[3:] == _turn(3) + _turn(4)
+
+
+def test_changed_history_discards_summary():
+    summarizer = BlockingSummarizer()
+    summarizer.release.set()
+    compactor = _compactor(summarizer)
+    messages = _history(4)
+    compactor.after_turn(messages)
+    _wait(compactor)
+
+    # the adapter dropped the oldest turn meanwhile
+    del messages[1:3]
+    assert (
+        compactor.before_request(messages)
+        == [INITIAL_CHAT_SYSTEM_MSG] + _history(4)[3:]
+    )
+
+
+def test_exclusive_summarizer_runs_before_the_request():
+    threads = []
+
+    def summarize(transcript, cancel):
+        threads.append(threading.current_thread())
+        return "summary"
+
+    compactor = _compactor(summarize, exclusive=True)
+    messages = _history(4)
+    # the chat model is never asked in the background
+    compactor.after_turn(messages)
+    assert compactor._job is None and not threads
+
+    assert compactor.due(messages)
+    messages = compactor.before_request(messages)
+    assert threads == [threading.current_thread()]
+    assert messages[1]["content"] == f"{few_shot_prompts.SUMMARY_PREFIX}\nsummary"
+    assert messages[3:] == _turn(2) + _turn(3)
+
+    # under the watermark again
+    assert not compactor.due(messages)
+    assert compactor.before_request(messages) is messages
+    assert len(threads) == 1
+
+
+def test_close_cancels_background_summary():
+    summarizer = BlockingSummarizer()
+    compactor = _compactor(summarizer)
+    compactor.after_turn(_history(4))
+    job = compactor._job
+    assert not compactor.due(_history(4))
+
+    compactor.close()
+    assert job.cancel.is_set()
+    assert job.done.wait(5)
+    assert job.summary is None
+    assert compactor._job is None
+
+
+def test_failing_summarizer_keeps_history():
+    def summarize(transcript, cancel):
+        raise ConnectionError
+
+    compactor = _compactor(summarize)
+    messages = _history(4)
+    compactor.after_turn(messages)
+    _wait(compactor)
+    assert compactor.before_request(messages) == _history(4)
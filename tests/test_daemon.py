@@ -0,0 +1,138 @@
+import threading
+import time
+
+import pytest
+
+from developergpt import config, daemon, tokenizers
+
+pytestmark = pytest.mark.skipif(
+    not daemon.is_supported(), reason="requires Unix domain sockets"
+)
+
+
+class FakeLlama:
+    def __init__(self):
+        self.calls = []
+
+    def create_chat_completion(self, **kwargs):
+        self.calls.append(kwargs)
+        if kwargs.get("stream"):
+            # llama.cpp sends the role first, without any content
+            return iter(
+                [
+                    {"choices": [{"delta": {"role": "assistant"}}]},
+                    {"choices": [{"delta": {"content": "ls "}}]},
+                    {"choices": [{"delta": {"content": "-la"}}]},
+                ]
+            )
+        if kwargs.get("messages") == "fail":
+            raise ValueError("bad request")
+        return {"choices": [{"message": {"content": "ls -la"}}]}
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False):
+        return [1] * add_bos + list(text)
+
+
+class BlockingLlama(FakeLlama):
+    """Generates until released, counting concurrent generations."""
+
+    def __init__(self):
+        super().__init__()
+        self.generating = threading.Event()
+        self.release = threading.Event()
+        self.n_running = 0
+        self.max_running = 0
+
+    def create_chat_completion(self, **kwargs):
+        self.n_running += 1
+        self.max_running = max(self.max_running, self.n_running)
+        self.generating.set()
+        self.release.wait(5)
+        self.n_running -= 1
+        return super().create_chat_completion(**kwargs)
+
+
+@pytest.fixture
+def llama():
+    return FakeLlama()
+
+
+@pytest.fixture
+def served(tmpdir, monkeypatch, llama):
+    monkeypatch.setattr(config, "CACHE_DIR", str(tmpdir))
+    server = threading.Thread(
+        target=daemon.serve, args=(config.MISTRAL_Q6, 10, llama), daemon=True
+    )
+    server.start()
+    client = None
+    while client is None:
+        client = daemon.connect(config.MISTRAL_Q6)
+    yield client, llama
+    client.shutdown()
+    server.join(timeout=5)
+
+
+def test_streams_chat_chunks(served):
+    client, llama = served
+    chunks = client.create_chat_completion_openai_v1(
+        messages=[{"role": "user", "content": "list files"}], stream=True
+    )
+    content = [chunk.choices[0].delta.content for chunk in chunks]
+    assert content == [None, "ls ", "-la"]
+    assert llama.calls[0]["messages"][0]["content"] == "list files"
+
+
+def test_errors_are_raised_on_the_client(served):
+    client, _ = served
+    with pytest.raises(daemon.DaemonError, match="bad request"):
+        client.create_chat_completion_openai_v1(messages="fail")
+    # the daemon keeps serving after a failed request
+    response = client.create_chat_completion_openai_v1(messages=[])
+    assert response.choices[0].message.content == "ls -la"
+
+
+def test_tokenizes_with_the_served_model(served):
+    client, _ = served
+    assert client.tokenize(b"ls", add_bos=False) == list(b"ls")
+    tokenizer = tokenizers.chat_tokenizer(config.MISTRAL_Q6, client)
+    assert tokenizer.count("ls -la") == len("ls -la")
+
+
+@pytest.mark.parametrize("llama", [BlockingLlama()])
+def test_ping_while_generating(served):
+    client, llama = served
+    responses = []
+
+    def request():
+        response = client.create_chat_completion_openai_v1(messages=[])
+        responses.append(response.choices[0].message.content)
+
+    requests = [threading.Thread(target=request) for _ in range(2)]
+    requests[0].start()
+    assert llama.generating.wait(5)
+    requests[1].start()
+
+    # a busy daemon still answers, so the CLI doesn't load the model a second time
+    start = time.perf_counter()
+    assert daemon.connect(config.MISTRAL_Q6) is not None
+    assert time.perf_counter() - start < daemon.CONNECT_TIMEOUT
+
+    llama.release.set()
+    for thread in requests:
+        thread.join(5)
+    assert responses == ["ls -la", "ls -la"]
+    # the second request waited for the model
+    assert llama.max_running == 1
+
+
+def test_connect_without_daemon(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, "CACHE_DIR", str(tmpdir))
+    # a socket file left behind by a daemon that was killed
+    (tmpdir / f"daemon-{config.MISTRAL_Q6}.sock").write("")
+    assert daemon.connect(config.MISTRAL_Q6) is None
+
+
+def test_exits_when_idle(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, "CACHE_DIR", str(tmpdir))
+    daemon.serve(config.MISTRAL_Q6, 0.1, FakeLlama())
+    assert not (tmpdir / f"daemon-{config.MISTRAL_Q6}.sock").exists()
@@ -0,0 +1,217 @@
+import io
+from collections import Counter
+
+import pytest
+import tiktoken
+from rich.console import Console
+
+pytest.importorskip("google.generativeai")
+
+from google.api_core import exceptions as google_exceptions  # noqa: E402
+from google.generativeai import ChatSession  # noqa: E402
+
+from developergpt import (  # noqa: E402
+    config,
+    gemini_adapter,
+    json_repair,
+    providers,
+    tokenizers,
+    utils,
+)
+
+MODEL = config.FLASH
+
+# byte-level encoding built in-process, the real encodings are downloaded on first use
+BYTE_ENCODING = tiktoken.Encoding(
+    name="bytes",
+    pat_str=r"\S+|\s+",
+    mergeable_ranks={bytes([i]): i for i in range(256)},
+    special_tokens={},
+)
+
+COMMAND_JSON = '{"commands": [{"cmd_to_execute": "ls", "cmd_explanations": ["list"], "arg_explanations": {}}]}'
+
+
+class FakeChunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeStream:
+    """Streamed response of the Gemini API stand-in."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.usage_metadata = None
+
+    def __aiter__(self):
+        async def chunks():
+            yield FakeChunk(self.text)
+
+        return chunks()
+
+
+class FakeGemini:
+    """Local stand-in for the Gemini API, recording the contents of every request."""
+
+    def __init__(self, refuse_cache: bool = False):
+        self.refuse_cache = refuse_cache
+        self.caches: dict = {}
+        self.uploads = 0
+        self.models = 0
+        self.requests: list = []  # contents including the cached prefix
+        self.sent: list = []  # contents sent with the request
+        gemini = self
+
+        class FakeCachedContent:
+            def __init__(self, name: str, model: str):
+                self.name, self.model = name, model
+
+            @classmethod
+            def create(cls, *, model, contents, ttl):
+                if gemini.refuse_cache:
+                    raise google_exceptions.InvalidArgument("content too small")
+                gemini.uploads += 1
+                name = f"cachedContents/{gemini.uploads}"
+                gemini.caches[name] = list(contents)
+                return cls(name, model)
+
+        class FakeModel:
+            def __init__(self, model_name: str, cached_content=None):
+                gemini.models += 1
+                self.model_name = model_name
+                self.cached_content = cached_content
+
+            @classmethod
+            def from_cached_content(cls, cached_content):
+                return cls(cached_content.model, cached_content=cached_content.name)
+
+            async def generate_content_async(self, contents, **kwargs):
+                prefix = []
+                if self.cached_content is not None:
+                    if self.cached_content not in gemini.caches:
+                        raise google_exceptions.NotFound("cached content expired")
+                    prefix = gemini.caches[self.cached_content]
+                gemini.sent.append(list(contents))
+                gemini.requests.append(prefix + list(contents))
+                return FakeStream(COMMAND_JSON)
+
+        self.CachedContent = FakeCachedContent
+        self.GenerativeModel = FakeModel
+
+
+@pytest.fixture
+def gemini(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, "get_encoding", lambda model: BYTE_ENCODING)
+    calibration = tokenizers.TokenCalibration(str(tmpdir / "calibration.json"))
+    monkeypatch.setattr(tokenizers, "calibration", lambda: calibration)
+    store = gemini_adapter.ContextCacheStore(str(tmpdir / "context_cache.json"))
+    monkeypatch.setattr(gemini_adapter, "context_cache", lambda: store)
+    fake = FakeGemini()
+    monkeypatch.setattr(gemini_adapter.caching, "CachedContent", fake.CachedContent)
+    monkeypatch.setattr(gemini_adapter, "GenerativeModel", fake.GenerativeModel)
+    # count the JSON outcomes here instead of in the response cache
+    fake.outcomes = Counter()
+    resolve = json_repair.resolve_command_output
+    monkeypatch.setattr(
+        json_repair,
+        "resolve_command_output",
+        lambda *args, **kwargs: resolve(*args, **{**kwargs, "outcomes": fake.outcomes}),
+    )
+    gemini_adapter.get_model.cache_clear()
+    gemini_adapter._cached_prefix_model.cache_clear()
+    yield fake
+    gemini_adapter.get_model.cache_clear()
+    gemini_adapter._cached_prefix_model.cache_clear()
+
+
+def _command(user_input: str) -> str:
+    return gemini_adapter.model_command(
+        user_input=user_input,
+        console=Console(file=io.StringIO()),
+        fast_mode=False,
+        model=MODEL,
+    )
+
+
+def test_warm_up_uses_the_cached_model(gemini, monkeypatch):
+    counted = []
+
+    async def count_tokens_async(self, contents):
+        counted.append(self)
+
+    monkeypatch.setattr(
+        gemini.GenerativeModel, "count_tokens_async", count_tokens_async, raising=False
+    )
+    providers.get_provider(MODEL).warm_up(MODEL).result(timeout=5)
+    assert counted == [gemini_adapter.get_model(MODEL)]
+    assert gemini.models == 1
+
+
+def test_prefix_is_uploaded_once(gemini):
+    _command("list files")
+    _command("show disk usage")
+
+    assert gemini.uploads == 1
+    assert gemini.outcomes == Counter({json_repair.VALID: 2})
+    assert gemini.caches["cachedContents/1"] == gemini_adapter.BASE_INPUT_CMD_MSGS
+    # the models are created once and the requests send the prefix by reference
+    assert gemini.models == 2
+    for i, user_input in enumerate(["list files", "show disk usage"]):
+        request = gemini_adapter.format_user_request(user_input)
+        assert gemini.sent[i] == [request]
+        assert gemini.requests[i] == gemini_adapter.BASE_INPUT_CMD_MSGS + [request]
+
+    # a new process reuses the uploaded prefix
+    store = gemini_adapter.ContextCacheStore(gemini_adapter.context_cache().path)
+    assert gemini_adapter.cached_prefix(
+        MODEL, gemini_adapter.BASE_INPUT_CMD_MSGS, store
+    ) == gemini_adapter.CachedPrefix(
+        "cachedContents/1",
+        config.GOOGLE_MODEL_MAP[MODEL],
+        store.key(config.GOOGLE_MODEL_MAP[MODEL], gemini_adapter.BASE_INPUT_CMD_MSGS),
+    )
+    assert gemini.uploads == 1
+
+
+def test_refused_upload_is_sent_inline_and_not_retried(gemini):
+    gemini.refuse_cache = True
+    _command("list files")
+    gemini.refuse_cache = False
+    _command("list files")
+
+    assert gemini.uploads == 0
+    assert gemini.sent[-1][:-1] == gemini_adapter.BASE_INPUT_CMD_MSGS
+
+
+def test_expired_prefix_falls_back_inline(gemini):
+    _command("list files")
+    gemini.caches.clear()  # deleted on the server
+    _command("list files")
+    assert gemini.sent[-1][:-1] == gemini_adapter.BASE_INPUT_CMD_MSGS
+
+    # the prefix is uploaded again by the next request
+    _command("list files")
+    assert gemini.uploads == 2
+
+
+def test_history_is_kept_under_token_budget(gemini):
+    history = []
+    for i in range(10):
+        history.append({"role": "user", "parts": [f"question {i} " * 10]})
+        history.append({"role": "model", "parts": [f"answer {i} " * 10]})
+    chat_session = ChatSession(model=None, history=history)
+    tokenizer = tokenizers.chat_tokenizer(MODEL, None)
+
+    n_tokens = gemini_adapter.reduce_history(chat_session, "next", 500, tokenizer)
+    assert n_tokens <= 500
+    kept = chat_session.history
+    assert 0 < len(kept) < 20 and len(kept) % 2 == 0
+    assert kept[0].role == "user"
+    assert kept[-1].parts[0].text == "answer 9 " * 10
+
+    # a history under the budget is left as it is
+    assert gemini_adapter.reduce_history(chat_session, "next", 500, tokenizer) == (
+        n_tokens
+    )
+    assert len(chat_session.history) == len(kept)
@@ -0,0 +1,88 @@
+import json
+import re
+
+import pytest
+
+from developergpt import few_shot_prompts, grammars
+
+TOKEN = re.compile(r'\s+|"(?:\\.|[^"\\])*"|\[(?:\\.|[^\]\\])*\]|[a-z0-9-]+|[()|*+?]')
+
+
+def _to_regex(gbnf: str) -> "re.Pattern":
+    """Compile a (non-recursive) GBNF grammar to an equivalent regular expression."""
+    rules = dict(line.split(" ::= ", 1) for line in gbnf.splitlines())
+
+    def expand(body: str) -> str:
+        parts = []
+        for token in TOKEN.findall(body):
+            if token.isspace():
+                continue
+            if token.startswith('"'):
+                parts.append(re.escape(json.loads(token)))
+            elif token.startswith("["):
+                parts.append(token)
+            elif token == "(":
+                parts.append("(?:")
+            elif token in ")|*+?":
+                parts.append(token)
+            else:
+                parts.append(f"(?:{expand(rules[token])})")
+        return "".join(parts)
+
+    return re.compile(expand(rules["root"]))
+
+
+@pytest.mark.parametrize("fast_mode", [False, True])
+def test_all_rules_are_defined(fast_mode):
+    gbnf = grammars.command_gbnf(fast_mode)
+    rules = dict(line.split(" ::= ", 1) for line in gbnf.splitlines())
+    assert gbnf.startswith("root ::= ")
+    for body in rules.values():
+        for token in TOKEN.findall(body):
+            if re.fullmatch(r"[a-z0-9-]+", token):
+                assert token in rules
+
+
+@pytest.mark.parametrize(
+    "fast_mode, output",
+    [
+        (False, few_shot_prompts.CONDA_OUTPUT_EXAMPLE),
+        (False, few_shot_prompts.SEARCH_OUTPUT_EXAMPLE),
+        (False, few_shot_prompts.UNKNOWN_QUERY_OUTPUT_EXAMPLE_ONE),
+        (True, few_shot_prompts.CONDA_OUTPUT_EXAMPLE_FAST),
+        (True, few_shot_prompts.PROCESS_OUTPUT_EXAMPLE_FAST),
+        (True, few_shot_prompts.UNKNOWN_QUERY_OUTPUT_EXAMPLE_ONE_FAST),
+    ],
+)
+def test_few_shot_examples_match(fast_mode, output):
+    grammar = _to_regex(grammars.command_gbnf(fast_mode))
+    assert grammar.fullmatch(output.strip())
+
+
+@pytest.mark.parametrize(
+    "fast_mode, output",
+    [
+        (True, '{"commands": ["ls -la",]}'),  # trailing comma
+        (True, '{"commands": []}'),
+        (True, '```json\n{"commands": ["ls"]}\n```'),
+        (True, '{"commands": ["ls"]} Hope this helps!'),  # nothing after the object
+        (True, '{"error": 0}'),
+        (False, '{"input": "ls", "error": 0, "commands": [{"cmd_to_execute": "ls"}]}'),
+        (False, '{"error": 1}'),
+    ],
+)
+def test_invalid_outputs_do_not_match(fast_mode, output):
+    grammar = _to_regex(grammars.command_gbnf(fast_mode))
+    assert not grammar.fullmatch(output)
+
+
+def test_format_schema():
+    schema = grammars.format_schema(few_shot_prompts.JSON_CMD_FORMAT)
+    assert schema["required"] == ["input", "error", "commands"]
+    assert schema["properties"]["error"] == {"const": 0}
+    command = schema["properties"]["commands"]["items"]["properties"]
+    assert command["seq"] == {"type": "integer"}
+    assert command["arg_explanations"] == {
+        "type": "object",
+        "additionalProperties": {"type": "string"},
+    }
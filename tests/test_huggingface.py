@@ -0,0 +1,102 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+huggingface_hub = pytest.importorskip("huggingface_hub")
+
+from developergpt import config, huggingface_adapter  # noqa: E402
+
+MODEL = config.ZEPHYR
+
+
+def _event(i: int, text: str) -> bytes:
+    token = {"id": i, "text": text, "logprob": 0.0, "special": False}
+    data = {"index": i, "token": token, "generated_text": None, "details": None}
+    return b"data: " + json.dumps(data).encode() + b"\n\n"
+
+
+class StubInferenceAPI(BaseHTTPRequestHandler):
+    """
+    Streams text generation server-sent events in chunks. With `endless`, the model keeps
+    generating after starting the next user turn until the client disconnects.
+    """
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+    endless = False
+    connections: set = set()
+    disconnected = threading.Event()
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _chunk(self, data: bytes) -> None:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_POST(self) -> None:
+        self.connections.add(self.client_address)
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        texts = ["Hello", " there.", "\nUser:", " hi"]
+        try:
+            for i, text in enumerate(texts):
+                self._chunk(_event(i, text))
+            for i in range(len(texts), 1000 if self.endless else 0):
+                time.sleep(0.01)
+                self._chunk(_event(i, " more"))
+            self._chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.disconnected.set()
+            self.close_connection = True
+
+
+@pytest.fixture
+def stub_api(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubInferenceAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setitem(
+        config.HF_MODEL_MAP, MODEL, f"http://127.0.0.1:{server.server_port}"
+    )
+    StubInferenceAPI.endless = False
+    StubInferenceAPI.connections = set()
+    StubInferenceAPI.disconnected = threading.Event()
+    huggingface_hub.utils.reset_sessions()
+    yield StubInferenceAPI
+    server.shutdown()
+    server.server_close()
+
+
+def _chat_turn(backend) -> str:
+    responses = backend.generate_stream("User: hello\nAssistant: ", max_new_tokens=10)
+    return "".join(huggingface_adapter._stream_until_user_turn(responses))
+
+
+def test_user_turn_closes_the_connection(stub_api, monkeypatch):
+    closed = []
+    close = requests.Response.close
+    monkeypatch.setattr(
+        requests.Response, "close", lambda self: closed.append(self) or close(self)
+    )
+    stub_api.endless = True
+    backend = huggingface_adapter.HuggingFaceBackend(MODEL, None)
+    assert _chat_turn(backend) == "Hello there.\n"
+    # the HTTP response is closed (not left to the garbage collector), the server
+    # notices the closed connection and stops generating
+    assert len(closed) == 1
+    assert stub_api.disconnected.wait(5)
+
+
+def test_finished_stream_releases_the_connection(stub_api):
+    backend = huggingface_adapter.HuggingFaceBackend(MODEL, None)
+    responses = backend.generate_stream("User: hello\nAssistant: ", max_new_tokens=10)
+    assert [r.token.text for r in responses] == ["Hello", " there.", "\nUser:", " hi"]
+    assert _chat_turn(backend) == "Hello there.\n"
+    # both requests used the same kept-alive connection
+    assert len(stub_api.connections) == 1
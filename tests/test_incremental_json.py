@@ -0,0 +1,72 @@
+import io
+import json
+import random
+
+from rich.console import Console
+
+from developergpt.incremental_json import IncrementalJSONParser
+from developergpt.streaming import StreamingCommands
+
+RESPONSE = """```json
+{"commands": [
+  {"cmd_to_execute": "find . -name \\"*.py\\" | xargs wc -l",
+   "cmd_explanations": ["`find` searches for files.", "Counts lines \\u2013 per file"],
+   "arg_explanations": {"-name": "matches the file name", "-l": "counts lines"}},
+  {"cmd_to_execute": "git status", "cmd_explanations": [], "arg_explanations": {}}
+], "error": 0, "ratio": -1.5e3, "ok": true, "missing": null}
+```"""
+
+
+def _chunks(text: str, seed: int) -> list:
+    rng = random.Random(seed)
+    chunks = []
+    i = 0
+    while i < len(text):
+        n = rng.randint(1, 6)
+        chunks.append(text[i : i + n])
+        i += n
+    return chunks
+
+
+def test_parses_streamed_json():
+    expected = json.loads(RESPONSE[RESPONSE.index("{") : RESPONSE.rindex("}") + 1])
+    for seed in range(10):
+        parser = IncrementalJSONParser()
+        for chunk in _chunks(RESPONSE, seed):
+            parser.feed(chunk)
+        assert parser.done
+        assert parser.value == expected
+
+
+def test_strings_only_appear_once_complete():
+    parser = IncrementalJSONParser()
+    parser.feed('{"commands": [{"cmd_to_execute": "ls -l')
+    assert parser.value == {"commands": [{}]}
+    parser.feed('a", "cmd_explanations": ["Lists')
+    assert parser.value == {
+        "commands": [{"cmd_to_execute": "ls -la", "cmd_explanations": []}]
+    }
+
+
+def test_commands_are_shown_before_the_response_is_complete():
+    console = Console(width=80, file=io.StringIO(), record=True)
+    view = StreamingCommands(fast_mode=False, panel_width=80)
+    first_command_at = None
+    for i, chunk in enumerate(_chunks(RESPONSE, seed=0)):
+        view.append(chunk)
+        console.print(view)
+        if first_command_at is None and "find" in console.export_text():
+            first_command_at = i
+    assert view.text == RESPONSE
+    assert first_command_at is not None
+    assert first_command_at < len(_chunks(RESPONSE, seed=0)) // 2
+    assert [c["cmd_to_execute"] for c in view.commands()] == [
+        'find . -name "*.py" | xargs wc -l',
+        "git status",
+    ]
+
+
+def test_fast_mode_commands():
+    view = StreamingCommands(fast_mode=True, panel_width=80)
+    view.append('{"commands": ["ls -la", "du -sh *')
+    assert view.commands() == ["ls -la"]
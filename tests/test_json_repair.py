@@ -0,0 +1,160 @@
+import json
+from collections import Counter
+
+import pytest
+
+from developergpt import json_repair
+
+COMMAND = {
+    "cmd_to_execute": "find . -name '*.log' -exec rm {} \\;",
+    "cmd_explanations": ["`find` searches for files."],
+    "arg_explanations": {"-name": "the file name pattern"},
+}
+
+
+def _commands(output: str) -> list:
+    return json.loads(output)["commands"]
+
+
+@pytest.mark.parametrize(
+    "raw_output",
+    [
+        # trailing commas and a code fence
+        """```json
+{"commands": [{"cmd_to_execute": "ls -la", "cmd_explanations": ["lists files",],
+"arg_explanations": {"-l": "long format",},},], "error": 0,}
+```""",
+        # single quotes and an unquoted key
+        """{'commands': [{'cmd_to_execute': 'ls -la', 'cmd_explanations': ['lists files'],
+'arg_explanations': {'-l': 'long format'}}], error: 0}""",
+    ],
+)
+def test_repairs_syntax_errors(raw_output):
+    output = json_repair.repair_command_output(raw_output, fast_mode=False)
+    assert _commands(output) == [
+        {
+            "cmd_to_execute": "ls -la",
+            "cmd_explanations": ["lists files"],
+            "arg_explanations": {"-l": "long format"},
+        }
+    ]
+
+
+def test_repairs_unescaped_quotes_and_newlines():
+    raw_output = """Here you go:
+{"commands": [{"cmd_to_execute": "grep -r "TODO" src",
+"cmd_explanations": ["searches for
+the word TODO", "uses `find -exec rm {} \\;` style escapes"], "arg_explanations": {}}]}"""
+    (command,) = _commands(json_repair.repair_command_output(raw_output, False))
+    assert command["cmd_to_execute"] == 'grep -r "TODO" src'
+    assert command["cmd_explanations"] == [
+        "searches for\nthe word TODO",
+        "uses `find -exec rm {} \\;` style escapes",
+    ]
+
+
+def test_truncated_output_keeps_complete_commands():
+    raw_output = json.dumps({"commands": [COMMAND, COMMAND]})
+    cut_in_command = raw_output[: raw_output.rindex("cmd_to_execute") + 25]
+    assert _commands(json_repair.repair_command_output(cut_in_command, False)) == [
+        COMMAND
+    ]
+
+    fast_output = '{"commands": ["ls -la", "du -sh *", "rm -rf /tm'
+    assert _commands(json_repair.repair_command_output(fast_output, True)) == [
+        "ls -la",
+        "du -sh *",
+    ]
+
+
+def test_fast_and_full_formats():
+    raw_output = '{"commands": ["ls -la", {"cmd_to_execute": "pwd"}, 3]}'
+    assert _commands(json_repair.repair_command_output(raw_output, True)) == [
+        "ls -la",
+        "pwd",
+    ]
+    assert [
+        c["cmd_to_execute"]
+        for c in _commands(json_repair.repair_command_output(raw_output, False))
+    ] == ["ls -la", "pwd"]
+
+
+@pytest.mark.parametrize(
+    "raw_output",
+    ["I can't help with that.", '{"commands": [{"cmd_explanations": ["x"]}]}', "{"],
+)
+def test_unrepairable_output(raw_output):
+    assert json_repair.repair_command_output(raw_output, False) is None
+
+
+def test_error_response_is_kept():
+    output = json_repair.repair_command_output('{"input": "fly", "error": 1,}', False)
+    assert json.loads(output) == {"input": "fly", "error": 1}
+
+
+def test_resolve_prefers_local_repair():
+    outcomes: Counter = Counter()
+    valid = json.dumps({"commands": ["ls"]})
+    assert (
+        json_repair.resolve_command_output(
+            f"```\n{valid}\n```", True, outcomes=outcomes
+        )
+        == valid
+    )
+
+    def reask(cleaned_output, error):
+        raise AssertionError("the model must not be asked again")
+
+    output = json_repair.resolve_command_output(
+        '{"commands": ["ls",]}', True, reask, outcomes=outcomes
+    )
+    assert _commands(output) == ["ls"]
+    assert outcomes == Counter({json_repair.VALID: 1, json_repair.REPAIRED: 1})
+
+
+@pytest.mark.parametrize("raw_output", ['{"command": "ls"}', '["ls"]', '"ls"'])
+def test_json_without_commands_is_not_valid(raw_output):
+    outcomes: Counter = Counter()
+    asked = []
+
+    def reask(cleaned_output, error):
+        asked.append(error)
+        return '{"commands": ["ls"]}'
+
+    output = json_repair.resolve_command_output(
+        raw_output, True, reask, outcomes=outcomes
+    )
+    assert _commands(output) == ["ls"]
+    assert asked == ['the JSON has no "commands" list']
+    assert outcomes == Counter({json_repair.REASKED: 1})
+
+
+def test_reported_invalid_request_is_valid():
+    outcomes: Counter = Counter()
+    raw_output = '{"input": "fly", "error": 1}'
+    assert (
+        json_repair.resolve_command_output(raw_output, False, outcomes=outcomes)
+        == raw_output
+    )
+    assert outcomes == Counter({json_repair.VALID: 1})
+
+
+def test_resolve_reasks_as_last_resort():
+    outcomes: Counter = Counter()
+    asked = []
+
+    def reask(cleaned_output, error):
+        asked.append((cleaned_output, error))
+        return '{"commands": ["ls"]}'
+
+    output = json_repair.resolve_command_output(
+        "{nothing useful}", True, reask, outcomes=outcomes
+    )
+    assert _commands(output) == ["ls"]
+    assert asked and asked[0][0] == "{nothing useful}"
+
+    output = json_repair.resolve_command_output(
+        "no json at all", True, outcomes=outcomes
+    )
+    assert output == "no json at all"
+    assert outcomes == Counter({json_repair.REASKED: 1, json_repair.FAILED: 1})
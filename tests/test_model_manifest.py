@@ -0,0 +1,85 @@
+import hashlib
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from developergpt import config, model_manifest
+
+MODEL = config.MISTRAL_Q4
+LLM_FILE = config.LLAMA_CPP_MODEL_MAP[MODEL][1]
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, "OFFLINE_MODEL_CACHE_DIR", str(tmpdir))
+    return tmpdir
+
+
+@pytest.fixture
+def manifest(tmpdir):
+    return model_manifest.ModelManifest(str(tmpdir / "models.json"))
+
+
+@pytest.fixture
+def hub(monkeypatch, cache_dir):
+    """Stand-in for the Hugging Face Hub serving one revision of the model file."""
+    hub = SimpleNamespace(content=b"gguf v1", revision="rev1", downloads=0)
+
+    def remote_file(model):
+        return SimpleNamespace(
+            commit_hash=hub.revision,
+            etag=hashlib.sha256(hub.content).hexdigest(),
+        )
+
+    def hf_hub_download(repo, filename, revision, local_dir):
+        assert revision == hub.revision
+        hub.downloads += 1
+        path = os.path.join(local_dir, filename)
+        with open(path, "wb") as f:
+            f.write(hub.content)
+        return path
+
+    monkeypatch.setattr(model_manifest, "_remote_file", remote_file)
+    huggingface_hub = pytest.importorskip("huggingface_hub")
+    monkeypatch.setattr(huggingface_hub, "hf_hub_download", hf_hub_download)
+    return hub
+
+
+def test_resolve_without_download(manifest):
+    assert model_manifest.resolve(MODEL, manifest) is None
+
+
+def test_resolve_registers_existing_file(manifest, cache_dir):
+    path = str(cache_dir / LLM_FILE)
+    with open(path, "wb") as f:
+        f.write(b"gguf")
+
+    assert model_manifest.resolve(MODEL, manifest) == path
+    entry = model_manifest.ModelManifest(manifest.path).get(LLM_FILE)
+    assert entry["size"] == 4
+    assert entry["sha256"] is None  # hashed on update, not on the startup path
+
+
+def test_download_and_update(manifest, hub):
+    path = model_manifest.download(MODEL, manifest)
+    entry = manifest.get(LLM_FILE)
+    assert entry["path"] == path
+    assert entry["revision"] == "rev1"
+    assert entry["sha256"] == hashlib.sha256(b"gguf v1").hexdigest()
+
+    assert not model_manifest.update(MODEL, manifest)
+    assert hub.downloads == 1
+
+    hub.content, hub.revision = b"gguf v2", "rev2"
+    assert model_manifest.update(MODEL, manifest)
+    assert manifest.get(LLM_FILE)["revision"] == "rev2"
+    with open(path, "rb") as f:
+        assert f.read() == b"gguf v2"
+
+
+def test_corrupt_download_is_removed(manifest, hub, monkeypatch):
+    monkeypatch.setattr(model_manifest, "file_sha256", lambda path: "corrupt")
+    with pytest.raises(OSError):
+        model_manifest.download(MODEL, manifest)
+    assert model_manifest.resolve(MODEL, manifest) is None
@@ -0,0 +1,69 @@
+import pytest
+
+pytest.importorskip("llama_cpp")
+
+from developergpt import config, prefix_cache  # noqa: E402
+
+
+class FakeLlama:
+    """Stand-in for llama_cpp.Llama that tracks evaluated tokens like llama.cpp does."""
+
+    def __init__(self):
+        self.n_tokens = 0
+        self.input_ids: list = []
+        self.loaded_state = None
+
+    def save_state(self):
+        return {"input_ids": self.input_ids[: self.n_tokens], "n_tokens": self.n_tokens}
+
+    def load_state(self, state):
+        self.loaded_state = state
+        self.input_ids = list(state["input_ids"])
+        self.n_tokens = state["n_tokens"]
+
+    def reset(self):
+        self.n_tokens = 0
+
+    def evaluate(self, prompt_tokens: list, completion_tokens: list):
+        self.input_ids = prompt_tokens + completion_tokens
+        self.n_tokens = len(self.input_ids)
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, "OFFLINE_MODEL_CACHE_DIR", str(tmpdir))
+
+
+PREFIX = list(range(1000, 1200))
+
+
+def test_snapshot_after_two_different_requests():
+    client = FakeLlama()
+    cache = prefix_cache.PrefixStateCache(client, config.MISTRAL_Q4, fast_mode=True)
+
+    client.evaluate(PREFIX + [1, 2, 3], [7, 7])
+    cache.record(len(PREFIX) + 3)
+    assert not cache.restore()  # no snapshot yet, only the prompt tokens were recorded
+
+    client.evaluate(PREFIX + [4, 5], [8])
+    cache.record(len(PREFIX) + 2)
+
+    fresh_client = FakeLlama()
+    fresh_cache = prefix_cache.PrefixStateCache(
+        fresh_client, config.MISTRAL_Q4, fast_mode=True
+    )
+    assert fresh_cache.restore()
+    assert fresh_client.input_ids == PREFIX
+
+
+def test_snapshots_are_per_mode():
+    client = FakeLlama()
+    cache = prefix_cache.PrefixStateCache(client, config.MISTRAL_Q4, fast_mode=True)
+    for request in ([1], [2]):
+        client.evaluate(PREFIX + request, [])
+        cache.record(len(PREFIX) + 1)
+
+    full_mode = prefix_cache.PrefixStateCache(
+        FakeLlama(), config.MISTRAL_Q4, fast_mode=False
+    )
+    assert not full_mode.restore()
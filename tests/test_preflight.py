@@ -0,0 +1,50 @@
+import time
+
+import pytest
+from rich.console import Console
+
+from developergpt import config, preflight, utils
+
+
+def test_cache_roundtrip_and_ttl(tmpdir):
+    path = str(tmpdir / "preflight.json")
+    cache = preflight.PreflightCache(path, ttl=60)
+    cache.mark("connectivity:https://example.com")
+    cache.entries["connectivity:https://old.example.com"] = time.time() - 120
+    cache.save()
+
+    reloaded = preflight.PreflightCache(path, ttl=60)
+    assert reloaded.is_fresh("connectivity:https://example.com")
+    assert not reloaded.is_fresh("connectivity:https://old.example.com")
+    assert not reloaded.is_fresh("connectivity:https://unknown.example.com")
+
+
+def test_corrupt_cache_is_ignored(tmpdir):
+    path = tmpdir / "preflight.json"
+    path.write("{not json")
+    assert preflight.PreflightCache(str(path)).entries == {}
+
+
+def test_run_probes_provider_endpoint_once(tmpdir, monkeypatch):
+    probed = []
+
+    def fake_check_connectivity(url, timeout):
+        probed.append(url)
+        return True
+
+    monkeypatch.setattr(utils, "check_connectivity", fake_check_connectivity)
+    monkeypatch.setenv(config.GOOGLE_API_KEY, "test-key")
+    cache = preflight.PreflightCache(str(tmpdir / "preflight.json"))
+
+    preflight.run(config.FLASH, Console(), cache)
+    preflight.run(config.FLASH, Console(), cache)
+    assert probed == [config.GOOGLE_ENDPOINT]
+
+
+def test_run_exits_without_connectivity(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, "check_connectivity", lambda url, timeout: False)
+    monkeypatch.setenv(config.GOOGLE_API_KEY, "test-key")
+    cache = preflight.PreflightCache(str(tmpdir / "preflight.json"))
+
+    with pytest.raises(SystemExit):
+        preflight.run(config.FLASH, Console(), cache)
@@ -0,0 +1,74 @@
+import io
+import json
+import time
+
+import pytest
+from rich.console import Console
+
+from developergpt import profiling
+
+
+@pytest.fixture
+def profiler(monkeypatch):
+    monkeypatch.setattr(profiling, "_spans", [])
+    monkeypatch.setattr(profiling, "_enabled", False)
+    profiling.enable()
+    return profiling
+
+
+def _names(spans) -> list:
+    return [s.name for s in spans]
+
+
+def test_spans_are_not_recorded_when_disabled(monkeypatch):
+    monkeypatch.setattr(profiling, "_spans", [])
+    monkeypatch.setattr(profiling, "_enabled", False)
+    with profiling.span("preflight"):
+        pass
+    assert list(profiling.traced_stream(["a", "b"])) == ["a", "b"]
+    assert profiling.spans() == []
+
+
+def test_spans(profiler):
+    with profiler.span("preflight"):
+        with profiler.span("connectivity check"):
+            time.sleep(0.01)
+    spans = profiler.spans()
+    assert _names(spans) == ["imports", "preflight", "connectivity check"]
+    assert spans[2].end - spans[2].start >= 0.01
+    assert spans[1].start <= spans[2].start and spans[2].end <= spans[1].end
+
+
+def test_traced_stream(profiler):
+    def chunks():
+        time.sleep(0.02)  # prompt evaluation
+        yield "ls"
+        time.sleep(0.01)
+        yield " -la"
+
+    assert "".join(profiler.traced_stream(chunks())) == "ls -la"
+    ttft, generation = profiler.spans()[1:]
+    assert ttft.name == "time to first token"
+    assert ttft.end - ttft.start >= 0.02
+    assert generation.name == "generation"
+    assert generation.start == ttft.end
+
+
+def test_summary_and_chrome_trace(profiler, tmpdir):
+    for _ in range(2):
+        with profiler.span("render"):
+            pass
+
+    console = Console(file=io.StringIO(), width=100)
+    profiler.print_summary(console)
+    summary = console.file.getvalue()
+    assert "imports" in summary and "render" in summary
+
+    path = str(tmpdir / "trace.json")
+    profiler.export_chrome_trace(path)
+    with open(path) as f:
+        events = json.load(f)["traceEvents"]
+    complete = [e for e in events if e["ph"] == "X"]
+    assert _names(profiler.spans()) == [e["name"] for e in complete]
+    assert all(e["ts"] >= 0 and e["dur"] >= 0 for e in complete)
+    assert any(e["ph"] == "M" and e["name"] == "thread_name" for e in events)
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from developergpt import aio, config, race
+
+VALID = json.dumps({"commands": ["ls -la"]})
+
+
+@pytest.fixture
+def stats():
+    stats = race.RaceStats(":memory:")
+    yield stats
+    stats.close()
+
+
+def _model(response, delay=0.0, calls=None):
+    def get_output():
+        if calls is not None:
+            calls.append(time.perf_counter())
+        time.sleep(delay)
+        return response
+
+    return get_output
+
+
+def test_fastest_valid_response_wins(stats):
+    winner = race.race_command(
+        [
+            ("gpt4", _model(VALID, delay=0.5)),
+            ("haiku", _model("not json", delay=0.0)),
+            ("flash", _model(VALID, delay=0.05)),
+        ],
+        stats,
+    )
+    assert winner.model == "flash"
+    assert winner.response == VALID
+    summary = {row["model"]: row for row in stats.summary()}
+    assert summary["flash"]["wins"] == 1
+    assert summary["haiku"]["valid"] == 0
+    # gpt4 was cancelled once flash won, it would have taken at least as long as flash
+    assert summary["gpt4"]["wins"] == 0
+    assert summary["gpt4"]["p50"] >= summary["flash"]["p50"]
+
+
+def test_failing_contestants_lose(stats):
+    def exits():
+        raise SystemExit(-1)  # adapters exit on API errors
+
+    assert race.race_command([("gpt4", exits)], stats) is None
+    assert race.race_command([("gpt4", exits), ("flash", _model(VALID))], stats)
+
+
+def test_hedge_waits_for_p95(stats, monkeypatch):
+    monkeypatch.setattr(config, "RACE_MIN_SAMPLES", 3)
+    for _ in range(3):
+        stats.record("gpt4", 0.2, valid=True, won=True)
+    assert stats.hedge_delay("gpt4") == pytest.approx(0.2)
+
+    calls = []
+    winner = race.race_command(
+        [("gpt4", _model(VALID, delay=0.05)), ("flash", _model(VALID, calls=calls))],
+        stats,
+        hedge=True,
+    )
+    # gpt4 answered within its usual latency, flash was never asked
+    assert winner.model == "gpt4"
+    assert not calls
+
+    start = time.perf_counter()
+    winner = race.race_command(
+        [("gpt4", _model(VALID, delay=1.0)), ("flash", _model(VALID, calls=calls))],
+        stats,
+        hedge=True,
+    )
+    assert winner.model == "flash"
+    assert calls[0] - start == pytest.approx(0.2, abs=0.1)
+
+
+def test_hedge_asks_next_model_after_failure(stats):
+    calls = []
+    winner = race.race_command(
+        [("gpt4", _model(None)), ("flash", _model(VALID, calls=calls))],
+        stats,
+        hedge=True,
+    )
+    assert winner.model == "flash"
+    assert len(calls) == 1
+
+
+def test_losers_are_cancelled(stats):
+    cancelled = threading.Event()
+
+    def slow_request():
+        async def request():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+            return VALID
+
+        return aio.run(request())
+
+    winner = race.race_command(
+        [("gpt4", slow_request), ("flash", _model(VALID, delay=0.1))], stats
+    )
+    assert winner.model == "flash"
+    assert cancelled.wait(1)
+    # the cancelled request is recorded as a lower bound of its latency
+    (sample,) = stats.latencies("gpt4")
+    assert sample.censored and sample.latency >= 0.1
+
+
+def test_cancelled_requests_raise_the_hedge_delay(stats):
+    for _ in range(10):
+        stats.record("gpt4", 0.2, valid=True, won=True)
+    assert stats.hedge_delay("gpt4") == pytest.approx(0.2)
+    # gpt4 lost (and was cancelled) after 1s and more
+    for i in range(10):
+        stats.record("gpt4", 1.0 + i, valid=False, won=False, censored=True)
+    assert stats.hedge_delay("gpt4") >= 1.0
+
+
+def test_percentile_with_censored_samples():
+    samples = [race.Sample(float(i), censored=False) for i in range(1, 21)]
+    assert race._percentile(samples, 0.5) == 10
+    assert race._percentile(samples, 0.95) == 19
+    # censored samples are only known to be slower, the estimate can't be lower
+    censored = [race.Sample(5.0, censored=True)] * 20
+    assert race._percentile(samples + censored, 0.5) > 10
+    assert race._percentile(censored, 0.95) == 5.0
+
+
+def test_losers_do_not_block(stats):
+    release = threading.Event()
+
+    def hangs():
+        release.wait()
+        return VALID
+
+    start = time.perf_counter()
+    winner = race.race_command([("gpt4", hangs), ("flash", _model(VALID))], stats)
+    assert winner.model == "flash"
+    assert time.perf_counter() - start < 1
+    release.set()
+
+
+def test_offline_losers_stop_before_the_race_returns(stats):
+    tokens = []
+    stopped = threading.Event()
+
+    def generate():
+        try:
+            for i in range(1000):
+                time.sleep(0.01)  # evaluating the next token
+                tokens.append(i)
+                yield str(i)
+        finally:
+            stopped.set()
+
+    def offline_request():
+        # the model is shared with the foreground, it must not keep generating
+        return "".join(aio.cancellable(generate()))
+
+    winner = race.race_command(
+        [(config.MISTRAL_Q4, offline_request), ("flash", _model(VALID, delay=0.1))],
+        stats,
+    )
+    assert winner.model == "flash"
+    assert stopped.is_set()
+    n_tokens = len(tokens)
+    assert n_tokens < 1000
+    time.sleep(0.05)
+    assert len(tokens) == n_tokens
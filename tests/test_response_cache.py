@@ -0,0 +1,111 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from developergpt import cli, config, json_repair
+from developergpt.response_cache import ResponseCache, normalize_request
+
+RESPONSE = '{"commands": ["lsof -ti:8080 | xargs kill"]}'
+
+
+def _cache(**kwargs) -> ResponseCache:
+    return ResponseCache(":memory:", **kwargs)
+
+
+def test_normalize_request():
+    assert normalize_request("  Kill process on   port 8080. ") == (
+        "kill process on port 8080"
+    )
+
+
+def test_hit_and_miss_counters():
+    cache = _cache()
+    assert cache.get("kill process on port 8080", "flash", True) is None
+    cache.put("kill process on port 8080", "flash", True, RESPONSE)
+
+    cached = cache.get("Kill process on port 8080", "flash", True)
+    assert cached is not None and cached.response == RESPONSE and not cached.stale
+    # the key includes model and fast mode
+    assert cache.get("kill process on port 8080", "gpt4", True) is None
+    assert cache.get("kill process on port 8080", "flash", False) is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 3, 1)
+
+
+def test_platform_is_part_of_key():
+    cache = _cache()
+    cache.put("list files", "flash", True, RESPONSE, platform="Linux")
+    assert cache.get("list files", "flash", True, platform="Windows") is None
+    assert cache.get("list files", "flash", True, platform="Linux") is not None
+
+
+def test_lru_eviction():
+    cache = _cache(max_entries=2)
+    cache.put("a", "flash", True, RESPONSE)
+    time.sleep(0.01)
+    cache.put("b", "flash", True, RESPONSE)
+    time.sleep(0.01)
+    assert cache.get("a", "flash", True)  # "a" is now the most recently used
+    time.sleep(0.01)
+    cache.put("c", "flash", True, RESPONSE)
+
+    assert cache.get("b", "flash", True) is None
+    assert cache.get("a", "flash", True) is not None
+    assert cache.get("c", "flash", True) is not None
+
+
+def test_stale_while_revalidate_and_expiry():
+    cache = _cache(stale_ttl=60)
+    cache.put("stale", "flash", True, RESPONSE, ttl=0)
+    cached = cache.get("stale", "flash", True)
+    assert cached is not None and cached.stale
+
+    cache = _cache(stale_ttl=0)
+    cache.put("expired", "flash", True, RESPONSE, ttl=0)
+    assert cache.get("expired", "flash", True) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_stale_hit_is_refreshed_in_a_daemon_thread(tmpdir, monkeypatch):
+    path = str(tmpdir / "responses.sqlite3")
+    monkeypatch.setattr(cli, "ResponseCache", lambda: ResponseCache(path))
+    refreshed = []
+    done = threading.Event()
+
+    def refresh_cached_command(ctx, *, user_input, fast_mode):
+        refreshed.append((ctx.obj["model"], threading.current_thread().daemon))
+        done.set()
+
+    monkeypatch.setattr(cli, "refresh_cached_command", refresh_cached_command)
+    for model in [config.FLASH, config.MISTRAL_Q4]:
+        ResponseCache(path).put("list files", model, True, RESPONSE, ttl=0)
+        response = cli.get_command_response(
+            SimpleNamespace(obj={"model": model}),
+            user_input="list files",
+            fast_mode=True,
+            use_cache=True,
+        )
+        assert response == RESPONSE
+    assert done.wait(5)
+    # offline models are never asked concurrently with the foreground
+    assert refreshed == [(config.FLASH, True)]
+
+
+def test_json_outcomes_are_added_to_the_stats(tmpdir, monkeypatch):
+    path = str(tmpdir / "responses.sqlite3")
+    monkeypatch.setattr(cli, "ResponseCache", lambda: ResponseCache(path))
+
+    def model_command(ctx, *, user_input, console, fast_mode, outcomes):
+        outcomes[json_repair.REPAIRED] += 1
+        return RESPONSE
+
+    monkeypatch.setattr(cli, "model_command", model_command)
+    for user_input in ["list files", "show disk usage"]:
+        cli.get_command_response(
+            SimpleNamespace(obj={"model": config.FLASH}),
+            user_input=user_input,
+            fast_mode=True,
+            use_cache=True,
+        )
+    assert ResponseCache(path).stats()[json_repair.REPAIRED] == 2
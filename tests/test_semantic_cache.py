@@ -0,0 +1,145 @@
+import sqlite3
+import time
+
+import pytest
+
+from developergpt.semantic_cache import SemanticCache, salient_tokens
+
+RESPONSE = '{"commands": ["find . -name \'*.pyc\' -delete"]}'
+
+
+OTHER_REQUESTS = [
+    "list all .pyc files",
+    "show the current git status",
+    "kill process on port 8080",
+    "list hidden files",
+    "show disk usage",
+    "stop all docker containers",
+]
+
+
+def _cache(**kwargs) -> SemanticCache:
+    return SemanticCache(sqlite3.connect(":memory:"), **kwargs)
+
+
+def test_near_duplicate_hit():
+    cache = _cache(threshold=0.6)
+    cache.add("delete all .pyc files in this directory", "flash", True, RESPONSE)
+
+    similar = cache.lookup("delete all the .pyc files in this directory", "flash", True)
+    assert similar is not None and similar.response == RESPONSE
+    assert similar.similarity > 0.6
+
+
+def test_scope_and_threshold():
+    cache = _cache(threshold=0.6)
+    cache.add("delete all .pyc files", "flash", True, RESPONSE, platform="Linux")
+
+    assert cache.lookup("delete all .pyc files", "flash", True, "macOS") is None
+    assert cache.lookup("delete all .pyc files", "flash", False, "Linux") is None
+    assert cache.lookup("show the current git branch", "flash", True, "Linux") is None
+
+
+@pytest.mark.parametrize(
+    "stored, paraphrase",
+    [
+        ("delete all .pyc files", "delete every pyc file"),
+        ("delete all .pyc files", "remove all the .pyc files"),
+        ("delete all .pyc files", "erase *.pyc files"),
+        ("show the current git branch", "display current git branch"),
+        ("create a folder named build", "make a directory named build"),
+    ],
+)
+def test_paraphrase_hit(stored, paraphrase):
+    cache = _cache()  # default threshold
+    cache.add(stored, "flash", True, RESPONSE)
+    cache.add("show the current git status", "flash", True, "git status")
+    similar = cache.lookup(paraphrase, "flash", True)
+    assert similar is not None and similar.request == stored
+
+
+@pytest.mark.parametrize(
+    "stored, paraphrase",
+    [
+        ("delete all .pyc files", "remove every pyc file recursively"),
+        ("find files larger than 100MB", "find files bigger than 100MB"),
+        ("delete all .pyc files", "delete all .pyc files in this directory"),
+    ],
+)
+def test_paraphrase_with_other_words_hits(stored, paraphrase):
+    cache = _cache()  # default threshold
+    cache.add(stored, "flash", True, RESPONSE)
+    # the idf weights depend on the other cached requests
+    for other in OTHER_REQUESTS:
+        cache.add(other, "flash", True, "other")
+    similar = cache.lookup(paraphrase, "flash", True)
+    assert similar is not None and similar.request == stored.lower()
+
+
+@pytest.mark.parametrize(
+    "stored, other",
+    [
+        ("delete all .pyc files", "do not delete .pyc files"),
+        ("delete all .pyc files", "don't delete the .pyc files"),
+        ("delete all .pyc files", "delete all .pyc files except in venv"),
+        ("delete all .pyc files", "delete all .pyc files in src"),
+        ("find files larger than 100MB", "find files smaller than 100MB"),
+        ("create a folder named build", "create a folder named dist"),
+    ],
+)
+def test_different_meaning_misses(stored, other):
+    cache = _cache(threshold=0.0)
+    cache.add(stored, "flash", True, RESPONSE)
+    assert cache.lookup(other, "flash", True) is None
+
+
+def test_unseen_words_do_not_hide_candidates():
+    cache = _cache(threshold=0.0)
+    cache.add("delete all .pyc files", "flash", True, RESPONSE)
+    # the n-grams of the made-up word are unknown to the index (and have the highest idf),
+    # the candidates must still be found with the known n-grams
+    similar = cache.lookup("delete all .pyc files xyzzyplughquux", "flash", True)
+    assert similar is not None and similar.response == RESPONSE
+
+
+def test_salient_tokens_must_match():
+    assert salient_tokens("kill process on port 8080") == {"8080", "kill"}
+    assert salient_tokens("delete all *.pyc files") == {"pyc", "delete"}
+    assert salient_tokens("don't delete *.pyc files in src") == {
+        "pyc",
+        "delete",
+        "not",
+        "src",
+    }
+    cache = _cache(threshold=0.5)
+    cache.add("kill process on port 8080", "flash", True, RESPONSE)
+    assert cache.lookup("kill process on port 3000", "flash", True) is None
+    assert cache.lookup("kill the process on port 8080", "flash", True) is not None
+    # the requested action must match too
+    cache.add("delete all .pyc files", "flash", True, RESPONSE)
+    assert cache.lookup("list all .pyc files", "flash", True) is None
+    assert cache.lookup("delete all .log files", "flash", True) is None
+
+
+def test_expired_entries_are_stale_then_removed(monkeypatch):
+    cache = _cache(ttl=10, stale_ttl=20)
+    cache.add("delete all .pyc files", "flash", True, RESPONSE)
+    now = time.time()
+    assert not cache.lookup("delete every pyc file", "flash", True).stale
+
+    monkeypatch.setattr(time, "time", lambda: now + 15)
+    assert cache.lookup("delete every pyc file", "flash", True).stale
+
+    monkeypatch.setattr(time, "time", lambda: now + 40)
+    assert cache.lookup("delete every pyc file", "flash", True) is None
+    cache.add("list files", "flash", True, RESPONSE)  # evicts the expired entry
+    assert cache.db.execute("SELECT COUNT(*) FROM semantic_entries").fetchone() == (1,)
+
+
+def test_lru_eviction():
+    cache = _cache(max_entries=2)
+    for request in ["list files", "show disk usage", "print working directory"]:
+        cache.add(request, "flash", True, RESPONSE)
+        time.sleep(0.01)
+    assert cache.lookup("list files", "flash", True) is None
+    assert cache.lookup("print working directory", "flash", True) is not None
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from developergpt import sessions
+
+
+def _turn(i: int) -> list:
+    return [
+        {"role": "user", "content": f"question {i}"},
+        {"role": "assistant", "content": f"answer {i} " + "x" * 50},
+    ]
+
+
+@pytest.fixture
+def chat_log(tmpdir):
+    log = sessions.ChatLog("work", str(tmpdir))
+    log.create("gpt35")
+    return log
+
+
+def test_log_is_append_only_json_lines(chat_log):
+    chat_log.append(_turn(0))
+    chat_log.append(_turn(1))
+    with open(chat_log.path) as f:
+        lines = f.read().splitlines()
+    assert json.loads(lines[0])["model"] == "gpt35"
+    assert [json.loads(line) for line in lines[1:]] == _turn(0) + _turn(1)
+    assert chat_log.header()["model"] == "gpt35"
+
+
+def test_recent_reads_backwards(chat_log, monkeypatch):
+    monkeypatch.setattr(sessions, "BLOCK_SIZE", 16)  # lines span several blocks
+    for i in range(10):
+        chat_log.append(_turn(i))
+
+    assert chat_log.recent(4) == _turn(8) + _turn(9)
+    # an odd limit never starts with an assistant message
+    assert chat_log.recent(5) == _turn(8) + _turn(9)
+    assert chat_log.recent(100) == sum((_turn(i) for i in range(10)), [])
+
+
+def test_recent_of_empty_session(chat_log):
+    assert chat_log.recent(10) == []
+
+
+def test_list_and_delete(tmpdir, chat_log):
+    chat_log.append(_turn(0))
+    other = sessions.ChatLog("work.old", str(tmpdir))
+    other.create("flash")
+    (tmpdir / "work.0123456789abcdef.state").write("state")
+    (tmpdir / "work.old.0123456789abcdef.state").write("state")
+
+    listed = {s["name"]: s for s in sessions.list_sessions(str(tmpdir))}
+    assert listed["work"]["model"] == "gpt35"
+    assert listed["work"]["messages"] == 2
+    assert listed["work.old"]["messages"] == 0
+
+    chat_log.delete()
+    assert sorted(f.basename for f in tmpdir.listdir()) == [
+        "work.old.0123456789abcdef.state",
+        "work.old.jsonl",
+    ]
+
+
+@pytest.mark.parametrize(
+    "name, valid", [("work", True), ("my-chat_2.1", True), ("../x", False), ("", False)]
+)
+def test_session_names(name, valid):
+    assert sessions.is_valid_name(name) == valid
@@ -0,0 +1,51 @@
+import pytest
+
+from developergpt import speculative
+
+EOS = 2
+
+
+class FakeLlama:
+    """Stand-in for llama_cpp.Llama that continues a fixed token sequence."""
+
+    def __init__(self, continuation: list, n_vocab: int = 32000):
+        self.continuation = continuation
+        self._n_vocab = n_vocab
+        self.prompts: list = []
+
+    def generate(self, tokens: list, temp: float):
+        self.prompts.append(list(tokens))
+        yield from self.continuation
+
+    def token_eos(self) -> int:
+        return EOS
+
+    def n_vocab(self) -> int:
+        return self._n_vocab
+
+
+def test_draft_model_drafts_greedily():
+    llm = FakeLlama([5, 6, 7, 8, 9, 10])
+    draft_model = speculative.GGUFDraftModel(llm, num_pred_tokens=4)
+    assert draft_model.draft([1, 3, 4]) == [5, 6, 7, 8]
+    assert llm.prompts == [[1, 3, 4]]
+    assert draft_model.draft([]) == []
+
+
+def test_draft_stops_at_end_of_sequence():
+    draft_model = speculative.GGUFDraftModel(FakeLlama([5, EOS, 6]))
+    assert draft_model.draft([1]) == [5]
+
+
+def test_draft_validation(tmpdir):
+    path = tmpdir / "draft.gguf"
+    path.write("gguf")
+    assert speculative.is_valid_draft(speculative.PROMPT_LOOKUP)
+    assert speculative.is_valid_draft(str(path))
+    assert not speculative.is_valid_draft(str(tmpdir / "missing.gguf"))
+
+    speculative.check_vocabulary(FakeLlama([]), None)
+    draft_model = speculative.GGUFDraftModel(FakeLlama([], n_vocab=32000))
+    speculative.check_vocabulary(FakeLlama([]), draft_model)
+    with pytest.raises(ValueError):
+        speculative.check_vocabulary(FakeLlama([], n_vocab=256000), draft_model)
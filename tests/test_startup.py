@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that must only be imported once a model / interactive path is selected
+LAZY_MODULES = [
+    "openai",
+    "anthropic",
+    "google.generativeai",
+    "llama_cpp",
+    "huggingface_hub",
+    "text_generation",
+    "tiktoken",
+    "requests",
+    "prompt_toolkit",
+    "inquirer",
+    "developergpt.openai_adapter",
+    "developergpt.anthropic_adapter",
+    "developergpt.gemini_adapter",
+    "developergpt.huggingface_adapter",
+    "developergpt.interactive",
+]
+
+IMPORT_PROBE = """
+import json, sys
+import developergpt.cli
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+def _import_cli() -> list:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output)
+
+
+def test_cli_import_is_lazy():
+    # the import time itself is measured by benchmarks/bench_startup.py
+    loaded = set(_import_cli())
+    eager = [m for m in LAZY_MODULES if m in loaded]
+    assert not eager, f"modules imported eagerly by developergpt.cli: {eager}"
+
+
+def test_provider_registry_covers_supported_models():
+    from developergpt import config, providers
+
+    for model in config.SUPPORTED_MODELS:
+        assert providers.get_provider(model).adapter.startswith("developergpt.")
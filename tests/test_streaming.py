@@ -0,0 +1,164 @@
+import io
+import random
+from types import SimpleNamespace
+
+import pytest
+from rich.console import Console
+from rich.markdown import Markdown
+
+from developergpt.streaming import StopSequenceScanner, StreamingMarkdown
+
+RESPONSE = """# Finding large files
+
+Use `find` to list **large** files
+in the current directory:
+
+1. Run this command:
+   ```bash
+   find . -size +100M
+   ```
+2. Then remove the ones you don't need:
+
+   ```bash
+   rm -i file
+   ```
+
+```python
+def f():
+
+    return 1
+```
+- bullet a
+- bullet b
+
+> Be careful with `rm`.
+
+| flag | meaning |
+|------|---------|
+| -i   | prompt  |
+
+    indented code
+
+    still code
+Done.
+"""
+
+SECTION = """## Step {i}
+
+Inspect `service-{i}` and check **all** of its recent logs:
+
+```bash
+journalctl -u service-{i} --since "1 hour ago" | grep -i error | tail -n 50
+```
+
+1. The command filters errors.
+2. `tail` keeps the last 50 lines.
+
+"""
+
+
+def _render(renderable) -> str:
+    console = Console(width=80, file=io.StringIO(), record=True)
+    console.print(renderable)
+    return console.export_text(styles=True)
+
+
+def _stream(text: str, seed: int) -> list:
+    """Split text into token-sized chunks like a model response stream."""
+    rng = random.Random(seed)
+    chunks = []
+    i = 0
+    while i < len(text):
+        n = rng.randint(1, 8)
+        chunks.append(text[i : i + n])
+        i += n
+    return chunks
+
+
+def test_renders_like_full_markdown():
+    expected = _render(Markdown(RESPONSE, inline_code_theme="monokai"))
+    for seed in range(5):
+        markdown = StreamingMarkdown()
+        for chunk in _stream(RESPONSE, seed):
+            markdown.append(chunk)
+            _render(markdown)
+        assert markdown.text == RESPONSE
+        assert _render(markdown) == expected
+
+
+def test_completed_blocks_are_frozen():
+    markdown = StreamingMarkdown()
+    markdown.append("First paragraph.\n\n```bash\nls\n```\nSecond")
+    assert markdown.blocks == ["First paragraph.\n\n", "```bash\nls\n```\n"]
+    assert markdown.tail == "Second"
+
+
+def test_20k_token_stream_parses_each_block_once():
+    # ~20k streamed tokens of a long, code-heavy answer
+    text = "".join(SECTION.format(i=i) for i in range(400))
+    chunks = _stream(text, seed=0)[:20000]
+    assert len(chunks) == 20000
+    console = Console(width=80, file=io.StringIO())
+    parsed = []
+
+    class CountingMarkdown(StreamingMarkdown):
+        def _render_block(self, block, console, options):
+            parsed.append(len(block))
+            return super()._render_block(block, console, options)
+
+    markdown = CountingMarkdown()
+    for i, chunk in enumerate(chunks):
+        markdown.append(chunk)
+        if i % 100 == 0:
+            # rich.live.Live redraws a few times per second, not on every chunk
+            console.render_lines(markdown, console.options)
+    console.render_lines(markdown, console.options)
+
+    # frozen blocks are parsed once, only the open tail is parsed on every redraw
+    n_redraws = len(chunks) // 100 + 2
+    assert len(parsed) <= len(markdown.blocks) + n_redraws
+    assert sum(parsed) < 2 * len(text)
+
+
+def _scan(chunks, stop_sequences):
+    scanner = StopSequenceScanner(stop_sequences)
+    shown = []
+    for chunk in chunks:
+        shown.append(scanner.feed(chunk))
+        # only text that may still start a stop sequence is held back
+        assert len(scanner.pending) <= max(scanner.max_length - 1, 0)
+        if scanner.stopped:
+            return "".join(shown), True
+    return "".join(shown) + scanner.flush(), False
+
+
+def test_stop_sequence_split_across_chunks():
+    text = "Run `ls -la` to list files.\nUser: thanks"
+    for chunk_size in range(1, 8):
+        chunks = [text[i : i + chunk_size] for i in range(0, len(text), chunk_size)]
+        assert _scan(chunks, ["User:"]) == ("Run `ls -la` to list files.\n", True)
+
+
+def test_earliest_stop_sequence_wins():
+    assert _scan(["a <|end|> b\nUser:"], ["\nUser:", "<|end|>"]) == ("a ", True)
+
+
+def test_held_back_prefix_is_flushed_without_stop():
+    assert _scan(["print('Use", "r')"], ["User:"]) == ("print('User')", False)
+    assert _scan(["no stop sequences"], []) == ("no stop sequences", False)
+
+
+def test_user_turn_closes_the_upstream_stream():
+    huggingface_adapter = pytest.importorskip("developergpt.huggingface_adapter")
+    produced = []
+
+    def responses():
+        for text in ["Hello", " there.", "\nUs", "er: hi", " more", " tokens"]:
+            produced.append(text)
+            yield SimpleNamespace(token=SimpleNamespace(text=text, special=False))
+
+    upstream = responses()
+    shown = "".join(huggingface_adapter._stream_until_user_turn(upstream))
+    assert shown == "Hello there.\n"
+    assert produced[-1] == "er: hi"
+    assert upstream.gi_frame is None  # closed
@@ -0,0 +1,94 @@
+import pytest
+import tiktoken
+
+from developergpt import utils
+
+# byte-level encoding built in-process, the real encodings are downloaded on first use
+BYTE_ENCODING = tiktoken.Encoding(
+    name="bytes",
+    pat_str=r"\S+|\s+",
+    mergeable_ranks={bytes([i]): i for i in range(256)},
+    special_tokens={},
+)
+
+
+@pytest.fixture(autouse=True)
+def encoded_texts(monkeypatch):
+    encoded = []
+
+    def get_encoding(model):
+        return CountingEncoding(encoded)
+
+    monkeypatch.setattr(utils, "get_encoding", get_encoding)
+    return encoded
+
+
+class CountingEncoding:
+    def __init__(self, encoded: list):
+        self.encoded = encoded
+
+    def encode(self, text: str) -> list:
+        self.encoded.append(text)
+        return BYTE_ENCODING.encode(text)
+
+
+def _message(i: int) -> dict:
+    return {"role": "user", "content": f"message number {i}"}
+
+
+def test_running_total_matches_full_count():
+    history = utils.ChatHistory([_message(0)], "gpt-4-turbo")
+    history.append(_message(1))
+    history.extend([_message(2), _message(3)])
+    history.insert(1, _message(4))
+    history.pop(1)
+    history.pop(2)
+    history[0] = _message(5)
+    assert history.n_tokens == utils.count_msg_tokens(list(history), "gpt-4-turbo")
+
+
+def test_messages_are_encoded_once(encoded_texts):
+    messages, _ = utils.check_reduce_context(
+        [_message(0)], 10_000, "gpt-3.5-turbo", ctx_removal_index=1
+    )
+    for i in range(1, 50):
+        messages.append(_message(i))
+        messages, _ = utils.check_reduce_context(
+            messages, 10_000, "gpt-3.5-turbo", ctx_removal_index=1
+        )
+    # role and content of each message
+    assert len(encoded_texts) == 2 * 50
+
+
+def test_reduce_context_keeps_system_message():
+    system = {"role": "system", "content": "You are a helpful assistant."}
+    messages = [system] + [_message(i) for i in range(20)]
+    limit = utils.count_msg_tokens(messages[:5], "gpt-4-turbo")
+
+    reduced, n_tokens = utils.check_reduce_context(
+        messages, limit, "gpt-4-turbo", ctx_removal_index=1
+    )
+    assert reduced[0] == system
+    assert reduced[-1] == messages[-1]
+    assert n_tokens <= limit
+    assert n_tokens == utils.count_msg_tokens(list(reduced), "gpt-4-turbo")
+
+
+def test_turn_cost_is_flat_as_history_grows(encoded_texts):
+    def encoded_per_turn(history_length: int) -> list:
+        messages = utils.ChatHistory(
+            [_message(i) for i in range(history_length)], "gpt-3.5-turbo"
+        )
+        counts = []
+        for i in range(20):
+            n_encoded = len(encoded_texts)
+            messages.append(_message(i))
+            messages, _ = utils.check_reduce_context(
+                messages, 10**9, "gpt-3.5-turbo", ctx_removal_index=1
+            )
+            counts.append(len(encoded_texts) - n_encoded)
+        return counts
+
+    # only the new message is encoded (role and content), however long the history
+    # (the per-turn time is measured by benchmarks/bench_utils.py)
+    assert encoded_per_turn(10) == encoded_per_turn(5000) == [2] * 20
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+import tiktoken
+
+from developergpt import config, tokenizers, utils
+
+# byte-level encoding built in-process, the real encodings are downloaded on first use
+BYTE_ENCODING = tiktoken.Encoding(
+    name="bytes",
+    pat_str=r"\S+|\s+",
+    mergeable_ranks={bytes([i]): i for i in range(256)},
+    special_tokens={},
+)
+
+
+@pytest.fixture(autouse=True)
+def calibration(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, "get_encoding", lambda model: BYTE_ENCODING)
+    calibration = tokenizers.TokenCalibration(str(tmpdir / "calibration.json"))
+    monkeypatch.setattr(tokenizers, "calibration", lambda: calibration)
+    return calibration
+
+
+def _messages(n: int) -> list:
+    return [{"role": "user", "content": f"message number {i}"} for i in range(n)]
+
+
+def test_llama_models_count_with_their_own_tokenizer():
+    class FakeLlama:
+        def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False):
+            return text.split()
+
+    tokenizer = tokenizers.chat_tokenizer(config.MISTRAL_Q4, FakeLlama())
+    assert tokenizer.count("three word text") == 3
+    assert tokenizer.scale == 1.0
+    tokenizer.observe(100, 200)  # exact counts are never calibrated
+    assert tokenizer.scale == 1.0
+
+
+def test_calibration_corrects_the_estimate(calibration):
+    tokenizer = tokenizers.chat_tokenizer(config.HAIKU, None)
+    history = utils.ChatHistory(_messages(10), tokenizer)
+    estimate = history.n_tokens
+
+    # the provider reports 20% more prompt tokens than estimated
+    for _ in range(30):
+        tokenizer.observe(history.n_tokens, round(estimate * 1.2))
+    assert tokenizer.scale == pytest.approx(1.2, rel=0.01)
+    assert history.n_tokens == pytest.approx(estimate * 1.2, rel=0.01)
+
+    # the context budget is applied to the calibrated count
+    reduced, n_tokens = utils.check_reduce_context(
+        history, estimate, tokenizer, ctx_removal_index=1
+    )
+    assert n_tokens <= estimate
+    assert len(reduced) < 10
+
+
+def test_calibration_is_per_provider_and_persisted(calibration):
+    tokenizers.chat_tokenizer(config.HAIKU, None).observe(1000, 1500)
+    assert tokenizers.chat_tokenizer(config.SONNET, None).scale == 1.5
+    assert tokenizers.chat_tokenizer(config.GPT35, None).scale == 1.0
+
+    with open(calibration.path) as f:
+        assert json.load(f)["anthropic"] == {"factor": 1.5, "samples": 1}
+    assert tokenizers.TokenCalibration(calibration.path).factor("anthropic") == 1.5
+
+
+def test_outliers_are_bounded(calibration):
+    calibration.observe("openai", 100, 10_000)
+    assert calibration.factor("openai") == config.TOKEN_FACTOR_MAX
+    calibration.observe("openai", 100, 0)  # missing usage is ignored
+    assert calibration.entries["openai"]["samples"] == 1
@@ -0,0 +1,84 @@
+import time
+
+from developergpt import tuning
+
+HARDWARE = tuning.Hardware(physical_cores=4, logical_cores=8, available_ram=16 * 2**30)
+MODEL_SIZE = 6 * 2**30
+
+
+class FakeLlama:
+    """Stand-in for llama_cpp.Llama whose speed depends on the thread counts."""
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.closed = False
+
+    def tokenize(self, text: bytes) -> list:
+        return list(text)
+
+    def eval(self, tokens: list) -> None:
+        pass
+
+    def reset(self) -> None:
+        pass
+
+    def generate(self, tokens: list, temp: float):
+        # prompt evaluation is fastest with all logical cores, generation with 4 threads
+        time.sleep(0.04 / self.settings["n_threads_batch"])
+        while True:
+            yield 0
+            time.sleep(0.0005 * (1 + abs(self.settings["n_threads"] - 4)))
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def test_detect_hardware():
+    hardware = tuning.detect_hardware()
+    assert 1 <= hardware.physical_cores <= hardware.logical_cores
+
+
+def test_candidate_settings():
+    candidates = tuning.candidate_settings(HARDWARE, MODEL_SIZE)
+    assert sorted({c["n_threads"] for c in candidates}) == [2, 4, 8]
+    assert all(c["use_mlock"] for c in candidates)
+
+    low_ram = HARDWARE._replace(available_ram=8 * 2**30)
+    assert not any(
+        c["use_mlock"] for c in tuning.candidate_settings(low_ram, MODEL_SIZE)
+    )
+
+
+def test_benchmark_picks_fastest_settings():
+    loaded = []
+
+    def load(settings):
+        loaded.append(FakeLlama(settings))
+        return loaded[-1]
+
+    candidates = [
+        {"n_threads": n, "n_threads_batch": n, "n_batch": 512} for n in (2, 4, 8)
+    ]
+    results = tuning.benchmark(load, candidates)
+    assert [r.settings for r in results] == candidates
+    assert all(llm.closed for llm in loaded)
+    assert tuning.best_settings(results) == {
+        "n_threads": 4,
+        "n_threads_batch": 8,
+        "n_batch": 512,
+    }
+
+
+def test_store(tmpdir):
+    path = str(tmpdir / "tuning.json")
+    settings = {"n_threads": 4, "n_threads_batch": 8, "n_batch": 256}
+    tuning.TuningStore(path).put("model.gguf", HARDWARE, settings)
+
+    store = tuning.TuningStore(path)
+    assert store.get("model.gguf", HARDWARE) == settings
+    assert store.get("other.gguf", HARDWARE) is None
+    # tuned for different hardware (e.g. a resized VM)
+    assert store.get("model.gguf", HARDWARE._replace(logical_cores=16)) is None
+
+    assert store.remove("model.gguf")
+    assert tuning.TuningStore(path).get("model.gguf", HARDWARE) is None